@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+# Plays lots of games with a bot and reports how they went: how often it
+# wins, where it dies, and which monsters hurt it the most. Run it before and
+# after changing monsters.csv or rooms.csv to see what the change did. See
+# ld38/balance.py.
+#
+#   python balance.py                # 1000 games on every CPU
+#   python balance.py -n 100 -j 2    # 100 games on 2 CPUs
+import argparse
+import multiprocessing
+import sys
+
+from ld38.balance import MAX_TURNS, simulate_and_report
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Simulate Rogue Basement games")
+  parser.add_argument(
+    '-n', '--games', type=int, default=1000, help="how many games to play")
+  parser.add_argument(
+    '-s', '--seed', type=int, default=0,
+    help="seed of the first game; the rest follow in order")
+  parser.add_argument(
+    '-j', '--workers', type=int, default=None,
+    help="worker processes (default: one per CPU)")
+  parser.add_argument(
+    '--max-turns', type=int, default=MAX_TURNS,
+    help="call off games that take longer than this")
+  args = parser.parse_args()
+
+  print(simulate_and_report(args.games, args.seed, args.max_turns, args.workers))
+  return 0
+
+
+if __name__ == '__main__':
+  multiprocessing.freeze_support()
+  sys.exit(main())
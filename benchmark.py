@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+# Has a bot play a few games without opening a window and reports how fast
+# the game ran: turns per second, events per turn, and how the time was split
+# between the player's actions, FOV, monster AI and event dispatch. Run it
+# before and after a change to see whether the change made the game faster or
+# slower. See ld38/benchmark.py.
+#
+#   python benchmark.py                  # 3 games of up to 2000 turns
+#   python benchmark.py -n 10 --no-split # just turns per second, 10 games
+#   python benchmark.py --plan-together  # monsters plan their turns together
+import argparse
+import sys
+
+from ld38.benchmark import MAX_TURNS, NUM_GAMES, format_report, run_benchmark
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark Rogue Basement")
+  parser.add_argument(
+    '-n', '--games', type=int, default=NUM_GAMES, help="how many games to play")
+  parser.add_argument(
+    '-s', '--seed', type=int, default=0,
+    help="seed of the first game; the rest follow in order")
+  parser.add_argument(
+    '--max-turns', type=int, default=MAX_TURNS,
+    help="stop each game after this many turns")
+  parser.add_argument(
+    '--no-split', action='store_true',
+    help="don't play the games a second time to see where the time went")
+  parser.add_argument(
+    '--plan-together', action='store_true',
+    help="have monsters decide what to do before any of them moves")
+  args = parser.parse_args()
+
+  print(format_report(run_benchmark(
+    args.games, args.seed, args.max_turns, measure_parts=not args.no_split,
+    plan_turns_together=args.plan_together)))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -5,15 +5,64 @@
 # to have a class that grows new methods that quickly. Better to have functions
 # that operate on the class, which you can separate into different namespaces
 # later.
+from collections import namedtuple
+
 from clubsandwich.tilemap import CellOutOfBoundsError
 
 from .const import (
   EnumEventNames,
+  GOLD_TYPE_INDEX,
   terrain_types,
-  monster_types,
 )
 
 
+# When monsters plan their turns together (see LevelState.take_turns()), the
+# actions they take while planning are written down as Plans instead of done
+# right away. resolve_plans() does them afterwards.
+#
+# * action: the action function, like action_move
+# * entity: who's doing it
+# * args: the rest of the action function's arguments
+# * target: for moves, whoever was at the destination when the move was
+#   planned (usually nobody, or the player)
+Plan = namedtuple('Plan', ['action', 'entity', 'args', 'target'])
+
+
+# The data of an entity_took_damage event.
+#
+# * attacker: whoever did it
+# * amount: hit points the target actually lost, which is less than the
+#   attacker's strength if it didn't have that many left
+# * monster_type: the kind of monster to blame. For thrown rocks that's
+#   whoever threw them, not ROCK_IN_FLIGHT.
+Damage = namedtuple('Damage', ['attacker', 'amount', 'monster_type'])
+
+
+def _plan(level_state, action, entity, args, target=None):
+  level_state.plans.append(Plan(action, entity, args, target))
+  return True
+
+
+def resolve_plans(level_state, plans):
+  """
+  Do *plans*, in order. Each one was decided on without knowing about the
+  others, so a move only goes ahead if its destination still holds what it
+  held when the move was planned: nobody, or the entity it meant to attack.
+  Otherwise somebody got there first (earlier plans win), or the target got
+  away, and the entity stays put.
+  """
+  for plan in plans:
+    if level_state.player.position is None:
+      break
+    if plan.entity.position is None:
+      # Killed before its plan came up
+      continue
+    if (plan.action is action_move and
+        level_state.get_entity_at(plan.args[0]) is not plan.target):
+      continue
+    plan.action(level_state, plan.entity, *plan.args)
+
+
 def action_close(level_state, entity, position):
   """
   Have the entity close the door at the given cell
@@ -38,38 +87,19 @@ def action_throw(level_state, entity, item, target_position, speed):
   Have the entity throw an item at a specific position. "Speed" is number of
   moves per turn for the item in flight to take.
 
-  When an item is thrown, an entity is created with monster type
-  [ITEM_ID]_IN_FLIGHT. So for ROCK, you get a ROCK_IN_FLIGHT. As a long-term
-  design this isn't great because you have to specify every throwable item in
-  two places. But then again, the throwing mechanic in Rogue Basement where
-  thrown items move one tile per turn is generally weird, so I'm not too
+  The item doesn't become an entity while it's in the air. The level's
+  projectiles.Projectiles keeps track of it until it hits something or lands,
+  and uses the monster type [ITEM_ID]_IN_FLIGHT to draw it and talk about it.
+  So for ROCK, you get a ROCK_IN_FLIGHT. You have to specify every throwable
+  item in two places, but then again, the throwing mechanic in Rogue Basement
+  where thrown items move one tile per turn is generally weird, so I'm not too
   worried about you trying to copy this...
   """
-  path = list(entity.position.points_bresenham_to(target_position))
-  # first point on the path is probably the entity's current position, so
-  # skip it
-  while level_state.get_entity_at(path[0]) == entity:
-    path.pop(0)
-
-  if not level_state.get_can_move(entity, path[0]):
-    return False
-
-  entity_in_the_way = level_state.get_entity_at(path[0])
-  if entity_in_the_way:
+  if level_state.plans is not None:
+    return _plan(level_state, action_throw, entity, (item, target_position, speed))
+  if not level_state.projectiles.throw(entity, item, target_position, speed):
     return False
 
-  entity.inventory.remove(item)
-  mk_id = item.item_type.id + '_IN_FLIGHT'
-  rock_in_flight = level_state.create_entity(monster_types[mk_id], path[0], {
-    # Hack: first point is "None" because rock is already in first position
-    'path': [None] + path[1:],
-    'speed': speed,
-  })
-
-  ### Thrown object takes strength from thrower ###
-  rock_in_flight.stats['strength'] = entity.stats['strength']
-  rock_in_flight.inventory.append(item)
-
   if entity.is_player:
     # If the player threw the item, give monsters a chance to move
     level_state.fire_player_took_action_if_alive(entity.position)
@@ -81,6 +111,10 @@ def action_move(level_state, entity, position):
   depends on what is at *position*. If it's empty, the entity moves. If it's a
   door, the door opens. If it's another entity, then attack.
   """
+  if level_state.plans is not None:
+    return _plan(
+      level_state, action_move, entity, (position,),
+      level_state.get_entity_at(position))
   cell = level_state.tilemap.cell(position)
 
   target_entity = level_state.get_entity_at(position)
@@ -97,9 +131,7 @@ def action_move(level_state, entity, position):
     return True
 
   if level_state.get_can_move(entity, position):
-    del level_state.entity_by_position[entity.position]
-    entity.position = position
-    level_state.entity_by_position[position] = entity
+    level_state.move_entity(entity, position)
     level_state.fire(EnumEventNames.entity_moved, data=entity, entity=entity)
     if entity.is_player:
       # let monsters move
@@ -118,13 +150,17 @@ def action_move(level_state, entity, position):
       level_state.fire(EnumEventNames.entity_bumped, data=cell, entity=entity)
 
 
-def action_attack(level_state, a, b):
-  """Entity *a* attacks entity *b*"""
+def action_attack(level_state, a, b, monster_type=None):
+  """
+  Entity *a* attacks entity *b*. The damage counts against *monster_type*,
+  or *a*'s monster type if that's None.
+  """
   level_state.fire(EnumEventNames.entity_attacking, data=b, entity=a)
   level_state.fire(EnumEventNames.entity_attacked, data=a, entity=b)
-  b.state['hp'] -= a.stats['strength']
-  level_state.fire(EnumEventNames.entity_took_damage, data=a, entity=b)
-  if b.state['hp'] <= 0:
+  damage = Damage(a, min(a.strength, b.hp), monster_type or a.monster_type)
+  level_state.set_hp(b, b.hp - a.strength)
+  level_state.fire(EnumEventNames.entity_took_damage, data=damage, entity=b)
+  if b.hp <= 0:
     level_state.fire(EnumEventNames.entity_died, data=None, entity=b)
     p = b.position
     level_state.remove_entity(b)
@@ -134,31 +170,30 @@ def action_attack(level_state, a, b):
     for i in b.inventory:
       level_state.drop_item(i, p)
 
-    if b.is_player:
-      level_state.dispatcher.stop_propagation()
-
 
 def action_pickup_item(level_state, entity):
+  if level_state.plans is not None:
+    return _plan(level_state, action_pickup_item, entity, ())
   items = level_state.get_items_at(entity.position)
   if not items:
     return False
 
   # handle scoring
-  golds = [item for item in items if item.item_type.id == 'GOLD']
+  golds = [item for item in items if item.type_index == GOLD_TYPE_INDEX]
   if entity == level_state.player and golds:
     level_state.game_state.score += len(golds)
     level_state.fire(EnumEventNames.score_increased, data=None, entity=None)
 
   # pick things up
-  items = [item for item in items if item.item_type.id != 'GOLD']
+  items = [item for item in items if item.type_index != GOLD_TYPE_INDEX]
   entity.inventory.extend(items)
 
   if entity == level_state.player:
     # if player, pick up everything
-    del level_state.items_by_position[entity.position]
+    level_state.set_items_at(entity.position, [])
   else:
     # if an enemy, put the golds back!
-    level_state.items_by_position[entity.position] = golds
+    level_state.set_items_at(entity.position, golds)
 
   # the items are now positionless. fire the pickup events.
   for item in items:
@@ -0,0 +1,194 @@
+"""
+Playing lots of games with bot.Bot to see how hard the game is.
+
+The numbers that decide how hard Rogue Basement is live in monsters.csv
+(hp_max, strength, chance, difficulty) and rooms.csv (monster_density,
+item_density). After changing them, run ``python balance.py`` and compare
+the report with the one from before. Both use the same seeds, so the
+differences come from the change, not from luck.
+
+Each game runs in a HeadlessGame in a worker process, one per CPU by default.
+"""
+import os
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from statistics import mean, median
+
+from . import game_state
+from .batch import get_damage
+from .bot import Bot
+from .game_state import LEVEL_SIZE, NUM_LEVELS
+from .headless import HeadlessGame
+
+
+# Games that haven't ended after this many turns are called off, in case the
+# bot gets stuck
+MAX_TURNS = 5000
+
+OUTCOME_WON = 'won'
+OUTCOME_DIED = 'died'
+OUTCOME_TIMED_OUT = 'timed out'
+
+
+# How one game went.
+#
+# * depth: the level the game ended on
+# * deepest: the deepest level the player got to. It can be deeper than
+#   *depth*, since the stairs go both ways.
+# * death_quadrant: 'NW', 'NE', 'SW' or 'SE', the part of the level where the
+#   player died, or None
+# * damage_by_monster_type: ``{monster type ID: hit points}`` the player lost
+#   to each kind of monster. Thrown rocks count against whoever threw them.
+# * killed_by: monster type ID of the last thing to hurt the player, if they
+#   died
+GameResult = namedtuple('GameResult', [
+  'seed', 'outcome', 'turns', 'score', 'depth', 'deepest', 'death_quadrant',
+  'damage_by_monster_type', 'killed_by'])
+
+
+def get_quadrant(position):
+  """Which quarter of the level *position* is in, like ``'NW'``"""
+  return (
+    ('N' if position.y < LEVEL_SIZE.height // 2 else 'S') +
+    ('W' if position.x < LEVEL_SIZE.width // 2 else 'E'))
+
+
+def play_game(seed, max_turns=MAX_TURNS):
+  """Play the game with *seed* with a bot, and return a :py:class:`GameResult`"""
+  game = HeadlessGame(seed=seed)
+  bot = Bot()
+  damage_by_monster_type = Counter()
+  killed_by = None
+  last_position = game.level_state.player.position
+  deepest = 0
+
+  while not game.is_over and game.turn < max_turns:
+    last_position = game.level_state.player.position
+    game.submit(*bot.choose_command(game.level_state))
+    game.consume_events()
+    deepest = max(deepest, game.game_state.depth)
+    (_, damage) = get_damage(game.pop_events())
+    damage_by_monster_type.update(damage)
+    if damage:
+      killed_by = list(damage)[-1]
+
+  is_dead = game.level_state.player.position is None
+  if game.game_state.has_won:
+    outcome = OUTCOME_WON
+  elif is_dead:
+    outcome = OUTCOME_DIED
+  else:
+    outcome = OUTCOME_TIMED_OUT
+  return GameResult(
+    seed=seed,
+    outcome=outcome,
+    turns=game.turn,
+    score=game.game_state.score,
+    depth=game.game_state.depth,
+    deepest=deepest,
+    death_quadrant=get_quadrant(last_position) if is_dead else None,
+    damage_by_monster_type=dict(damage_by_monster_type),
+    killed_by=killed_by if is_dead else None)
+
+
+def _init_worker():
+  game_state.GENERATE_LEVELS_IN_BACKGROUND = False
+
+
+def _play_games(seeds, max_turns):
+  # Runs in a worker process. A few games per task keeps the overhead down.
+  return [play_game(seed, max_turns) for seed in seeds]
+
+
+def run_simulation(num_games, first_seed=0, max_turns=MAX_TURNS, workers=None,
+                   chunk_size=4):
+  """
+  Play games with seeds ``first_seed`` to ``first_seed + num_games - 1``,
+  spread over *workers* processes (default: one per CPU), and return their
+  :py:class:`GameResult` objects in seed order
+  """
+  seeds = list(range(first_seed, first_seed + num_games))
+  chunks = [seeds[i:i + chunk_size] for i in range(0, len(seeds), chunk_size)]
+  workers = workers or os.cpu_count() or 1
+  if workers == 1:
+    return _play_games(seeds, max_turns)
+  results = []
+  with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+    for chunk_results in executor.map(
+        _play_games, chunks, [max_turns] * len(chunks)):
+      results.extend(chunk_results)
+  return results
+
+
+def format_report(results, seconds=None):
+  """Returns a plain text summary of a list of :py:class:`GameResult`"""
+  n = len(results)
+  outcomes = Counter(r.outcome for r in results)
+  deaths = [r for r in results if r.outcome == OUTCOME_DIED]
+
+  def percent(count):
+    return '{:.1f}%'.format(100 * count / n) if n else '-'
+
+  lines = []
+  if seconds is None:
+    lines.append('{} games'.format(n))
+  else:
+    lines.append('{} games in {:.1f}s'.format(n, seconds))
+  lines.append('Won {}, died {}, timed out {}'.format(
+    percent(outcomes[OUTCOME_WON]),
+    percent(outcomes[OUTCOME_DIED]),
+    percent(outcomes[OUTCOME_TIMED_OUT])))
+  if not n:
+    return '\n'.join(lines)
+
+  lines.append('Turns: mean {:.0f}, median {:.0f}, max {}'.format(
+    mean(r.turns for r in results),
+    median(r.turns for r in results),
+    max(r.turns for r in results)))
+  if deaths:
+    lines.append('Turns survived by those who died: mean {:.0f}, median {:.0f}'.format(
+      mean(r.turns for r in deaths), median(r.turns for r in deaths)))
+  lines.append('Score: mean {:.1f}, median {:.0f}, max {}'.format(
+    mean(r.score for r in results),
+    median(r.score for r in results),
+    max(r.score for r in results)))
+
+  lines.append('')
+  lines.append('Deepest level reached:')
+  depths = Counter(r.deepest for r in results)
+  for depth in range(NUM_LEVELS):
+    lines.append('  {}: {}'.format(depth, percent(depths[depth])))
+
+  if deaths:
+    lines.append('')
+    lines.append('Deaths by level and quadrant:')
+    quadrants = ('NW', 'NE', 'SW', 'SE')
+    lines.append('  level ' + ''.join('{:>7}'.format(q) for q in quadrants))
+    by_place = Counter((r.depth, r.death_quadrant) for r in deaths)
+    for depth in range(NUM_LEVELS):
+      lines.append('  {:>5} '.format(depth) + ''.join(
+        '{:>7}'.format(by_place[(depth, q)]) for q in quadrants))
+
+  damage = Counter()
+  games_hurt_by = Counter()
+  for r in results:
+    damage.update(r.damage_by_monster_type)
+    games_hurt_by.update(r.damage_by_monster_type.keys())
+  killed_by = Counter(r.killed_by for r in deaths)
+  if damage:
+    lines.append('')
+    lines.append('Damage taken, by monster type:')
+    lines.append('  {:<16}{:>10}{:>10}{:>10}{:>8}'.format(
+      'monster', 'total', 'per game', 'in games', 'kills'))
+    for (monster_type_id, total) in damage.most_common():
+      lines.append('  {:<16}{:>10}{:>10.1f}{:>10}{:>8}'.format(
+        monster_type_id, total, total / n,
+        percent(games_hurt_by[monster_type_id]), killed_by[monster_type_id]))
+  return '\n'.join(lines)
+
+
+def simulate_and_report(num_games, first_seed=0, max_turns=MAX_TURNS, workers=None):
+  start = time.perf_counter()
+  results = run_simulation(num_games, first_seed, max_turns, workers)
+  return format_report(results, time.perf_counter() - start)
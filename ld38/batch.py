@@ -0,0 +1,411 @@
+"""
+Lots of games at once, for bots, training and balance testing.
+
+:py:class:`GameBatch` owns K independent games (see headless.py) and steps
+all of them with one call. Actions go in as an array of indexes into
+:py:data:`ACTIONS`, and everything comes out as NumPy arrays with one row per
+game, so the code using it never has to loop over games in Python itself::
+
+  batch = GameBatch(64, seed=1)
+  (stats, views) = batch.reset()
+  while True:
+    actions = np.random.randint(NUM_ACTIONS, size=64)
+    result = batch.step(actions)
+    ...
+
+Each game keeps its own copy of the random module's state and swaps it in
+while it's being stepped. So game *i* plays out exactly like a HeadlessGame
+with the same seed given the same commands, no matter how many other games
+are in the batch or which process they're in, and can be replayed (see
+replay.py). :py:meth:`GameBatch.get_seed` says what the seed was.
+
+With ``num_workers > 0``, the games are split between that many worker
+processes. The arrays live in shared memory, so stepping only sends a few
+bytes down a pipe to each worker; the observations are never pickled.
+"""
+import multiprocessing
+import random
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import game_state
+from .const import (
+  KEYS_TO_DIRECTIONS,
+  MONSTER_TYPE_INDEXES,
+  NOTHING_INDEX,
+  ROCK_TYPE_INDEX,
+)
+from .headless import HeadlessGame
+
+
+# Everything a player can do, as ``(command, direction)``. Actions are
+# indexes into this list.
+ACTIONS = (
+  [(d, None) for d in KEYS_TO_DIRECTIONS] +
+  [('GET', None), ('WAIT', None)] +
+  [('CLOSE', d) for d in KEYS_TO_DIRECTIONS] +
+  [('THROW', d) for d in KEYS_TO_DIRECTIONS])
+NUM_ACTIONS = len(ACTIONS)
+
+# Columns of the stats array
+STAT_NAMES = (
+  'turn', 'depth', 'score', 'hp', 'hp_max', 'x', 'y', 'rocks', 'is_dead',
+  'has_won')
+(STAT_TURN, STAT_DEPTH, STAT_SCORE, STAT_HP, STAT_HP_MAX, STAT_X, STAT_Y,
+ STAT_ROCKS, STAT_IS_DEAD, STAT_HAS_WON) = range(len(STAT_NAMES))
+
+# Each game's view is the square of cells within this many cells of the
+# player, with one layer per channel. Like the tilemap, it's indexed
+# ``[channel, x, y]``. 0 always means "nothing" or "don't know":
+#
+# * terrain: terrain index + 1 (see tilemap.TERRAIN_INDEXES) of cells the
+#   player remembers
+# * monster: monster type index + 1 (see const.MONSTER_TYPE_INDEXES)
+#   of monsters the player can see, and of things in flight (like
+#   ROCK_IN_FLIGHT) in cells without a monster
+# * item: item type index + 1 (see const.ITEM_TYPE_INDEXES) of the top
+#   item the player can see
+VIEW_RADIUS = 7
+VIEW_CHANNELS = ('terrain', 'monster', 'item')
+(CHANNEL_TERRAIN, CHANNEL_MONSTER, CHANNEL_ITEM) = range(len(VIEW_CHANNELS))
+VIEW_SIZE = VIEW_RADIUS * 2 + 1
+
+
+# What GameBatch.step() returns. Every array has one row per game.
+#
+# * stats: ``(K, len(STAT_NAMES))`` int32, see STAT_NAMES
+# * views: ``(K, len(VIEW_CHANNELS), VIEW_SIZE, VIEW_SIZE)`` int16
+# * rewards: ``(K,)`` int32, how much the score went up this step
+# * damage: ``(K,)`` int32, how many hit points the player lost this step
+# * dones: ``(K,)`` bool, whether the game ended this step. If
+#   *auto_reset* is on, that game has already been replaced by a new one,
+#   and *stats* and *views* are for the new one.
+BatchStep = namedtuple('BatchStep', ['stats', 'views', 'rewards', 'damage', 'dones'])
+
+
+def get_game_seed(batch_seed, game_index, episode):
+  """
+  The seed of the *episode*-th game played in slot *game_index*. It doesn't
+  depend on how the games are split between processes.
+  """
+  seed_sequence = np.random.SeedSequence([batch_seed, game_index, episode])
+  return int(seed_sequence.generate_state(1)[0])
+
+
+def get_damage(events):
+  """
+  Total damage done to the player by *events* (from HeadlessGame), and how
+  much of it each monster type did, as ``(total, {monster type ID: damage})``
+  """
+  total = 0
+  by_monster_type = {}
+  for (name, entity, data) in events:
+    if name != 'entity_took_damage' or entity[0] != 'PLAYER':
+      continue
+    # The event's data is an actions.Damage, which knows how many hit points
+    # the player really lost, and who threw the rock if it was a rock
+    (_, damage, monster_type_id) = data
+    total += damage
+    by_monster_type[monster_type_id] = (
+      by_monster_type.get(monster_type_id, 0) + damage)
+  return (total, by_monster_type)
+
+
+def _get_empty_arrays(num_games, allocate=np.zeros):
+  return {
+    'actions': allocate((num_games,), np.int16),
+    'stats': allocate((num_games, len(STAT_NAMES)), np.int32),
+    'views': allocate(
+      (num_games, len(VIEW_CHANNELS), VIEW_SIZE, VIEW_SIZE), np.int16),
+    'rewards': allocate((num_games,), np.int32),
+    'damage': allocate((num_games,), np.int32),
+    'dones': allocate((num_games,), np.bool_),
+  }
+
+
+class _Shard:
+  """
+  Some of the games in a batch: the ones from *start* up to *stop*. Writes
+  into its own rows of *arrays*. Runs either in the GameBatch's process or in
+  a worker.
+  """
+  def __init__(self, arrays, start, stop, seed, max_turns, auto_reset):
+    self.arrays = {k: v[start:stop] for (k, v) in arrays.items()}
+    self.start = start
+    self.seed = seed
+    self.max_turns = max_turns
+    self.auto_reset = auto_reset
+    self.games = [None] * (stop - start)
+    self.random_states = [None] * (stop - start)
+    self.episodes = [-1] * (stop - start)
+
+  def reset(self):
+    for i in range(len(self.games)):
+      self._start_game(i)
+    self.arrays['rewards'][:] = 0
+    self.arrays['damage'][:] = 0
+    self.arrays['dones'][:] = False
+
+  def step(self):
+    actions = self.arrays['actions']
+    stats = self.arrays['stats']
+    rewards = self.arrays['rewards']
+    damage = self.arrays['damage']
+    dones = self.arrays['dones']
+    outer_random_state = random.getstate()
+    try:
+      for (i, game) in enumerate(self.games):
+        if game.is_over:
+          # auto_reset is off, and this one ended on a previous step
+          rewards[i] = damage[i] = 0
+          dones[i] = True
+          continue
+        (command, direction) = ACTIONS[actions[i]]
+        random.setstate(self.random_states[i])
+        game.submit(command, direction)
+        game.consume_events()
+        self.random_states[i] = random.getstate()
+
+        score = game.game_state.score
+        rewards[i] = score - stats[i, STAT_SCORE]
+        damage[i] = get_damage(game.pop_events())[0]
+        dones[i] = game.is_over or (
+          self.max_turns is not None and game.turn >= self.max_turns)
+        if dones[i] and self.auto_reset:
+          self._start_game(i)
+        else:
+          self._observe(i)
+    finally:
+      random.setstate(outer_random_state)
+
+  def get_seed(self, i):
+    return self.games[i].game_state.seed
+
+  def _start_game(self, i):
+    self.episodes[i] += 1
+    seed = get_game_seed(self.seed, self.start + i, self.episodes[i])
+    outer_random_state = random.getstate()
+    try:
+      self.games[i] = HeadlessGame(seed=seed)
+      self.random_states[i] = random.getstate()
+    finally:
+      random.setstate(outer_random_state)
+    self._observe(i)
+
+  def _observe(self, i):
+    game = self.games[i]
+    game_state = game.game_state
+    level_state = game.level_state
+    player = level_state.player
+    position = player.position
+
+    row = self.arrays['stats'][i]
+    row[STAT_TURN] = game.turn
+    row[STAT_DEPTH] = game_state.depth
+    row[STAT_SCORE] = game_state.score
+    row[STAT_HP] = player.hp
+    row[STAT_HP_MAX] = player.hp_max
+    row[STAT_ROCKS] = sum(1 for item in player.inventory if item.type_index == ROCK_TYPE_INDEX)
+    row[STAT_IS_DEAD] = position is None
+    row[STAT_HAS_WON] = game_state.has_won
+
+    view = self.arrays['views'][i]
+    view[:] = 0
+    if position is None:
+      row[STAT_X] = row[STAT_Y] = -1
+      return
+    (row[STAT_X], row[STAT_Y]) = (position.x, position.y)
+
+    # Clip the view to the map, and work out where that lands in the view.
+    # Everything here comes straight out of LevelState's grids.
+    (width, height) = level_state.terrain_ids.shape
+    x0 = max(position.x - VIEW_RADIUS, 0)
+    y0 = max(position.y - VIEW_RADIUS, 0)
+    x1 = min(position.x + VIEW_RADIUS + 1, width)
+    y1 = min(position.y + VIEW_RADIUS + 1, height)
+    (dx, dy) = (VIEW_RADIUS - position.x, VIEW_RADIUS - position.y)
+    (map_x, map_y) = (slice(x0, x1), slice(y0, y1))
+    (view_x, view_y) = (slice(x0 + dx, x1 + dx), slice(y0 + dy, y1 + dy))
+
+    remembered = level_state.remembered_mask[map_x, map_y]
+    visible = level_state.visible_mask[map_x, map_y]
+    view[CHANNEL_TERRAIN, view_x, view_y] = np.where(
+      remembered, level_state.terrain_ids[map_x, map_y] + 1, 0)
+    view[CHANNEL_MONSTER, view_x, view_y] = np.where(
+      visible, level_state.entity_type_ids[map_x, map_y] + 1, 0)
+    # Thrown things aren't in the grids, since they aren't entities
+    for (point, monster_type) in level_state.projectiles.monster_type_by_position.items():
+      if (x0 <= point.x < x1 and y0 <= point.y < y1 and
+          level_state.visible_mask[point.x, point.y] and
+          level_state.entity_type_ids[point.x, point.y] == NOTHING_INDEX):
+        view[CHANNEL_MONSTER, point.x + dx, point.y + dy] = (
+          MONSTER_TYPE_INDEXES[monster_type.id] + 1)
+    # The player is always in the middle, so leave them out
+    view[CHANNEL_MONSTER, VIEW_RADIUS, VIEW_RADIUS] = 0
+    view[CHANNEL_ITEM, view_x, view_y] = np.where(
+      visible, level_state.item_type_ids[map_x, map_y] + 1, 0)
+
+
+def _worker_main(connection, shm_names, num_games, start, stop, seed,
+                 max_turns, auto_reset):
+  game_state.GENERATE_LEVELS_IN_BACKGROUND = False
+  blocks = {k: shared_memory.SharedMemory(name=name) for (k, name) in shm_names.items()}
+  empty = _get_empty_arrays(num_games, allocate=np.empty)
+  arrays = {
+    k: np.ndarray(empty[k].shape, empty[k].dtype, buffer=blocks[k].buf)
+    for k in blocks}
+  shard = _Shard(arrays, start, stop, seed, max_turns, auto_reset)
+  try:
+    while True:
+      (message, arg) = connection.recv()
+      if message == 'step':
+        shard.step()
+        connection.send(None)
+      elif message == 'reset':
+        shard.reset()
+        connection.send(None)
+      elif message == 'get_seed':
+        connection.send(shard.get_seed(arg - start))
+      elif message == 'close':
+        break
+  finally:
+    # Drop the views before closing, or SharedMemory complains
+    del shard, arrays
+    for block in blocks.values():
+      block.close()
+    connection.close()
+
+
+class GameBatch:
+  """
+  *num_games* games, stepped together. Pass *seed* to get the same games
+  every time.
+
+  * *max_turns*: end games after this many turns even if nobody has died,
+    so a bot that's stuck doesn't hold up the batch forever.
+  * *auto_reset*: when a game ends, start a new one in its place right away.
+    Otherwise it stays over, and reports ``done`` every step, until
+    :py:meth:`reset`.
+  * *num_workers*: split the games between this many processes. 0 means
+    run them all in this one.
+
+  The arrays :py:meth:`step` returns are reused by the next step, so copy
+  them if you want to keep them. Call :py:meth:`close` (or use ``with``) when
+  you're done, to stop the workers.
+  """
+  def __init__(self, num_games, seed=None, max_turns=None, auto_reset=True,
+               num_workers=0):
+    assert num_games >= 1
+    self.num_games = num_games
+    self.seed = random.getrandbits(32) if seed is None else seed
+    self._blocks = []
+    self._workers = []
+    # (start, stop) of each worker's games
+    self._ranges = []
+
+    if num_workers <= 0:
+      self._arrays = _get_empty_arrays(num_games)
+      self._shard = _Shard(
+        self._arrays, 0, num_games, self.seed, max_turns, auto_reset)
+      self.reset()
+      return
+
+    self._shard = None
+    self._arrays = {}
+    shm_names = {}
+    for (k, empty) in _get_empty_arrays(num_games, allocate=np.empty).items():
+      block = shared_memory.SharedMemory(create=True, size=max(empty.nbytes, 1))
+      self._blocks.append(block)
+      self._arrays[k] = np.ndarray(empty.shape, empty.dtype, buffer=block.buf)
+      shm_names[k] = block.name
+
+    num_workers = min(num_workers, num_games)
+    bounds = np.linspace(0, num_games, num_workers + 1).astype(int)
+    for (start, stop) in zip(bounds[:-1], bounds[1:]):
+      (connection, worker_connection) = multiprocessing.Pipe()
+      worker = multiprocessing.Process(
+        target=_worker_main,
+        args=(worker_connection, shm_names, num_games, int(start), int(stop),
+              self.seed, max_turns, auto_reset))
+      worker.start()
+      worker_connection.close()
+      self._workers.append((worker, connection))
+      self._ranges.append((int(start), int(stop)))
+    self.reset()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  @property
+  def stats(self):
+    return self._arrays['stats']
+
+  @property
+  def views(self):
+    return self._arrays['views']
+
+  def reset(self):
+    """Start new games in every slot. Returns ``(stats, views)``."""
+    self._run('reset')
+    return (self._arrays['stats'], self._arrays['views'])
+
+  def step(self, actions):
+    """
+    Do ``ACTIONS[actions[i]]`` in game *i*, for every game, and let the
+    monsters respond. Returns a :py:class:`BatchStep`.
+    """
+    actions = np.asarray(actions)
+    if actions.shape != (self.num_games,):
+      raise ValueError("Expected {} actions, got shape {}".format(
+        self.num_games, actions.shape))
+    if actions.min() < 0 or actions.max() >= NUM_ACTIONS:
+      raise ValueError("Actions must be from 0 to {}".format(NUM_ACTIONS - 1))
+    self._arrays['actions'][:] = actions
+    self._run('step')
+    return BatchStep(
+      stats=self._arrays['stats'],
+      views=self._arrays['views'],
+      rewards=self._arrays['rewards'],
+      damage=self._arrays['damage'],
+      dones=self._arrays['dones'])
+
+  def get_seed(self, game_index):
+    """The seed of the game in slot *game_index* right now"""
+    if self._shard is not None:
+      return self._shard.get_seed(game_index)
+    for ((start, stop), (_, connection)) in zip(self._ranges, self._workers):
+      if start <= game_index < stop:
+        connection.send(('get_seed', game_index))
+        return connection.recv()
+    raise IndexError("No such game: {!r}".format(game_index))
+
+  def close(self):
+    for (worker, connection) in self._workers:
+      try:
+        connection.send(('close', None))
+      except (BrokenPipeError, OSError):
+        pass
+    for (worker, connection) in self._workers:
+      worker.join()
+      connection.close()
+    self._workers = []
+    self._arrays = {}
+    for block in self._blocks:
+      block.close()
+      block.unlink()
+    self._blocks = []
+
+  def _run(self, message):
+    if self._shard is not None:
+      getattr(self._shard, message)()
+      return
+    # Get every worker started before waiting for any of them
+    for (_, connection) in self._workers:
+      connection.send((message, None))
+    for (_, connection) in self._workers:
+      connection.recv()
@@ -5,13 +5,11 @@ import random
 import weakref
 from collections import deque
 from enum import Enum
-from uuid import uuid4
 
 from clubsandwich.geom import Size, Point
 from clubsandwich.tilemap import TileMap
 
 from .actions import (
-  action_attack,
   action_pickup_item,
   action_move,
   action_throw,
@@ -19,7 +17,9 @@ from .actions import (
 from .level_generator import generate_dungeon
 from .const import (
   EnumEventNames,
+  EnumFeature,
   EnumMonsterMode,
+  ROCK_TYPE_INDEX,
 )
 from .entity import Item
 
@@ -53,8 +53,18 @@ class Behavior:
   def level_state(self):
     return self._level_state()
 
+  # Behaviors that respond to player_took_action don't hear about it from the
+  # dispatcher. LevelState.scheduler calls them when it's their entity's turn,
+  # which for most monsters is every time the player takes an action. See
+  # scheduler.py.
+  @property
+  def takes_turns(self):
+    return EnumEventNames.player_took_action in self.event_names
+
   def add_to_event_dispatcher(self, dispatcher):
     for name in self.event_names:
+      if name == EnumEventNames.player_took_action:
+        continue
       # Subscribe to events for all entities.
       # This is a pretty "meh" design decision and the biggest shortcoming of
       # the behavior system.
@@ -62,6 +72,8 @@ class Behavior:
 
   def remove_from_event_dispatcher(self, dispatcher):
     for name in self.event_names:
+      if name == EnumEventNames.player_took_action:
+        continue
       dispatcher.remove_subscriber(self, name, None)
 
 
@@ -98,6 +110,53 @@ class CompositeBehavior(Behavior):
     return handler
 
 
+# The level generator annotates the corridors between areas of different
+# difficulty with these. The game draws them glowing.
+TRANSITION_ANNOTATIONS = {'transition-1-2', 'transition-2-3', 'transition-3-4'}
+
+
+# For "balance", replenish the player's health between areas. This was added
+# in the last hour or so of the compo, as a hack in GameMainScene. It lives
+# here now so it happens whether or not anybody is drawing the game (when a
+# turn journal is replayed, for example).
+@behavior('heal_in_transitions')
+class HealInTransitionsBehavior(Behavior):
+  def __init__(self, entity, level_state):
+    super().__init__(entity, level_state, [EnumEventNames.entity_moved])
+
+  def on_entity_moved(self, event):
+    if event.entity is not self.entity:
+      return False
+    cell = self.level_state.tilemap.cell(self.entity.position)
+    if cell.annotations & TRANSITION_ANNOTATIONS:
+      self.level_state.set_hp(self.entity, self.entity.hp_max)
+    # Let the player's other behaviors see the move too
+    return False
+
+
+# Stepping on stairs takes the player to another level. That can't happen in
+# the middle of handling the old level's events, so this just tells the
+# GameState, and whoever is running the game calls GameState.take_stairs()
+# once the events are done.
+@behavior('use_stairs')
+class UseStairsBehavior(Behavior):
+  def __init__(self, entity, level_state):
+    super().__init__(entity, level_state, [EnumEventNames.entity_moved])
+
+  def on_entity_moved(self, event):
+    if event.entity is not self.entity:
+      return False
+    game_state = self.level_state.game_state
+    feature = self.level_state.tilemap.cell(self.entity.position).feature
+    if feature == EnumFeature.STAIRS_DOWN:
+      game_state.pending_stairs = feature
+    # The stairs up on the first level go back to the wizard's house, which
+    # you can't do until the job is done.
+    elif feature == EnumFeature.STAIRS_UP and game_state.depth > 0:
+      game_state.pending_stairs = feature
+    return False
+
+
 # Superclass for behaviors that simply respond to the player's movements
 class StandardEnemyBehavior(Behavior):
   def __init__(self, entity, level_state):
@@ -164,13 +223,13 @@ class PickUpRocksBehavior(StandardEnemyBehavior):
     self.entity.mode = EnumMonsterMode.DEFAULT
 
     for i in self.level_state.get_items_at(self.entity.position):
-      if i.item_type.id == 'ROCK':
+      if i.type_index == ROCK_TYPE_INDEX:
         action_pickup_item(self.level_state, self.entity)
         return True
 
     for p in possibilities:
       for i in self.level_state.get_items_at(p):
-        if i.item_type.id == 'ROCK':
+        if i.type_index == ROCK_TYPE_INDEX:
           action_move(self.level_state, self.entity, p)
           return True
     return False
@@ -268,52 +327,12 @@ class ThrowRockSlowBehavior(StandardEnemyBehavior):
 
     if self.entity.behavior_state['throw_rock_cooldown'] <= 0:
       try:
-        item = next(item for item in self.entity.inventory if item.item_type.id == 'ROCK')
+        item = next(item for item in self.entity.inventory if item.type_index == ROCK_TYPE_INDEX)
       except StopIteration:
         item = None
       if not item:
-        print("Can't throw, no more rocks in inventory")
         return False
 
       self.entity.behavior_state['throw_rock_cooldown'] = 6
       action_throw(self.level_state,
         self.entity, item, self.level_state.player.position, self.rock_speed)
-
-
-# Thrown rocks are entities! This behavior moves them along a predetermined
-# set of points (computed when the rock was thrown) until they hit the end of
-# their path, or they are attacked. 
-@behavior('path_until_hit')
-class PathUntilHitBehavior(StandardEnemyBehavior):
-  def _drop(self, point):
-    # The pathing entity is assumed to be carrying exactly one inventory item:
-    # the item that was thrown.
-    self.level_state.drop_item(self.entity.inventory.pop(0), point, entity=self.entity)
-    self.level_state.remove_entity(self.entity)
-
-  def _move_one(self):
-    p = self.entity.position
-    path = self.entity.behavior_state.get('path', None)
-    if path:
-      next_point = path.pop(0)
-      if next_point is None:
-        # See hack in actions.action_throw; this is a special case for the first
-        # point. Basically a "wait" instruction.
-        return True
-      else:
-        entity_to_hit = self.level_state.get_entity_at(next_point)
-        if entity_to_hit:
-          action_attack(self.level_state, self.entity, entity_to_hit)
-          self._drop(next_point)
-        elif self.level_state.get_is_terrain_passable(next_point):
-          action_move(self.level_state, self.entity, next_point)
-          return True
-    else:
-      # If no remaining points, drop
-      self._drop(self.entity.position)
-      return True
-
-  def on_player_took_action(self, event):
-    for _ in range(self.entity.behavior_state['speed']):
-      self._move_one()
-    return True
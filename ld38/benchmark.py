@@ -0,0 +1,224 @@
+"""
+How fast the game runs without a window, played by bot.Bot.
+
+Replays (see replay.py) are the best benchmark for one particular game, but
+somebody has to play it first. The bot plays like a person would, more or
+less: it walks down corridors, opens doors, fights, throws rocks and picks
+things up, so its games exercise the parts of the game a real player does.
+And since the game only depends on its seed and its commands, the same seeds
+give the same games every time, until the game itself changes.
+
+:py:func:`run_benchmark` plays a few games twice. The first time nothing
+extra is measured, to get honest turns per second. The second time, the
+interesting functions are wrapped in a :py:class:`Stopwatch` to find out
+where the time went:
+
+* bot: Bot.choose_command(). Not part of the game, so it's left out of the
+  turns per second.
+* player: commands.perform_command(), minus FOV.
+* FOV: LevelState.update_los_cache().
+* AI: behavior.py's event handlers, i.e. monsters deciding what to do and
+  doing it, plus moving rocks in flight (Projectiles.advance()), minus FOV.
+* dispatch: LevelState.consume_events() minus all of the above: the event
+  queue, EventDispatcher finding subscribers, the scheduler working out whose
+  turn it is, and the journal.
+* levels: going down the stairs, including generating the next level.
+* other: the rest, mostly the loop in this file.
+
+With *plan_turns_together*, monsters plan their turns in two phases (see
+LevelState.take_turns()). The games come out different, so compare it with
+itself.
+
+``python benchmark.py`` does it from the command line.
+"""
+import functools
+import time
+from collections import Counter, namedtuple
+from contextlib import ExitStack, contextmanager
+
+from . import game_state, level_state
+from .behavior import Behavior
+from .bot import Bot
+from .game_state import GameState
+from .headless import HeadlessGame
+from .level_state import LevelState
+from .projectiles import Projectiles
+
+
+NUM_GAMES = 3
+MAX_TURNS = 2000
+
+PARTS = ('bot', 'player', 'FOV', 'AI', 'dispatch', 'levels', 'other')
+
+
+# * turns_per_second: game turns per second, not counting time spent in the bot
+# * seconds_by_part: ``{part: seconds}`` for each of :py:data:`PARTS`, or None
+#   if it wasn't measured
+BenchmarkResult = namedtuple('BenchmarkResult', [
+  'games', 'turns', 'events', 'seconds', 'bot_seconds', 'turns_per_second',
+  'events_per_turn', 'seconds_by_part'])
+
+
+class Stopwatch:
+  """
+  Adds up the time spent in functions wrapped with :py:meth:`wrap`, by part.
+  When a wrapped function calls another one, the time counts for the inner
+  one only, so the parts add up to the total.
+  """
+  def __init__(self):
+    self.seconds_by_part = Counter()
+    self._parts = []
+    self._last_time = None
+
+  def _switch(self):
+    now = time.perf_counter()
+    if self._parts:
+      self.seconds_by_part[self._parts[-1]] += now - self._last_time
+    self._last_time = now
+
+  def wrap(self, part, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      self._switch()
+      self._parts.append(part)
+      try:
+        return function(*args, **kwargs)
+      finally:
+        self._switch()
+        self._parts.pop()
+    return wrapper
+
+
+@contextmanager
+def _patch(owner, name, value):
+  original = getattr(owner, name)
+  setattr(owner, name, value)
+  try:
+    yield
+  finally:
+    setattr(owner, name, original)
+
+
+def _get_behavior_handlers():
+  # Yields (class, method name) for every event handler of every behavior.
+  # CompositeBehavior's handlers are made per instance out of its
+  # sub-behaviors' handlers, so those are covered too.
+  classes = [Behavior]
+  while classes:
+    cls = classes.pop()
+    classes.extend(cls.__subclasses__())
+    for name in list(vars(cls)):
+      if name.startswith('on_'):
+        yield (cls, name)
+
+
+def _count_events(stack):
+  # Patches LevelState.fire() to count events, and returns the count so far
+  # as a one-item list
+  count = [0]
+  fire = LevelState.fire
+
+  def counting_fire(*args, **kwargs):
+    count[0] += 1
+    return fire(*args, **kwargs)
+  stack.enter_context(_patch(LevelState, 'fire', counting_fire))
+  return count
+
+
+def _time_parts(stack, stopwatch):
+  def wrap(owner, name, part):
+    stack.enter_context(
+      _patch(owner, name, stopwatch.wrap(part, getattr(owner, name))))
+
+  wrap(Bot, 'choose_command', 'bot')
+  wrap(HeadlessGame, 'submit', 'player')
+  wrap(LevelState, 'update_los_cache', 'FOV')
+  for (cls, name) in _get_behavior_handlers():
+    wrap(cls, name, 'AI')
+  wrap(Projectiles, 'advance', 'AI')
+  wrap(LevelState, 'consume_events', 'dispatch')
+  wrap(GameState, 'take_stairs', 'levels')
+
+
+def _play_games(seeds, max_turns, plan_turns_together, stopwatch=None):
+  # Returns (turns, events, seconds, bot seconds)
+  turns = 0
+  seconds = 0
+  bot_seconds = 0
+  with ExitStack() as stack:
+    # Generating levels in another process would make the numbers depend on
+    # how busy the machine is
+    stack.enter_context(_patch(game_state, 'GENERATE_LEVELS_IN_BACKGROUND', False))
+    stack.enter_context(
+      _patch(level_state, 'PLAN_TURNS_TOGETHER', plan_turns_together))
+    events = _count_events(stack)
+    if stopwatch is not None:
+      _time_parts(stack, stopwatch)
+
+    for seed in seeds:
+      game = HeadlessGame(seed=seed, collect_events=False)
+      bot = Bot()
+      start = time.perf_counter()
+      while not game.is_over and game.turn < max_turns:
+        bot_start = time.perf_counter()
+        command = bot.choose_command(game.level_state)
+        bot_seconds += time.perf_counter() - bot_start
+        game.submit(*command)
+        game.consume_events()
+      seconds += time.perf_counter() - start
+      turns += game.turn
+  return (turns, events[0], seconds, bot_seconds)
+
+
+def run_benchmark(num_games=NUM_GAMES, first_seed=0, max_turns=MAX_TURNS,
+                  measure_parts=True, plan_turns_together=False):
+  """
+  Have the bot play games with seeds ``first_seed`` to
+  ``first_seed + num_games - 1``, at most *max_turns* turns each, and return
+  a :py:class:`BenchmarkResult`. With *measure_parts*, play them all again to
+  see where the time went.
+  """
+  seeds = list(range(first_seed, first_seed + num_games))
+  (turns, events, seconds, bot_seconds) = _play_games(
+    seeds, max_turns, plan_turns_together)
+  game_seconds = seconds - bot_seconds
+
+  seconds_by_part = None
+  if measure_parts:
+    stopwatch = Stopwatch()
+    (_, _, timed_seconds, _) = _play_games(
+      seeds, max_turns, plan_turns_together, stopwatch)
+    seconds_by_part = {part: stopwatch.seconds_by_part[part] for part in PARTS}
+    seconds_by_part['other'] = max(
+      0, timed_seconds - sum(stopwatch.seconds_by_part.values()))
+
+  return BenchmarkResult(
+    games=num_games,
+    turns=turns,
+    events=events,
+    seconds=seconds,
+    bot_seconds=bot_seconds,
+    turns_per_second=turns / game_seconds if game_seconds else float('inf'),
+    events_per_turn=events / turns if turns else 0,
+    seconds_by_part=seconds_by_part)
+
+
+def format_report(result):
+  """Returns a plain text summary of a :py:class:`BenchmarkResult`"""
+  lines = [
+    '{} games, {} turns in {:.2f}s ({:.2f}s of it in the bot)'.format(
+      result.games, result.turns, result.seconds, result.bot_seconds),
+    'Turns per second: {:.0f}'.format(result.turns_per_second),
+    'Events per turn: {:.1f}'.format(result.events_per_turn),
+  ]
+  if result.seconds_by_part is not None:
+    total = sum(result.seconds_by_part.values())
+    lines.append('')
+    lines.append('Time by part (measured separately, so a bit slower):')
+    for part in PARTS:
+      seconds = result.seconds_by_part[part]
+      lines.append('  {:<10}{:>8.2f}s{:>7.1f}%{:>9.0f}us/turn'.format(
+        part, seconds,
+        100 * seconds / total if total else 0,
+        1000000 * seconds / result.turns if result.turns else 0))
+  return '\n'.join(lines)
@@ -0,0 +1,143 @@
+"""
+A player that plays by itself, for simulations (see balance.py).
+
+It only looks at things the player could know: what's remembered and
+what's visible right now, through LevelState's grids. It isn't very smart:
+
+1. Hit anything next to it.
+2. Throw a rock at any monster in a straight line (one of the eight
+   directions), if it has one and nothing is in the way.
+3. If a monster is two steps away, wait a turn or two for it. Whoever hits
+   first stuns the other, so it's better to be the one standing still.
+4. Pick up whatever it's standing on, so it gets rocks and gold.
+5. Walk to the nearest item it has seen.
+6. Walk to the nearest place it hasn't seen yet, opening doors on the way.
+7. When there's nothing left to see, take the stairs down.
+
+It never steps on the stairs up, since going back up a level doesn't get
+it anywhere.
+
+It's also the reference player for benchmark.py, since it does a bit of
+everything the game can do.
+"""
+import numpy as np
+
+from .const import KEYS_TO_DIRECTIONS, NOTHING_INDEX, ROCK_TYPE_INDEX
+from .pathing import get_direction_to_nearest, get_monster_mask
+from .tilemap import TERRAINS_BY_INDEX
+
+
+# How long to wait for a monster that's two steps away. Some of them never
+# come any closer.
+MAX_TURNS_TO_WAIT = 2
+
+# Don't bother throwing at things further away than this. Rocks fly two cells
+# a turn, so a far away monster has time to step out of the way.
+MAX_THROW_DISTANCE = 6
+
+# Terrain a thrown rock flies over
+_WALKABLE_BY_TERRAIN_INDEX = np.array([t.walkable for t in TERRAINS_BY_INDEX])
+
+
+def _get_square(shape, x, y, radius):
+  square = np.zeros(shape, dtype=np.bool_)
+  square[max(x - radius, 0):x + radius + 1, max(y - radius, 0):y + radius + 1] = True
+  return square
+
+
+def get_throw_direction(level_state, monsters):
+  """
+  The direction to throw a rock in to hit a monster in the *monsters* mask,
+  or ``None``. Only straight lines count, with nothing in the way and the
+  monster at least two cells off (next to the player, just hit it).
+  """
+  position = level_state.player.position
+  (width, height) = monsters.shape
+  terrain_ids = level_state.terrain_ids
+  entity_type_ids = level_state.entity_type_ids
+  for (direction, delta) in KEYS_TO_DIRECTIONS.items():
+    for distance in range(1, MAX_THROW_DISTANCE + 1):
+      (x, y) = (position.x + delta.x * distance, position.y + delta.y * distance)
+      if not (0 <= x < width and 0 <= y < height):
+        break
+      if not _WALKABLE_BY_TERRAIN_INDEX[terrain_ids[x, y]]:
+        break
+      if monsters[x, y] and distance > 1:
+        return direction
+      if entity_type_ids[x, y] != NOTHING_INDEX:
+        break
+  return None
+
+
+class Bot:
+  """
+  Call :py:meth:`choose_command` every turn and do what it says with
+  commands.perform_command() (or HeadlessGame.submit()).
+  """
+  def __init__(self):
+    self.turns_waited = 0
+    # Where it last saw items, on the level it's on. An item can go out of
+    # view after one step toward it, and if the bot forgot about it, it would
+    # turn around, see it again, and go back and forth forever.
+    self._items_seen = None
+    self._items_seen_level_id = None
+
+  def choose_command(self, level_state):
+    """Returns ``(command, direction)``"""
+    player = level_state.player
+    position = player.position
+    (x, y) = (position.x, position.y)
+    self._update_items_seen(level_state)
+
+    monsters = get_monster_mask(level_state)
+    neighbors = _get_square(monsters.shape, x, y, 1)
+    if (monsters & neighbors).any():
+      # Moving into a monster attacks it
+      return (get_direction_to_nearest(level_state, monsters & neighbors), None)
+    if any(item.type_index == ROCK_TYPE_INDEX for item in player.inventory):
+      direction = get_throw_direction(level_state, monsters)
+      if direction is not None:
+        return ('THROW', direction)
+    if (monsters & _get_square(monsters.shape, x, y, 2)).any():
+      if self.turns_waited < MAX_TURNS_TO_WAIT:
+        self.turns_waited += 1
+        return ('WAIT', None)
+    else:
+      self.turns_waited = 0
+
+    if level_state.get_items_at(position):
+      return ('GET', None)
+
+    stairs_up = np.zeros_like(level_state.remembered_mask)
+    stairs_up_point = level_state.tilemap.points_of_interest['stairs_up']
+    stairs_up[stairs_up_point.x, stairs_up_point.y] = True
+    for goals in self._get_goals(level_state):
+      direction = get_direction_to_nearest(level_state, goals, avoid=stairs_up)
+      if direction is not None:
+        return (direction, None)
+      if goals[x, y]:
+        # Already there, which can only be the stairs down. Stairs are taken
+        # by stepping onto them, so step off, and come back next turn.
+        direction = get_direction_to_nearest(level_state, ~goals, avoid=stairs_up)
+        if direction is not None:
+          return (direction, None)
+    return ('WAIT', None)
+
+  def _get_goals(self, level_state):
+    # In order of preference. Generator, so later ones are only computed if
+    # they're needed.
+    yield self._items_seen
+    yield ~level_state.remembered_mask
+    stairs = np.zeros_like(level_state.remembered_mask)
+    stairs_down = level_state.tilemap.points_of_interest['stairs_down']
+    if level_state.get_can_player_remember(stairs_down):
+      stairs[stairs_down.x, stairs_down.y] = True
+    yield stairs
+
+  def _update_items_seen(self, level_state):
+    visible = level_state.visible_mask
+    if self._items_seen_level_id != level_state.level_id:
+      self._items_seen = np.zeros_like(visible)
+      self._items_seen_level_id = level_state.level_id
+    self._items_seen = (
+      (self._items_seen & ~visible) | (visible & (level_state.item_type_ids >= 0)))
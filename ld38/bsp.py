@@ -0,0 +1,172 @@
+"""
+Binary space partitioning, for the level generator.
+
+This does exactly what clubsandwich.generators.RandomBSPTree does, and
+makes the same calls to the random functions in the same order, so a seed
+still makes the same level. The clubsandwich version also knows how to draw
+itself, so importing it loads BearLibTerminal, and the level generator has to
+work in processes that don't have a terminal (see headless.py).
+"""
+import weakref
+from random import randrange
+
+from clubsandwich.geom import Point, Rect, Size
+
+
+class BSPNode:
+  """
+  Node in a binary space partitioning tree. Same interface as
+  clubsandwich.generators.BSPNode.
+
+  .. py:attribute:: rect
+
+    Rect represented by this node
+
+  .. py:attribute:: is_horz
+
+    ``True`` iff this node is divided down its Y axis; ``False`` otherwise
+
+  .. py:attribute:: value
+
+    Where this node is split between its two children, or ``None``
+
+  .. py:attribute:: child_a
+  .. py:attribute:: child_b
+
+    Left and right children (horizontal), or top and bottom (vertical)
+
+  .. py:attribute:: level
+
+    How many levels of parents this node has
+
+  .. py:attribute:: data
+
+    Dict for the level generator's use
+  """
+  def __init__(self, rect, is_horz=True, value=None, level=0):
+    self.parent_weakref = lambda: None
+    self.rect = rect
+    self.level = level
+    self.is_horz = is_horz
+    self.value = value
+    self.child_a = None
+    self.child_b = None
+    self.data = {}
+
+  @property
+  def max_value(self):
+    if self.is_horz:
+      return self.rect.size.width - 1
+    else:
+      return self.rect.size.height - 1
+
+  @property
+  def rect_a(self):
+    if self.is_horz:
+      return Rect(self.rect.origin, Size(self.value, self.rect.height))
+    else:
+      return Rect(self.rect.origin, Size(self.rect.width, self.value))
+
+  @property
+  def rect_b(self):
+    if self.is_horz:
+      return Rect(
+        self.rect.origin + Point(self.value + 1, 0),
+        Size(self.rect.width - self.value - 1, self.rect.height))
+    else:
+      return Rect(
+        self.rect.origin + Point(0, self.value + 1),
+        Size(self.rect.width, self.rect.height - self.value - 1))
+
+  def get_node_at_path(self, spec=''):
+    """
+    Given a string of ``'a'`` and ``'b'`` characters, follow those branches
+    and return the node at the end
+    """
+    node = self
+    for c in spec:
+      if c == 'a':
+        node = node.child_a
+      elif c == 'b':
+        node = node.child_b
+      else:
+        raise ValueError("Invalid character: {}".format(c))
+    return node
+
+  @property
+  def leaves(self):
+    """Iterator of all leaves, left/top-to-right/bottom"""
+    if self.child_a and self.child_b:
+      yield from self.child_a.leaves
+      yield from self.child_b.leaves
+    else:
+      yield self
+
+  @property
+  def sibling_pairs(self):
+    """Iterator of all pairs of siblings, deepest first"""
+    if not self.child_a or not self.child_b:
+      return
+    yield from self.child_a.sibling_pairs
+    yield from self.child_b.sibling_pairs
+    yield (self.child_a, self.child_b)
+
+  @property
+  def leftmost_leaf(self):
+    """The left/top-most leaf in the tree"""
+    if self.child_a:
+      return self.child_a.leftmost_leaf
+    else:
+      return self
+
+  @property
+  def ancestors(self):
+    """Iterator of ``self`` and all parents, starting with first parent"""
+    yield self
+    parent = self.parent_weakref()
+    if parent:
+      yield from parent.ancestors
+
+  def __repr__(self):
+    tag = 'horz' if self.is_horz else 'vert'
+    return 'BSPNode({}, {})'.format(tag, self.value)
+
+
+def _default_randrange(level, a, b):
+  return randrange(a, b)
+
+
+class RandomBSPTree:
+  """
+  A randomly generated BSP tree over a rectangle of *size*, with leaves at
+  least *min_leaf_size* on both axes. *randrange_func* is called as
+  ``randrange_func(level, a, b)`` to pick where to split each node.
+
+  .. py:attribute:: root
+
+    :py:class:`BSPNode` root of all children
+  """
+  def __init__(self, size, min_leaf_size, randrange_func=_default_randrange):
+    self.randrange_func = randrange_func
+    self.min_leaf_size = min_leaf_size
+    self.root = BSPNode(Rect(Point(0, 0), size))
+    self.subdivide(self.root)
+
+  def subdivide(self, node, iterations_left=8):
+    if iterations_left < 1:
+      return
+    if self.add_children(node):
+      self.subdivide(node.child_a, iterations_left=iterations_left - 1)
+      self.subdivide(node.child_b, iterations_left=iterations_left - 1)
+
+  def add_children(self, node):
+    a = self.min_leaf_size
+    b = node.max_value - self.min_leaf_size * 2
+    if b - a < 1:
+      return False
+    node.value = self.randrange_func(node.level, a, b)
+    node.child_a = BSPNode(node.rect_a, not node.is_horz, level=node.level + 1)
+    node.child_a.parent_weakref = weakref.ref(node)
+    node.child_b = BSPNode(node.rect_b, not node.is_horz, level=node.level + 1)
+    node.child_b.parent_weakref = weakref.ref(node)
+    return True
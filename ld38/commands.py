@@ -0,0 +1,78 @@
+# Everything the player can do, by key binding ID (the left column of
+# key_bindings.csv). GameMainScene and the modal scenes used to call the
+# functions in actions.py themselves. Now they decide *what* the player wants
+# to do, and perform_command() does it, so anything else that wants to play
+# the game (like replaying a turn journal, see journal.py) does exactly the
+# same thing the keyboard does. It's also where replays are recorded (see
+# replay.py).
+from .actions import (
+  action_close,
+  action_move,
+  action_pickup_item,
+  action_throw,
+)
+from .const import (
+  verbs,
+  KEYS_TO_DIRECTIONS,
+)
+from .sentences import simple_declarative_sentence
+
+
+# Commands that need a direction as well. GameMainScene asks for it with
+# another keystroke.
+COMMANDS_WITH_DIRECTION = {'CLOSE', 'THROW'}
+
+# Thrown things fly until they hit something, so aim way past the edge of
+# the map. The path is clipped to the map as the rock flies (see
+# projectiles.py), so this doesn't cost anything.
+THROW_DISTANCE = 1000
+# Tiles per turn for rocks the player throws
+PLAYER_THROW_SPEED = 2
+
+
+def perform_command(level_state, command, direction=None):
+  """
+  Have the player do *command*, a key binding ID like ``'U'`` or ``'GET'``.
+  Commands in :py:data:`COMMANDS_WITH_DIRECTION` also need *direction*, one
+  of the keys of ``KEYS_TO_DIRECTIONS``.
+
+  Returns a message to show the player, or ``None``.
+  """
+  game_state = level_state.game_state
+  if game_state is not None:
+    if game_state.recorder is not None:
+      game_state.recorder.record(command, direction)
+    if game_state.journal is not None:
+      game_state.journal.begin_turn(level_state, command, direction)
+
+  player = level_state.player
+  if command in KEYS_TO_DIRECTIONS:
+    # If the key represents a direction, try to move in that direction.
+    action_move(level_state, player, player.position + KEYS_TO_DIRECTIONS[command])
+  elif command == 'GET':
+    action_pickup_item(level_state, player)
+  elif command == 'WAIT':
+    # The easiest implementation of "wait" is to just fire the event that
+    # says "the player did something, you can move now" without the player
+    # having actually done anything.
+    level_state.fire_player_took_action_if_alive()
+  elif command == 'CLOSE':
+    delta = KEYS_TO_DIRECTIONS[direction]
+    if action_close(level_state, player, player.position + delta):
+      return "You closed the door."
+    else:
+      return "There is no door there."
+  elif command == 'THROW':
+    if not player.inventory:
+      return "You don't have anything to throw."
+    delta = KEYS_TO_DIRECTIONS[direction]
+    did_throw = action_throw(
+      level_state, player, player.inventory[0],
+      player.position + delta * THROW_DISTANCE, PLAYER_THROW_SPEED)
+    if did_throw:
+      return simple_declarative_sentence('PLAYER', verbs.THROW, 'ROCK')
+    else:
+      return "You can't throw that in that direction."
+  else:
+    raise ValueError("Not a command: {!r}".format(command))
+  return None
@@ -5,12 +5,17 @@ from math import floor
 from pathlib import Path
 from enum import Enum, unique
 
-from bearlibterminal import terminal
 from clubsandwich.datastore import DataStore, CSVReader
 from clubsandwich.geom import Point
 
 
+# The data files live next to the script that started the game (run.py, or
+# the executable PyInstaller makes). Headless scripts and bots (see
+# headless.py) can be run from anywhere, so if there's no data there, use the
+# copy next to this package.
 GAME_ROOT = Path(os.path.abspath(sys.argv[0])).parent
+if not (GAME_ROOT / 'data').is_dir():
+  GAME_ROOT = Path(os.path.abspath(__file__)).parent.parent
 
 
 ### field types ###
@@ -138,13 +143,14 @@ def _key_list(str_list):
   """
   key_bindings.csv's values are BearLibTerminal constant names, minus the 3-
   character ``TK_`` prefix. This function takes a list of those values and adds
-  back the prefix, and looks it up in the ``terminal`` namespace to get the
-  actual value of the constant.
+  back the prefix. The names are looked up in the ``terminal`` namespace later,
+  by :py:func:`get_bindings_by_key`, so that the game can run without
+  BearLibTerminal (see headless.py).
 
-  >>> _key_list('UP|DOWN')
-  [terminal.TK_UP, terminal.TK_DOWN]
+  >>> _key_list(['UP', 'DOWN'])
+  ['TK_UP', 'TK_DOWN']
   """
-  return [getattr(terminal, 'TK_' + s.strip()) for s in str_list]
+  return ['TK_' + s.strip() for s in str_list]
 
 ITEM_RE = re.compile(r'(.*)x(\d+)')
 def _items(val):
@@ -195,6 +201,7 @@ class EnumMonsterMode(Enum):
 class EnumRoomShape(Enum):
   BOX_RANDOM = 0
   BOX_FULL = 1
+  CAVE = 2
 
 
 @unique
@@ -285,6 +292,8 @@ monster_types = DataStore('MonsterType', (
   ('behaviors', _pipe_separated),
   ('hp_max', _int),
   ('strength', _int),
+  # Actions per player turn, see scheduler.py
+  ('speed', float),
   ('items', _items),
 ))
 
@@ -329,6 +338,36 @@ class KeyBindingsReader(CSVReader):
       yield [line[0], line[1:]]
 
 
+# Like tilemap.TERRAIN_INDEXES: every monster type and item type gets a
+# small integer, in the order they appear in their CSV files. Entities and
+# items keep theirs in a plain attribute (``type_index``), so the code that
+# runs all the time compares ints instead of strings, and LevelState can store
+# them in NumPy grids. These are keyed by ID because the rows have lists in
+# them, so they can't be dict keys. -1 means "nothing here".
+#
+# reload() fills these in, and changes them in place, so it's safe to import
+# them.
+MONSTER_TYPE_INDEXES = {}
+ITEM_TYPE_INDEXES = {}
+NOTHING_INDEX = -1
+# Item type index -> the monster type an item of that type is while it's
+# thrown: [ITEM_ID]_IN_FLIGHT, like ROCK_IN_FLIGHT. None if there isn't one.
+IN_FLIGHT_MONSTER_TYPES = []
+
+
+def _index_types():
+  MONSTER_TYPE_INDEXES.clear()
+  MONSTER_TYPE_INDEXES.update(
+    (mt.id, i) for i, mt in enumerate(monster_types.items))
+  ITEM_TYPE_INDEXES.clear()
+  ITEM_TYPE_INDEXES.update((it.id, i) for i, it in enumerate(item_types.items))
+  del IN_FLIGHT_MONSTER_TYPES[:]
+  for it in item_types.items:
+    in_flight_id = it.id + '_IN_FLIGHT'
+    IN_FLIGHT_MONSTER_TYPES.append(
+      monster_types[in_flight_id] if in_flight_id in monster_types else None)
+
+
 # Load all the values from the files, dumping any previously stored data. This
 # is how you'd go about implementing a settings screen where you can change the
 # key bindings, or live-edit your monster data to tune the game.
@@ -349,21 +388,33 @@ def reload():
   item_types.add_source(ItemTypeReader(str(GAME_ROOT / 'data' / 'items.csv')))
   key_bindings.add_source(KeyBindingsReader(
     str(GAME_ROOT / 'data' / 'key_bindings.csv'), skip_first_line=False))
+  _index_types()
 reload()
 
+# The types the code has to tell apart from the rest
+PLAYER_TYPE_INDEX = MONSTER_TYPE_INDEXES['PLAYER']
+ROCK_TYPE_INDEX = ITEM_TYPE_INDEXES['ROCK']
+GOLD_TYPE_INDEX = ITEM_TYPE_INDEXES['GOLD']
+
 
 ### assorted code constants ###
 
 
-# A simple reverse mapping of the key_bindings data store. It's a map of
-# terminal.TK_BLAH: "Key ID".
-#
-# >>> BINDINGS_BY_KEY[terminal.TK_KP_8]
-# "UP"
-BINDINGS_BY_KEY = {}
-for binding in key_bindings.items:
-  for key in binding.keys:
-    BINDINGS_BY_KEY[key] = binding.id
+def get_bindings_by_key():
+  """
+  A simple reverse mapping of the key_bindings data store. It's a map of
+  terminal.TK_BLAH: "Key ID". This is the only thing in this file that needs
+  BearLibTerminal, so it's imported here instead of at the top.
+
+  >>> get_bindings_by_key()[terminal.TK_KP_8]
+  "UP"
+  """
+  from bearlibterminal import terminal
+  bindings_by_key = {}
+  for binding in key_bindings.items:
+    for key in binding.keys:
+      bindings_by_key[getattr(terminal, key)] = binding.id
+  return bindings_by_key
 
 
 # For the directional keys, it's really nice to be able to just map a key
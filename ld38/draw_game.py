@@ -198,6 +198,11 @@ def get_char_and_color(level_state, cell):
       char = entity.monster_type.char
       if entity.mode == EnumMonsterMode.STUNNED:
         color = C_MONSTER_STUNNED
+    # Thrown things aren't entities, but they're drawn like them
+    elif cell.point in level_state.projectiles.monster_type_by_position:
+      monster_type = level_state.projectiles.monster_type_by_position[cell.point]
+      color = monster_type.color
+      char = monster_type.char
   else:
     color = '#444444'
   
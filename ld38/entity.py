@@ -1,24 +1,46 @@
-from .const import EnumMonsterMode
+from .const import (
+  EnumMonsterMode,
+  ITEM_TYPE_INDEXES,
+  MONSTER_TYPE_INDEXES,
+  PLAYER_TYPE_INDEX,
+)
 
 # Every moving game object is an Entity. There is no subclassing. The
 # differences are all in the properties.
+#
+# There can be a lot of entities, and their attributes get looked at all the
+# time by behaviors and actions, so they use __slots__: no __dict__ per
+# entity, and the numbers are plain attributes instead of dicts of stats.
+# (Bots and the like that want to look at all of them at once should use
+# LevelState's NumPy grids instead.)
 class Entity:
+  __slots__ = (
+    'monster_type', 'type_index', 'is_player', 'hp_max', 'strength', 'speed',
+    'hp', 'position', 'behaviors', 'inventory', 'mode', 'behavior_state',
+    # Behaviors keep weak references to their entities
+    '__weakref__',
+  )
+
   def __init__(self, monster_type):
     # This is how we know what kind of thing it is
     self.monster_type = monster_type
+    # The same thing as a small integer (see const.MONSTER_TYPE_INDEXES)
+    self.type_index = MONSTER_TYPE_INDEXES[monster_type.id]
+    # It is basically up to the level generator to make sure there is only one
+    # player. :-)
+    self.is_player = self.type_index == PLAYER_TYPE_INDEX
 
     # Stats for entities do not change during the game, unless some permanent
     # buff or debuff is applied. Rogue Basement has neither of those.
-    self.stats = {
-      'hp_max': monster_type.hp_max,
-      'strength': monster_type.strength,
-    }
+    self.hp_max = monster_type.hp_max
+    self.strength = monster_type.strength
+    # Actions per turn, see scheduler.py
+    self.speed = monster_type.speed
 
-    # "State" can and should change during gameplay. Hit points is the most
-    # obvious application.
-    self.state = {
-      'hp': self.stats['hp_max']
-    }
+    # State can and should change during gameplay. Hit points is the most
+    # obvious application. Use LevelState.set_hp() to change it, so the
+    # level's grids stay up to date.
+    self.hp = self.hp_max
     self.position = None
 
     # Entities have positions if they are alive in the level.
@@ -45,12 +67,6 @@ class Entity:
     # for them to store things in.
     self.behavior_state = {}
 
-  @property
-  def is_player(self):
-    # It is basically up to the level generator to make sure there is only one
-    # player. :-)
-    return self.monster_type.id == 'PLAYER'
-
   def add_behavior(self, behavior):
     # Simply keep references to all behaviors. The LevelState object will take
     # care of the rest.
@@ -64,6 +80,10 @@ class Entity:
 # are, and where they are in the map. Rogue Basement just has rocks, so that
 # is enough.
 class Item:
+  __slots__ = ('item_type', 'type_index', 'position')
+
   def __init__(self, item_type):
     self.item_type = item_type
+    # See const.ITEM_TYPE_INDEXES
+    self.type_index = ITEM_TYPE_INDEXES[item_type.id]
     self.position = None  # None if in someone's inventory
@@ -2,7 +2,10 @@
 # just like The Dude's rug. You can probably read it start to finish, but
 # by all means start jumping around from here.
 
+from contextlib import nullcontext
+
 # Dependencies for rendering the UI
+from clubsandwich.blt.nice_terminal import terminal
 from clubsandwich.ui import (
   LabelView,
   LayoutOptions,
@@ -15,18 +18,43 @@ from .views import ProgressBarView, GameView, StatsView
 # scenes you can get to from the game scene.
 from .scenes import PauseScene, WinScene, LoseScene
 
+# The game saves itself every turn. The run is over when you win or die, so
+# then there's nothing to continue.
+from .save_game import Autosaver, delete_save
+
+# Set to False to only save when the player asks to
+AUTOSAVE = True
+
+# Set to True to keep a journal of every turn (see journal.py), which lets the
+# player undo moves with the UNDO key
+JOURNAL = False
+from .journal import TurnJournal
+
+# Set to True to record the keys the player presses, so the game can be
+# played back later (see replay.py)
+RECORD_REPLAY = False
+from .replay import InputRecorder, save_replay
+
+# Set to a number of seconds to limit how long each frame spends on monster
+# AI and other events. A turn that takes longer is finished over the next
+# few frames, and keys pressed in the meantime wait for it. None means
+# always finish the turn in the frame it was taken.
+FRAME_BUDGET = None
+
 # This object stores the state of the whole game, so we're definitely gonna
 # need that.
 from .game_state import GameState
 
-# When keys are pressed, we'll call these functions to have the player do
-# things.
-from .actions import (
-  action_throw,
-  action_close,
-  action_move,
-  action_pickup_item,
-)
+# When keys are pressed, we'll call this function to have the player do
+# things. See commands.py.
+from .commands import perform_command
+
+# Some keys do many turns at once: shift + a direction runs, and x explores.
+from .running import Explore, RunInDirection
+
+# The glowing corridors heal the player (see behavior.py). We just have to
+# tell them about it.
+from .behavior import TRANSITION_ANNOTATIONS
 
 # When things happen, we need to show status messages at the bottom of the
 # screen. Since more than one thing can happen in a frame, there's some
@@ -54,13 +82,14 @@ from .const import (
   # These are collections of values from data files:
   verbs,        # from verbs.csv
   key_bindings, # from key_bindings.csv
-  # This is a reverse mapping of key_bindings.csv so we can turn
+  # This makes a reverse mapping of key_bindings.csv so we can turn
   # a raw key value into a usable command.
-  BINDINGS_BY_KEY,
+  get_bindings_by_key,
   # Map of key binding ID to a clubsandwich.geom.Point object representing a
   # direction.
   KEYS_TO_DIRECTIONS,
 )
+BINDINGS_BY_KEY = get_bindings_by_key()
 
 # At some point this game was slow. This flag enables profiling. You can
 # ignore it.
@@ -80,6 +109,9 @@ TEXT_HELP = """
 Move: arrows, numpad
       hjklyubn
 
+Run: shift + move
+Explore: x
+
 Get rock: g
 Throw rock: t
 Close: c
@@ -155,6 +187,22 @@ class GameAppearanceScene(UIScene):
     # same reason as enter()
     self.ctx.clear()
 
+  def after_consume_events(self):
+    pass
+
+  # Handle all the events caused by the last thing the player did. With a
+  # *budget* (in seconds), it might not get through all of them, and returns
+  # False.
+  def resolve_turn(self, budget=None):
+    # Tell the LevelState object to deal with any events in its queue. The
+    # event system is pretty sophisticated, more on that later.
+    if not self.game_state.level.consume_events(budget):
+      return False
+
+    # Some game scenes need to do things once all the events are done
+    self.after_consume_events()
+    return True
+
   # This function is called by DirectorLoop every frame. It does important
   # things!
   def terminal_update(self, is_active=True):
@@ -163,9 +211,7 @@ class GameAppearanceScene(UIScene):
     # Fade music in/out if necessary
     self.n_track_player.step()
 
-    # Tell the LevelState object to deal with any events in its queue. The
-    # event system is pretty sophisticated, more on that later.
-    self.game_state.level.consume_events()
+    self.resolve_turn(FRAME_BUDGET)
 
     # Tell the logger to display any log entries in its queue, or leave the
     # log unchanged.
@@ -211,33 +257,105 @@ class GameModalInputScene(GameAppearanceScene):
 #
 # Let's dive in!
 class GameMainScene(GameAppearanceScene):
-  def __init__(self, *args, **kwargs):
-    # Create a fresh GameState object
-    super().__init__(GameState(), *args, **kwargs)
+  def __init__(self, game_state=None, *args, **kwargs):
+    # Use the given GameState (the main menu makes one ahead of time), or
+    # create a fresh one
+    super().__init__(game_state or GameState(), *args, **kwargs)
     # Reset the music player in case this isn't the first game since the
     # process launched
     self.n_track_player.reset()
 
-    # Subscribe to a bunch of events. This probably looks a little weird, so
-    # you might want to read the docs for clubsandwich.event_dispatcher.
-    level_state = self.game_state.level
-    # But basically, this means "when the 'door_open' event is fired on the
-    # player entity, call self.on_door_open(event)."
-    level_state.dispatcher.add_subscriber(self, EnumEventNames.door_open, level_state.player)
-    level_state.dispatcher.add_subscriber(self, EnumEventNames.entity_bumped, level_state.player)
-    level_state.dispatcher.add_subscriber(self, EnumEventNames.entity_moved, level_state.player)
-    level_state.dispatcher.add_subscriber(self, EnumEventNames.entity_took_damage, level_state.player)
-    # These event handlers respond to all events with matching names,
-    # regardless of which entity they are attached to.
-    level_state.dispatcher.add_subscriber(self, EnumEventNames.entity_picked_up_item, None)
-    level_state.dispatcher.add_subscriber(self, EnumEventNames.entity_died, None)
-    level_state.dispatcher.add_subscriber(self, EnumEventNames.entity_attacking, None)
-    level_state.dispatcher.add_subscriber(self, EnumEventNames.score_increased, None)
+    self.subscribe(self.game_state.level)
+
+    # The run (see running.py) that is happening right now, if any
+    self.current_run = None
+
+    # The last key pressed while a turn was still being worked out (see
+    # FRAME_BUDGET), and whether shift was down: ``(key, is_shift)``
+    self.held_input = None
+
+    if AUTOSAVE:
+      self.game_state.autosaver = Autosaver(self.game_state)
+    if JOURNAL:
+      self.game_state.journal = TurnJournal(self.game_state)
+    if RECORD_REPLAY and self.game_state.seed is not None:
+      self.game_state.recorder = InputRecorder(self.game_state.seed)
+
+  def stop_autosave(self, discard=False):
+    if self.game_state.autosaver:
+      self.game_state.autosaver.stop(discard=discard)
+      self.game_state.autosaver = None
+
+  def save_replay(self):
+    if self.game_state.recorder:
+      save_replay(self.game_state.recorder.replay)
+      self.game_state.recorder = None
+
+  # Subscribe to a bunch of events. This probably looks a little weird, so
+  # you might want to read the docs for clubsandwich.event_dispatcher.
+  #
+  # But basically, (EnumEventNames.door_open, player) means "when the
+  # 'door_open' event is fired on the player entity, call
+  # self.on_door_open(event)." Subscriptions with the entity None respond to
+  # all events with matching names, regardless of which entity they are
+  # attached to.
+  def get_subscriptions(self, level_state):
+    return [
+      (EnumEventNames.door_open, level_state.player),
+      (EnumEventNames.entity_bumped, level_state.player),
+      (EnumEventNames.entity_moved, level_state.player),
+      (EnumEventNames.entity_took_damage, level_state.player),
+      (EnumEventNames.entity_picked_up_item, None),
+      (EnumEventNames.entity_died, None),
+      (EnumEventNames.entity_attacking, None),
+      (EnumEventNames.score_increased, None),
+    ]
+
+  def subscribe(self, level_state):
+    for (name, entity) in self.get_subscriptions(level_state):
+      level_state.dispatcher.add_subscriber(self, name, entity)
+
+  def unsubscribe(self, level_state):
+    for (name, entity) in self.get_subscriptions(level_state):
+      level_state.dispatcher.remove_subscriber(self, name, entity)
+
+  # If the player stepped on some stairs, the player's behavior told the
+  # GameState about it. We can't switch levels in the middle of handling the
+  # old level's events, so it happens here.
+  def after_consume_events(self):
+    if self.game_state.pending_stairs is None:
+      return
+    old_level = self.game_state.level
+    # Usually instant, because the level was generated in the background
+    stairs = self.game_state.take_stairs()
+
+    # Exit stairs on the last level means game win! Yay! And "winning" means
+    # "show a cute dialog." And the dialog looks almost exactly like the
+    # losing dialog, except it says "you win" instead of "you lose." How
+    # satisfying!
+    if self.game_state.has_won:
+      self.stop_autosave(discard=True)
+      delete_save()
+      self.save_replay()
+      self.director.push_scene(WinScene(self.game_state.score))
+      return
+
+    self.unsubscribe(old_level)
+    if stairs == EnumFeature.STAIRS_DOWN:
+      self.n_track_player.set_active_track(0)
+      self.logger.log("You descend the stairs.")
+    else:
+      self.n_track_player.set_active_track(3)
+      self.logger.log("You climb the stairs.")
+    self.subscribe(self.game_state.level)
+    self.stats_view.update()
 
   def exit(self):
     super().exit()
     # Stop the music and write profiler data to disk when the game ends.
     self.n_track_player.stop()
+    self.stop_autosave()
+    self.save_replay()
     if DEBUG_PROFILE: pr.dump_stats('profile')
 
   ### event handlers ###
@@ -253,26 +371,14 @@ class GameMainScene(GameAppearanceScene):
     # RogueBasementCell object (see level_generator.py) for a given position.
     cell = level_state.tilemap.cell(event.entity.position)
 
-    # This game only has one level, so exit stairs means game win! Yay!
-    # And "winning" means "show a cute dialog." And the dialog looks almost
-    # exactly like the losing dialog, except it says "you win" instead of
-    # "you lose." How satisfying!
-    if cell.feature == EnumFeature.STAIRS_DOWN:
-      self.director.push_scene(WinScene(self.game_state.score))
-
     # "Annotations" are just little notes left to us by the level generator.
     # These annotations in particular mean "this cell is part of a corridor
     # leading between two areas of different difficulty."
-    if cell.annotations & {'transition-1-2', 'transition-2-3', 'transition-3-4'}:
+    if cell.annotations & TRANSITION_ANNOTATIONS:
       # Fade the music out. DRAMA!!!
       self.n_track_player.set_active_track(None)
 
-      ### HACK HACK HACK HACK ###
-      # For "balance", replenish health between rooms.
-      # This was added in the last hour or so of the compo. It might be better
-      # to implement this as a cell Feature instead of this annotation, but eh,
-      # at this point it's not worth fixing.
-      level_state.player.state['hp'] = level_state.player.stats['hp_max']
+      # The player's behavior has already healed them
       self.logger.log("The glowing corridor restores you to health.")
       # Whenever we update player state, we have to manually update the stats
       # view. Not really the best workflow; the stats view ought to update
@@ -293,6 +399,9 @@ class GameMainScene(GameAppearanceScene):
     self.stats_view.update()
 
   def on_door_open(self, event):
+    # Exploring opens doors as it goes, which isn't news
+    if self.current_run is not None and not self.current_run.stops_at_doors:
+      return
     self.logger.log("You opened the door.")
 
   ## global events ##
@@ -315,6 +424,9 @@ class GameMainScene(GameAppearanceScene):
 
     if event.entity == self.game_state.level.player:
       # Funny how losing looks just like winning...
+      self.stop_autosave(discard=True)
+      delete_save()
+      self.save_replay()
       self.director.push_scene(LoseScene(self.game_state.score))
 
   def on_entity_picked_up_item(self, event):
@@ -344,26 +456,47 @@ class GameMainScene(GameAppearanceScene):
       return
 
     key = BINDINGS_BY_KEY[val]
-
+    is_shift = terminal.check(terminal.TK_SHIFT)
+
+    if self.game_state.level.has_unhandled_events:
+      # The last turn isn't over yet. With a frame budget, it gets to finish
+      # at its own pace, and the key waits (see terminal_update()).
+      if FRAME_BUDGET is not None:
+        self.held_input = (key, is_shift)
+        return
+      # If the player pressed two keys in one frame, finish the first one's
+      # turn before starting the next, the same way a replay would (see
+      # replay.py). It might have ended the game.
+      self.resolve_turn()
+      if self.director.active_scene is not self:
+        return
+
+    self.handle_input(key, is_shift)
+
+  def handle_input(self, key, is_shift):
     self.logger.clear()
 
+    # Holding shift turns a move into a run
+    if key in KEYS_TO_DIRECTIONS and is_shift:
+      self.run(RunInDirection(self.game_state.level, key))
+      return
+
     self.handle_key(key)
 
+  def terminal_update(self, is_active=True):
+    # A key that was pressed while the last turn was being worked out goes
+    # ahead once it's done
+    if (self.held_input is not None and is_active and
+        not self.game_state.level.has_unhandled_events):
+      (key, is_shift) = self.held_input
+      self.held_input = None
+      self.handle_input(key, is_shift)
+    super().terminal_update(is_active)
+
   def handle_key(self, k):
     level_state = self.game_state.level
     # Remember that `k` is one of the left column values in key_bindings.csv.
-    if k in KEYS_TO_DIRECTIONS:
-      # If the key represents a direction, try to move in that direction.
-      point = level_state.player.position + KEYS_TO_DIRECTIONS[k]
-      action_move(level_state, level_state.player, point)
-    elif k == 'GET':
-      action_pickup_item(level_state, level_state.player)
-    elif k == 'WAIT':
-      # The easiest implementation of "wait" is to just fire the event that
-      # says "the player did something, you can move now" without the player
-      # having actually done anything.
-      level_state.fire_player_took_action_if_alive()
-    elif k == 'CLOSE':
+    if k == 'CLOSE':
       # Now it's time to push one of those fancy modal-input scenes I've talked
       # so much about!
       self.director.push_scene(GameCloseScene(self.game_state))
@@ -375,7 +508,61 @@ class GameMainScene(GameAppearanceScene):
         # HAHA LOL PLAYER U SUX
         self.logger.log("You don't have anything to throw.")
     elif k == 'CANCEL':
-      self.director.push_scene(PauseScene())
+      self.director.push_scene(PauseScene(self.game_state))
+    elif k == 'UNDO':
+      self.undo()
+    elif k == 'EXPLORE':
+      self.run(Explore(level_state))
+    else:
+      # Moving, waiting and picking things up don't need any more input
+      message = perform_command(level_state, k)
+      if message:
+        self.logger.log(message)
+
+  # Do all the turns of a run (see running.py) right now, in this frame,
+  # without drawing the ones in between. Otherwise a 200-step walk would take
+  # at least 200 frames, and the player only cares where it ends. Saving
+  # every step would be a waste too.
+  def run(self, run):
+    autosaver = self.game_state.autosaver
+    self.current_run = run
+    try:
+      with autosaver.paused() if autosaver else nullcontext():
+        while True:
+          command = run.get_next_command()
+          if command is None:
+            break
+          perform_command(run.level_state, command)
+          self.resolve_turn()
+          # The player died, won, or took the stairs
+          if (self.director.active_scene is not self or
+              self.game_state.level is not run.level_state):
+            break
+          # Anything worth telling the player about is worth stopping for
+          if self.logger.log_messages:
+            break
+    finally:
+      self.current_run = None
+    if run.message:
+      self.logger.log(run.message)
+
+  def undo(self):
+    journal = self.game_state.journal
+    if journal is None:
+      self.logger.log("Undo is turned off.")
+      return
+    if not len(journal):
+      self.logger.log("There is nothing to undo.")
+      return
+    # The level is replaced with a new LevelState, so move our subscriptions
+    # over
+    self.unsubscribe(self.game_state.level)
+    level_state = journal.rewind(len(journal) - 1)
+    self.subscribe(level_state)
+    self.stats_view.update()
+    if self.game_state.autosaver:
+      self.game_state.autosaver.snapshot()
+    self.logger.log("You take back your last move.")
 
 
 # At this point, you should be able to read the last two classes yourself
@@ -406,16 +593,7 @@ class GameThrowScene(GameModalInputScene):
       self.logger.log("Invalid direction")
       return
 
-    delta = KEYS_TO_DIRECTIONS[k]
-
-    item = level_state.player.inventory[0]
-    did_throw = action_throw(
-      level_state,
-      level_state.player, item, level_state.player.position + delta * 1000, 2)
-    if did_throw:
-      self.logger.log(simple_declarative_sentence('PLAYER', verbs.THROW, 'ROCK'))
-    else:
-      self.logger.log("You can't throw that in that direction.")
+    self.logger.log(perform_command(level_state, 'THROW', k))
 
 
 class GameCloseScene(GameModalInputScene):
@@ -432,9 +610,5 @@ class GameCloseScene(GameModalInputScene):
       self.logger.log("Invalid direction")
       return
 
-    delta = KEYS_TO_DIRECTIONS[k]
-    if action_close(level_state, level_state.player, level_state.player.position + delta):
-      self.logger.log("You closed the door.")
-    else:
-      self.logger.log("There is no door there.")
+    self.logger.log(perform_command(level_state, 'CLOSE', k))
 
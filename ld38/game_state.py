@@ -1,37 +1,274 @@
+import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 from clubsandwich.geom import Size
 
+from .const import EnumFeature
 from .level_generator import generate_dungeon
 from .level_state import LevelState
+from .level_store import LevelStore
+from .serialization import dumps_tilemap, loads_tilemap
 
 
 LEVEL_SIZE = Size(100, 60)
+# Take the stairs down on the last level to win
+NUM_LEVELS = 3
 
 
-# Originally, Rogue Basement was going to have several levels. This was going
-# to be the object that tracked the current level and let you switch between
-# them.
+# Generating a level takes long enough to drop frames, so it's done in a
+# separate process while the player is busy with the current level. The
+# process hands back the level in serialized form (see serialization.py), and
+# a thread in this process turns it back into a LevelState. By the time the
+# player finds the stairs, the next level has been sitting around ready for
+# ages, and switching to it is just changing GameState.active_id.
 #
-# It fulfills that purpose, but there is no actual "change current level"
-# method! It would be as simple as setting `self.active_id = NEW_VALUE`.
-# The screen is redrawn completely every frame, so there is no need to do
-# anything else.
+# Both executors are shared by every GameState and created the first time
+# they're needed. One worker each is plenty, since only one level is ever
+# being generated at a time.
+_process_executor = None
+_thread_executor = None
+
+# Processes that are already one of many workers (see balance.py and
+# batch.py) set this to False. Every CPU is busy anyway, and worker processes
+# that start processes of their own can hang when they exit. Each level is
+# then generated in this process, the first time it's needed.
+GENERATE_LEVELS_IN_BACKGROUND = True
+
+
+def _get_process_executor():
+  global _process_executor
+  if _process_executor is None:
+    _process_executor = ProcessPoolExecutor(max_workers=1)
+  return _process_executor
+
+
+def _get_thread_executor():
+  global _thread_executor
+  if _thread_executor is None:
+    _thread_executor = ThreadPoolExecutor(max_workers=1)
+  return _thread_executor
+
+
+def generate_serialized_level(size, seed):
+  """
+  Runs in the worker process. Seeds the random module so a level depends only
+  on *seed*, then returns the output of serialization.dumps_tilemap().
+  """
+  random.seed(seed)
+  return dumps_tilemap(generate_dungeon(size))
+
+
+class _LevelOnDemand:
+  """
+  Stands in for the Future of the next level when
+  GENERATE_LEVELS_IN_BACKGROUND is False
+  """
+  def __init__(self, game_state, seed):
+    self._game_state = game_state
+    self._seed = seed
+
+  def result(self):
+    # The level generator uses the random module, and the game shouldn't be
+    # able to tell it happened
+    random_state = random.getstate()
+    try:
+      data = generate_serialized_level(LEVEL_SIZE, self._seed)
+    finally:
+      random.setstate(random_state)
+    return LevelState(loads_tilemap(data), self._game_state)
+
+
+def start_creating_game_state():
+  """
+  Start creating a GameState on the background thread, so it's ready by the
+  time the player wants to play. Returns a Future. See
+  :py:func:`finish_creating_game_state`.
+  """
+  return _get_thread_executor().submit(GameState)
+
+
+def finish_creating_game_state(future):
+  """
+  Returns the GameState from a :py:func:`start_creating_game_state` Future.
+  If the background thread hasn't even started on it yet, forget it and
+  create one right here instead. If it's partway done, finishing is faster
+  than starting over, so wait for it.
+  """
+  if future is None or future.cancel():
+    return GameState()
+  return future.result()
+
+
+# Originally, Rogue Basement only had one level. Now this object keeps track
+# of all the levels the player has visited, which one is current, and the
+# next one down, which is generated ahead of time. Only the most recently
+# visited levels stay in memory; see level_store.py.
+#
+# The screen is redrawn completely every frame, so switching levels is as
+# simple as setting `self.active_id = NEW_VALUE`. (GameMainScene does have to
+# subscribe to the new level's events, though.)
 #
 # This object also tracks the score. LevelState keeps a weak reference to this
 # object, so the active LevelState object is what actually increments the
 # score.
+#
+# The whole game depends only on the random module's state when it starts.
+# Pass a *seed* to play a specific game; otherwise one is picked at random.
+# Either way, it's kept in ``self.seed`` so the game can be replayed (see
+# replay.py).
 class GameState:
-  def __init__(self):
-    self.level_states_by_id = {}
+  def __init__(self, populate=True, seed=None):
+    self.level_states_by_id = LevelStore(self)
+    # Level IDs from top to bottom
+    self.level_ids = []
     self.score = 0
-    self.active_id = self.add_level().uuid
+    self._next_level_future = None
+    # The seed of the level in _next_level_future. Saved games keep it, so
+    # loading one doesn't have to draw a new seed from the random module.
+    self.next_level_seed = None
+    self.active_id = None
+    # Set by the player's behaviors when they step on stairs. See
+    # take_stairs().
+    self.pending_stairs = None
+    self.has_won = False
+    # If this is set to a save_game.Autosaver, the game is saved every turn
+    self.autosaver = None
+    # If this is set to a journal.TurnJournal, every turn is recorded
+    self.journal = None
+    # If this is set to a replay.InputRecorder, every command is recorded
+    self.recorder = None
+    self.seed = None
+    # save_game.py fills in the levels itself when it loads a saved game
+    if not populate:
+      return
+
+    self.seed = random.getrandbits(32) if seed is None else seed
+    random.seed(self.seed)
+    self.active_id = self.add_level().level_id
+    self.start_next_level()
 
   @property
   def level(self):
     return self.level_states_by_id[self.active_id]
 
-  def add_level(self):
-    level_state = LevelState(generate_dungeon(LEVEL_SIZE), self)
-    self.level_states_by_id[level_state.uuid] = level_state
+  @property
+  def depth(self):
+    """0 for the top level, 1 for the one below it, and so on"""
+    return self.level_ids.index(self.active_id)
+
+  @property
+  def is_last_level(self):
+    return self.depth >= NUM_LEVELS - 1
+
+  def add_level(self, level_state=None):
+    """
+    Add a level below all the others. If you don't pass one in, generate it
+    right now, on this thread.
+    """
+    if level_state is None:
+      level_state = LevelState(generate_dungeon(LEVEL_SIZE), self)
+    level_state.level_id = len(self.level_ids)
+    self.level_states_by_id[level_state.level_id] = level_state
+    self.level_ids.append(level_state.level_id)
     return level_state
 
-# Your next stop should be level_state.py.
+  def start_next_level(self, seed=None):
+    """
+    Start generating the level below the bottom one in the background, unless
+    that's already happening or there isn't going to be one. If you don't
+    pass a *seed*, one is picked.
+    """
+    if self._next_level_future is not None:
+      return
+    if len(self.level_ids) >= NUM_LEVELS:
+      return
+    # Pick the seed here so the whole game depends only on this process's
+    # random state
+    if seed is None:
+      seed = random.getrandbits(32)
+    self.next_level_seed = seed
+    if GENERATE_LEVELS_IN_BACKGROUND:
+      self._next_level_future = _get_thread_executor().submit(
+        self._load_level, seed)
+    else:
+      self._next_level_future = _LevelOnDemand(self, seed)
+
+  def _load_level(self, seed):
+    # Runs on the background thread
+    try:
+      data = _get_process_executor().submit(
+        generate_serialized_level, LEVEL_SIZE, seed).result()
+    except (BrokenProcessPool, OSError):
+      # No worker process for some reason. The level generator uses the
+      # random module, which the main thread is busy with, so it can't run on
+      # this thread without changing the game. Leave it for descend() to do
+      # on the main thread instead.
+      print("Unable to generate level in a worker process; doing it later")
+      return _LevelOnDemand(self, seed)
+    return LevelState(loads_tilemap(data), self)
+
+  def take_stairs(self):
+    """
+    If the player has stepped on some stairs since the last call, go where
+    they lead. The stairs down on the last level win the game instead (see
+    ``has_won``). Call this between turns, when all the events have been
+    consumed. Returns the stairs' EnumFeature, or ``None``.
+    """
+    stairs = self.pending_stairs
+    self.pending_stairs = None
+    if stairs == EnumFeature.STAIRS_DOWN:
+      if self.is_last_level:
+        self.has_won = True
+      else:
+        self.descend()
+    elif stairs == EnumFeature.STAIRS_UP:
+      self.ascend()
+    return stairs
+
+  def descend(self):
+    """
+    Make the level below the current one active, creating it if necessary,
+    and move the player there. Returns the new LevelState.
+    """
+    depth = self.depth
+    if depth + 1 >= len(self.level_ids):
+      # If the background level isn't finished yet, this waits for it.
+      self.start_next_level()
+      level_state = self._next_level_future.result()
+      self._next_level_future = None
+      self.next_level_seed = None
+      if isinstance(level_state, _LevelOnDemand):
+        level_state = level_state.result()
+      self.add_level(level_state)
+    self._move_player_to(self.level_ids[depth + 1])
+
+    # Get the next one going while the player explores this one
+    self.start_next_level()
+    return self.level
+
+  def ascend(self):
+    """
+    Make the level above the current one active and move the player there.
+    The player arrives on the stairs down, where they left. Returns the new
+    LevelState.
+    """
+    assert self.depth > 0
+    self._move_player_to(self.level_ids[self.depth - 1])
+    return self.level
+
+  def _move_player_to(self, level_id):
+    # The player on each level is a different Entity (its behaviors belong to
+    # that level), so copy over everything that should follow them.
+    #
+    # Take it away from the old player *before* switching, because looking up
+    # the new level may write the old one to disk.
+    old_player = self.level.player
+    hp = old_player.hp
+    inventory = old_player.inventory
+    old_player.inventory = []
+
+    self.active_id = level_id
+    new_player = self.level.player
+    self.level.set_hp(new_player, hp)
+    new_player.inventory = inventory
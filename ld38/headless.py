@@ -0,0 +1,224 @@
+"""
+Playing Rogue Basement from Python, without a window.
+
+The game itself (GameState, LevelState, actions.py, behavior.py) doesn't know
+anything about the screen. GameMainScene reads keys, calls
+commands.perform_command(), consumes events every frame, and draws the
+result. :py:class:`HeadlessGame` does the same things minus the drawing, for
+bots, benchmarks, tests and anything else that wants to play the game::
+
+  game = HeadlessGame(seed=1234)
+  observation = game.step('R')
+  observation = game.step('THROW', 'UL')
+  if observation.is_dead:
+    ...
+
+Nothing imported from here loads BearLibTerminal or pyglet, so it works in a
+plain Python process, on a server, or in a worker process. (Keep it that way:
+game_scene.py, views.py, draw_game.py, music.py and friends are for the
+window only.)
+"""
+import weakref
+from collections import namedtuple
+
+from .commands import COMMANDS_WITH_DIRECTION, perform_command
+from .const import EnumEventNames, KEYS_TO_DIRECTIONS
+from .game_state import GameState
+from .journal import describe_event
+
+
+# Everything HeadlessGame.submit() accepts: the eight directions, then the
+# rest of the player's actions
+COMMANDS = tuple(KEYS_TO_DIRECTIONS) + ('GET', 'WAIT', 'CLOSE', 'THROW')
+
+
+class GameOverError(Exception):
+  """The player is dead or has won, so there are no more turns"""
+  pass
+
+
+# What the player knows at the start of a turn. Everything is plain values,
+# so it's easy to print, compare and send to other processes.
+#
+# * turn: number of commands submitted so far
+# * depth: 0 for the top level, 1 for the one below it, and so on
+# * position: the player's ``(x, y)``, or ``None`` if they're dead
+# * inventory: item type IDs, like ``('ROCK', 'ROCK')``
+# * monsters: ``(monster type ID, x, y, hp)`` for every monster the player
+#   can see
+# * projectiles: ``(monster type ID, x, y)`` for everything in flight that the
+#   player can see, like ``('ROCK_IN_FLIGHT', 3, 4)``
+# * items: ``(item type ID, x, y)`` for every item the player can see lying
+#   around
+# * events: output of journal.describe_event() for every event since the last
+#   observation, in order. Empty if the game was created with
+#   ``collect_events=False``.
+Observation = namedtuple('Observation', [
+  'turn', 'depth', 'score', 'hp', 'hp_max', 'position', 'inventory',
+  'is_dead', 'has_won', 'monsters', 'projectiles', 'items', 'events'])
+
+
+class _EventCollector:
+  """
+  Subscribes to every event on a level and writes them down. Same trick as
+  CompositeBehavior: one ``on_<name>`` method per event name.
+  """
+  def __init__(self):
+    self.events = []
+    for name in EnumEventNames:
+      setattr(self, 'on_' + name.value, self._collect)
+
+  def _collect(self, event):
+    self.events.append(
+      describe_event(EnumEventNames(event.name), event.entity, event.data))
+
+  def subscribe(self, level_state):
+    for name in EnumEventNames:
+      level_state.dispatcher.add_subscriber(self, name, None)
+
+  def unsubscribe(self, level_state):
+    for name in EnumEventNames:
+      level_state.dispatcher.remove_subscriber(self, name, None)
+
+
+class HeadlessGame:
+  """
+  One game, played one command at a time. Pass *seed* to play a specific game
+  (see GameState), or *game_state* to keep playing one you already have, like
+  a loaded save.
+
+  If you don't care about events, pass ``collect_events=False``; it's a bit
+  faster.
+  """
+  def __init__(self, seed=None, game_state=None, collect_events=True):
+    self._game_state = game_state or GameState(seed=seed)
+    self.turn = 0
+    self._collector = _EventCollector() if collect_events else None
+    self._subscribed_level = None
+    self._subscribe()
+
+  @property
+  def game_state(self):
+    return self._game_state
+
+  @property
+  def level_state(self):
+    return self._game_state.level
+
+  @property
+  def is_over(self):
+    return self.level_state.player.position is None or self._game_state.has_won
+
+  def submit(self, command, direction=None):
+    """
+    Have the player do *command*, one of :py:data:`COMMANDS`. ``'CLOSE'`` and
+    ``'THROW'`` also need a *direction*, one of the eight direction commands.
+    Nothing happens until you call :py:meth:`consume_events`, so usually you
+    want :py:meth:`step` instead.
+
+    Returns a message for the player, or ``None`` (see
+    commands.perform_command()).
+    """
+    if self.is_over:
+      raise GameOverError("The game is over")
+    if command not in COMMANDS:
+      raise ValueError("Not a command: {!r}".format(command))
+    if command in COMMANDS_WITH_DIRECTION:
+      if direction not in KEYS_TO_DIRECTIONS:
+        raise ValueError("{} needs a direction, not {!r}".format(command, direction))
+    else:
+      direction = None
+
+    self.turn += 1
+    return perform_command(self.level_state, command, direction)
+
+  def consume_events(self):
+    """
+    Let the rest of the level react to whatever the player did. Then, if the
+    player stepped on some stairs, take them. This is what GameMainScene does
+    every frame.
+    """
+    self.level_state.consume_events()
+    if self._game_state.take_stairs() is not None:
+      self._subscribe()
+
+  def step(self, command, direction=None):
+    """
+    :py:meth:`submit` and :py:meth:`consume_events` in one go. Returns an
+    :py:class:`Observation` of the result.
+    """
+    self.submit(command, direction)
+    self.consume_events()
+    return self.observe()
+
+  def observe(self):
+    """
+    Returns an :py:class:`Observation` of the game as it is now, with the
+    events since the last call
+    """
+    level_state = self.level_state
+    player = level_state.player
+    can_see = level_state.los_cache if player.position else ()
+
+    monsters = []
+    for entity in level_state.entities:
+      if entity is player or entity.position not in can_see:
+        continue
+      monsters.append((
+        entity.monster_type.id, entity.position.x, entity.position.y,
+        entity.hp))
+
+    projectiles = [
+      (monster_type.id, point.x, point.y)
+      for (point, monster_type)
+      in level_state.projectiles.monster_type_by_position.items()
+      if point in can_see]
+
+    items = []
+    for (point, items_here) in level_state.items_by_position.items():
+      if point not in can_see:
+        continue
+      for item in items_here:
+        items.append((item.item_type.id, point.x, point.y))
+
+    position = player.position
+    return Observation(
+      turn=self.turn,
+      depth=self._game_state.depth,
+      score=self._game_state.score,
+      hp=player.hp,
+      hp_max=player.hp_max,
+      position=(position.x, position.y) if position else None,
+      inventory=tuple(item.item_type.id for item in player.inventory),
+      is_dead=position is None,
+      has_won=self._game_state.has_won,
+      monsters=tuple(monsters),
+      projectiles=tuple(projectiles),
+      items=tuple(items),
+      events=self.pop_events(),
+    )
+
+  def pop_events(self):
+    """
+    Returns the events since the last call (or observation), from
+    journal.describe_event(), and forgets them
+    """
+    if self._collector is None:
+      return ()
+    events = tuple(self._collector.events)
+    self._collector.events.clear()
+    return events
+
+  def _subscribe(self):
+    # Each level has its own dispatcher, so follow the player around
+    if self._collector is None:
+      return
+    level_state = self.level_state
+    if self._subscribed_level is not None:
+      old_level = self._subscribed_level()
+      if old_level is level_state:
+        return
+      if old_level is not None:
+        self._collector.unsubscribe(old_level)
+    self._collector.subscribe(level_state)
+    self._subscribed_level = weakref.ref(level_state)
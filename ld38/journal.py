@@ -0,0 +1,252 @@
+"""
+A record of every turn, for undo and for figuring out what went wrong.
+
+Everything that happens in a level goes through LevelState.fire() and
+LevelState.consume_events(), and everything the player does goes through
+commands.perform_command(). So the whole game is determined by where it
+started, what the player did, and what the random module said. The journal
+keeps exactly that:
+
+* For every turn: the command, the random state before it, and the events
+  that were dispatched because of it (boiled down to plain values, see
+  :py:func:`describe_event`).
+* Every *snapshot_interval* turns, and whenever the player is on a new
+  level: a snapshot of the level (see serialization.snapshot_level_state())
+  and the score.
+
+To see any turn again, load the nearest snapshot before it and replay the
+commands in between. That's a lot cheaper than keeping the whole game for
+every turn.
+
+Only the level the player was on is rewound. Other levels stay the way they
+are now.
+"""
+import random
+import weakref
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+from clubsandwich.geom import Point
+from clubsandwich.tilemap import Cell
+
+from .actions import Damage
+from .commands import perform_command
+from .entity import Entity, Item
+from .game_state import GameState
+from .projectiles import Projectile
+from .serialization import (
+  level_snapshot_to_dict,
+  level_state_from_dict,
+  snapshot_level_state,
+)
+
+
+# Snapshot the level this often. Lower is faster to rewind and uses more
+# memory.
+SNAPSHOT_INTERVAL = 20
+
+
+# The state of the game at the start of turn number *turn*
+JournalSnapshot = namedtuple('JournalSnapshot', [
+  'turn', 'level_id', 'level_ids', 'score', 'level'])
+
+
+def _pack_random_state(state):
+  # random.getstate() is 625 Python ints. Packed, it's 2.5 KB instead of ~20.
+  (version, internal_state, gauss_next) = state
+  return (version, array('I', internal_state), gauss_next)
+
+
+def _unpack_random_state(packed):
+  (version, internal_state, gauss_next) = packed
+  return (version, tuple(internal_state), gauss_next)
+
+
+def _describe(value):
+  if isinstance(value, (Entity, Projectile)):
+    return (
+      value.monster_type.id,
+      (value.position.x, value.position.y) if value.position else None)
+  if isinstance(value, Item):
+    return value.item_type.id
+  if isinstance(value, Damage):
+    return (_describe(value.attacker), value.amount, value.monster_type.id)
+  if isinstance(value, Cell):
+    value = value.point
+  if isinstance(value, Point):
+    return (value.x, value.y)
+  return value
+
+
+def describe_event(name, entity, data):
+  """
+  Returns an event as plain values, as it is right now: ``(name, entity,
+  data)``, where entities are ``(monster type ID, position)``, items are item
+  type IDs, cells and points are ``(x, y)``, and actions.Damage is
+  ``(attacker, amount, monster type ID)``.
+  """
+  return (name.value, _describe(entity), _describe(data))
+
+
+class JournalEntry:
+  """
+  One turn.
+
+  .. py:attribute:: level_id
+
+    The level the player was on
+
+  .. py:attribute:: command
+  .. py:attribute:: direction
+
+    The arguments to commands.perform_command()
+
+  .. py:attribute:: random_state
+
+    ``random.getstate()`` before the command, packed
+
+  .. py:attribute:: events
+
+    Output of :py:func:`describe_event` for every event dispatched during
+    this turn
+
+  .. py:attribute:: is_resolved
+
+    ``True`` if LevelState.consume_events() ran before the next command. (If
+    the player pressed two keys in one frame, it didn't.)
+  """
+  def __init__(self, level_id, command, direction, random_state):
+    self.level_id = level_id
+    self.command = command
+    self.direction = direction
+    self.random_state = random_state
+    self.events = []
+    self.is_resolved = False
+
+  def __repr__(self):
+    return "{}({!r}, {!r}, {} events)".format(
+      self.__class__.__name__, self.command, self.direction, len(self.events))
+
+
+class TurnJournal:
+  """
+  Set ``game_state.journal`` to one of these to start recording. Turns are
+  numbered from 0, starting when it was created.
+  """
+  def __init__(self, game_state, snapshot_interval=SNAPSHOT_INTERVAL):
+    assert snapshot_interval >= 1
+    self._game_state = weakref.ref(game_state)
+    self.snapshot_interval = snapshot_interval
+    self.entries = []
+    self.snapshots = []
+
+  def __len__(self):
+    return len(self.entries)
+
+  ### recording ###
+  # (commands.perform_command() and LevelState.consume_events() call these)
+
+  def begin_turn(self, level_state, command, direction):
+    turn = len(self.entries)
+    is_new_level = (
+      not self.entries or self.entries[-1].level_id != level_state.level_id)
+    is_due = (
+      not self.snapshots or
+      turn - self.snapshots[-1].turn >= self.snapshot_interval)
+    # A snapshot can only be taken between turns. If the last one hasn't been
+    # resolved yet, try again next turn.
+    if (is_new_level or is_due) and not level_state.event_queue:
+      self._add_snapshot(turn, level_state)
+    self.entries.append(JournalEntry(
+      level_state.level_id, command, direction,
+      _pack_random_state(random.getstate())))
+
+  def record_event(self, name, entity, data):
+    if self.entries:
+      self.entries[-1].events.append(describe_event(name, entity, data))
+
+  def finish_turn(self):
+    if self.entries:
+      self.entries[-1].is_resolved = True
+
+  def _add_snapshot(self, turn, level_state):
+    if self.snapshots and self.snapshots[-1].turn == turn:
+      self.snapshots.pop()
+    game_state = self._game_state()
+    self.snapshots.append(JournalSnapshot(
+      turn=turn,
+      level_id=level_state.level_id,
+      level_ids=list(game_state.level_ids),
+      score=game_state.score,
+      level=snapshot_level_state(level_state)))
+
+  ### looking back ###
+
+  def get_events(self, turn):
+    """Events dispatched during *turn*, from :py:func:`describe_event`"""
+    return self.entries[turn].events
+
+  def reconstruct(self, turn):
+    """
+    Returns a new GameState with the level as it was at the start of *turn*.
+    The GameState only has that one level in it. Doesn't change the game
+    being played.
+    """
+    random_state = random.getstate()
+    game_state = GameState(populate=False)
+    try:
+      self._replay(turn, game_state)
+    finally:
+      random.setstate(random_state)
+    return game_state
+
+  def rewind(self, turn):
+    """
+    Put the game back the way it was at the start of *turn*, and forget
+    everything after it. Returns the new LevelState for that level, which
+    replaces the old one.
+    """
+    game_state = self._game_state()
+    # Don't record or save the replay itself
+    (autosaver, recorder) = (game_state.autosaver, game_state.recorder)
+    game_state.journal = game_state.autosaver = game_state.recorder = None
+    try:
+      level_state = self._replay(turn, game_state)
+    finally:
+      game_state.journal = self
+      (game_state.autosaver, game_state.recorder) = (autosaver, recorder)
+    game_state.pending_stairs = None
+    # The turns being forgotten never happened, as far as a replay is
+    # concerned
+    if recorder is not None:
+      recorder.forget(len(self.entries) - turn)
+
+    del self.entries[turn:]
+    while self.snapshots and self.snapshots[-1].turn > turn:
+      self.snapshots.pop()
+    return level_state
+
+  def _replay(self, turn, game_state):
+    if not 0 <= turn < len(self.entries):
+      raise IndexError("No such turn: {!r}".format(turn))
+    i = bisect_right([s.turn for s in self.snapshots], turn) - 1
+    snapshot = self.snapshots[i]
+
+    level_state = level_state_from_dict(
+      level_snapshot_to_dict(snapshot.level), game_state)
+    if snapshot.level_id not in game_state.level_ids:
+      game_state.level_ids = list(snapshot.level_ids)
+    game_state.level_states_by_id[snapshot.level_id] = level_state
+    game_state.active_id = snapshot.level_id
+    game_state.score = snapshot.score
+
+    # Snapshots are taken whenever the player reaches a new level, so all of
+    # these turns happened on this one
+    for entry in self.entries[snapshot.turn:turn]:
+      random.setstate(_unpack_random_state(entry.random_state))
+      perform_command(level_state, entry.command, entry.direction)
+      if entry.is_resolved:
+        level_state.consume_events()
+    random.setstate(_unpack_random_state(self.entries[turn].random_state))
+    return level_state
@@ -4,17 +4,18 @@
 # In the comments, I will assume you've read my blog post which has some
 # important information about the level generator:
 # http://steveasleep.com/the-design-and-implementation-of-rogue-basement.html
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from math import floor
-from random import randrange, uniform
-from uuid import uuid4
+from random import choice, getrandbits, randrange, random
 
+import numpy as np
 from clubsandwich.geom import Rect, Point, Size
-# You should probably go read the docs for this:
-# http://steveasleep.com/clubsandwich/api_generators.html
-from clubsandwich.generators import RandomBSPTree
 from clubsandwich.tilemap import CellOutOfBoundsError
 
+# Same as clubsandwich.generators.RandomBSPTree, so you should probably go
+# read the docs for that:
+# http://steveasleep.com/clubsandwich/api_generators.html
+from .bsp import RandomBSPTree
 from .const import (
   EnumFeature,
   EnumRoomShape,
@@ -23,34 +24,160 @@ from .const import (
   item_types,
   terrain_types,
 )
-from .tilemap import RogueBasementCell, RogueBasementTileMap
+from .connectivity import get_components, get_connectivity_report
+from .room_graph import RoomCenterIndex
+from .tilemap import RogueBasementTileMap, TERRAIN_INDEXES
+
+
+class WeightedTable:
+  """
+  A precomputed table for picking one of several choices at random, where
+  each choice has a weight. Build it once with
+  ``WeightedTable([(choice, weight)])`` and call :py:meth:`choose` as many
+  times as you like.
+
+  This uses Walker's alias method, which sounds fancy but isn't so bad. Each
+  choice gets a "column" of height 1. Tall choices donate their extra height
+  to short ones until every column is full, so each column holds at most two
+  choices: its own and an "alias." Picking is then just "pick a random column,
+  flip a weighted coin," which takes the same amount of time no matter how
+  many choices there are.
+
+  Choices with weight 0 are dropped, so they can never be picked.
+  """
+  def __init__(self, choices):
+    choices = [(c, w) for c, w in choices if w > 0]
+    self.choices = [c for c, w in choices]
+    n = len(choices)
+    self._probabilities = [1.0] * n
+    self._aliases = list(range(n))
+    if not n:
+      return
+
+    total = sum(w for c, w in choices)
+    scaled = [w * n / total for c, w in choices]
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+      i_small = small.pop()
+      i_large = large.pop()
+      self._probabilities[i_small] = scaled[i_small]
+      self._aliases[i_small] = i_large
+      scaled[i_large] -= 1 - scaled[i_small]
+      if scaled[i_large] < 1:
+        small.append(i_large)
+      else:
+        large.append(i_large)
+    # Anything left over is (give or take floating point error) exactly full,
+    # which the defaults above already say.
+
+  def __len__(self):
+    return len(self.choices)
+
+  def choose(self):
+    """Returns a random choice. Raises ``ValueError`` if the table is empty."""
+    if not self.choices:
+      raise ValueError("Can't choose from a table with no nonzero weights")
+    r = random() * len(self.choices)
+    i = int(r)
+    if r - i < self._probabilities[i]:
+      return self.choices[i]
+    else:
+      return self.choices[self._aliases[i]]
 
 
 def weighted_choice(choices):
-  """``weighted_choice([(choice, weight)]) -> choice``"""
-  total = sum(w for c, w in choices)
-  r = uniform(0, total)
-  upto = 0
-  for c, w in choices:
-    if w == 0:
-      continue
-    if upto + w >= r:
-      return c
-    upto += w
-  assert False, "Shouldn't get here"
+  """``weighted_choice([(choice, weight)]) -> choice``
+
+  If you're going to pick from the same list more than once, build a
+  :py:class:`WeightedTable` instead.
+  """
+  return WeightedTable(choices).choose()
 
 
-def _get_difficulty(bsp_leaf, difficulty_map):
+# The four difficulty quadrants. The BSP tree's first two splits are always
+# exactly in the middle (see _bsp_randrange()), so each quadrant is the
+# subtree at one of these paths. The 'aa', 'ab' notation is just a quicker,
+# less error-prone way of saying node.child_a.child_b and such.
+#
+# The player starts in the top left and works their way around clockwise.
+QUADRANT_PATHS_BY_DIFFICULTY = {
+  0: 'aa',
+  1: 'ab',
+  2: 'bb',
+  3: 'ba',
+}
+DIFFICULTIES_BY_QUADRANT_PATH = {
+  v: k for k, v in QUADRANT_PATHS_BY_DIFFICULTY.items()}
+DIFFICULTIES = range(len(QUADRANT_PATHS_BY_DIFFICULTY))
+
+
+class SpawnTables:
   """
-  *difficulty_map* is a dict mapping difficulty (int 1-4) to a BSPNode. Returns
-  the difficulty of the given leaf, based on which difficulty_map value is its
-  ancestor.
+  All the weighted tables the level generator needs, precomputed from the
+  data stores:
+
+  * ``room_types[difficulty]``: which kind of room goes in a leaf
+  * ``monster_types[(room_type_id, difficulty)]``: which monster goes in a
+    room
+  * ``item_types[difficulty]``: which item goes in a room
+
+  Tables only exist for combinations that can actually happen, i.e. room types
+  are only paired with difficulties they allow.
+
+  You probably want :py:func:`get_spawn_tables` instead of making these
+  yourself.
   """
-  for ancestor in bsp_leaf.ancestors:
-    for (k, v) in difficulty_map.items():
-      if v == ancestor:
-        return k
-  raise ValueError("Cannot determine difficulty for this room")
+  def __init__(self):
+    # Remember exactly which data we were built from, so get_spawn_tables()
+    # can tell when const.reload() has replaced it.
+    self.sources = _get_data_sources()
+
+    self.room_types = {
+      difficulty: WeightedTable([
+        (rt, rt.chance) for rt in room_types.items
+        if rt.difficulty is None or rt.difficulty == difficulty])
+      for difficulty in DIFFICULTIES}
+
+    self.monster_types = {}
+    for rt in room_types.items:
+      # Filter monster types by what this room says it can have
+      # (might be None for wildcard)
+      possible_monsters = (
+        list(monster_types.items) if rt.monsters is None
+        else [monster_types[mt_k] for mt_k in rt.monsters])
+      for difficulty in DIFFICULTIES:
+        if rt.difficulty is not None and rt.difficulty != difficulty:
+          continue
+        # Further filter monster types by whether the monster says it can be
+        # in a room of this difficulty (may be None for wildcard)
+        self.monster_types[(rt.id, difficulty)] = WeightedTable([
+          (mt, mt.chance) for mt in possible_monsters
+          if mt.difficulty is None or mt.difficulty == difficulty])
+
+    self.item_types = {
+      difficulty: WeightedTable([
+        (it, it.chance_by_difficulty[difficulty]) for it in item_types.items])
+      for difficulty in DIFFICULTIES}
+
+
+def _get_data_sources():
+  return tuple(
+    source
+    for store in (room_types, monster_types, item_types)
+    for source in store.sources)
+
+
+_spawn_tables = None
+def get_spawn_tables():
+  """
+  Returns a :py:class:`SpawnTables` for the currently loaded data, building it
+  only if the data has changed since the last call.
+  """
+  global _spawn_tables
+  if _spawn_tables is None or _spawn_tables.sources != _get_data_sources():
+    _spawn_tables = SpawnTables()
+  return _spawn_tables
 
 
 class Room:
@@ -58,52 +185,148 @@ class Room:
   Represents a fully connected set of points. Mutually exclusive to other
   rooms.
   """
-  def __init__(self, rect, room_type):
-    self.room_id = uuid4().hex
+  def __init__(self, room_id, rect, room_type):
+    # Rooms are numbered in the order they're generated, starting at 0
+    self.room_id = room_id
     self.room_type = room_type
     # Corridors are always None, rooms are 1-4. Determined by quadrant, i.e.
     # 2nd-topmost ancestor.
     self.difficulty = None
 
-    # If only I had had time to make more room shapes...
+    # Box rooms are floor everywhere inside their walls. Caves are lumpy, so
+    # they keep a boolean NumPy array the size of their rect, indexed
+    # [x - rect.x, y - rect.y], saying which cells are floor. Use the methods
+    # below instead of poking at this directly.
+    self.floor_mask = None
+    self._floor_points = None
+
     if room_type.shape == EnumRoomShape.BOX_RANDOM:
       self.rect = rect.get_random_rect(Size(5, 5))
     if room_type.shape == EnumRoomShape.BOX_FULL:
       self.rect = rect
+    if room_type.shape == EnumRoomShape.CAVE:
+      self.rect = rect
+      self.floor_mask = generate_cave_floor(rect.size)
+
+  @classmethod
+  def restore(cls, room_id, room_type, difficulty, rect, floor_mask=None):
+    """
+    Recreate a room that was already generated, with its exact shape, rather
+    than making up a new one. Used by serialization.py.
+    """
+    room = cls.__new__(cls)
+    room.room_id = room_id
+    room.room_type = room_type
+    room.difficulty = difficulty
+    room.rect = rect
+    room.floor_mask = floor_mask
+    room._floor_points = None
+    return room
+
+  @property
+  def floor_points(self):
+    """List of all floor points in this room"""
+    if self._floor_points is None:
+      if self.floor_mask is None:
+        self._floor_points = list(self.rect.with_inset(1).points)
+      else:
+        (xs, ys) = np.nonzero(self.floor_mask)
+        self._floor_points = [
+          Point(self.rect.x + int(x), self.rect.y + int(y))
+          for (x, y) in zip(xs, ys)]
+    return self._floor_points
+
+  @property
+  def floor_area(self):
+    """Number of floor cells in this room"""
+    if self.floor_mask is None:
+      return self.rect.with_inset(1).area
+    return len(self.floor_points)
+
+  @property
+  def first_floor_point(self):
+    """Some floor point in this room; always the same one"""
+    if self.floor_mask is None:
+      return self.rect.with_inset(1).origin
+    return self.floor_points[0]
+
+  def get_random_floor_point(self):
+    """Returns a random floor point in this room"""
+    if self.floor_mask is None:
+      return self.rect.with_inset(1).get_random_point()
+    return choice(self.floor_points)
+
+
+# Cellular automaton settings for CAVE rooms. Start with roughly this fraction
+# of cells being rock, then smooth it this many times.
+CAVE_INITIAL_ROCK_CHANCE = 0.45
+CAVE_SMOOTHING_ITERATIONS = 4
+# If the cave comes out smaller than this many cells, give up and use a box.
+CAVE_MIN_FLOOR_AREA = 9
+
+
+def _count_neighborhood(grid, pad_value):
+  """
+  For a 2D boolean NumPy array, returns an array of the same shape counting
+  the ``True`` cells in each 3x3 neighborhood (including the center). Cells
+  off the edge count as *pad_value*.
+
+  This is a convolution, done the easy way: add up 9 shifted copies of the
+  array.
+  """
+  (width, height) = grid.shape
+  padded = np.pad(grid, 1, mode='constant', constant_values=pad_value)
+  counts = np.zeros(grid.shape, dtype=np.int8)
+  for dx in range(3):
+    for dy in range(3):
+      counts += padded[dx:dx + width, dy:dy + height]
+  return counts
 
 
-def generate_room(bsp_leaf, difficulty_map):
+def generate_cave_floor(size):
+  """
+  Returns a boolean NumPy array of the given size, indexed [x, y], that is
+  ``True`` for the floor cells of a cave. The outermost ring of cells is never
+  floor (walls need to go somewhere), and the floor is always one connected
+  blob.
+
+  This is the classic cellular automaton cave: start with random noise, then
+  repeatedly turn each cell into rock if most of its neighborhood is rock, or
+  floor if it isn't. Every step works on the whole cave at once.
+  """
+  floor = np.zeros((size.width, size.height), dtype=bool)
+  inner_width = size.width - 2
+  inner_height = size.height - 2
+  if inner_width * inner_height < CAVE_MIN_FLOOR_AREA:
+    floor[1:-1, 1:-1] = True
+    return floor
+
+  # Seed NumPy from the random module so the same seed makes the same caves
+  np_random = np.random.RandomState(getrandbits(32))
+  is_rock = np_random.random_sample((inner_width, inner_height)) < CAVE_INITIAL_ROCK_CHANCE
+  for _ in range(CAVE_SMOOTHING_ITERATIONS):
+    # 5 or more out of 9 means mostly rock. Off the edge is all rock.
+    is_rock = _count_neighborhood(is_rock, True) >= 5
+
+  # Smoothing can leave little pockets of floor, so only keep the biggest one.
+  components = get_components(~is_rock)
+  if components.num_components:
+    largest = np.argmax(components.sizes)
+    floor[1:-1, 1:-1] = components.labels == largest
+  if floor.sum() < CAVE_MIN_FLOOR_AREA:
+    floor[1:-1, 1:-1] = True
+  return floor
+
+
+def generate_room(room_id, bsp_leaf, difficulty, spawn_tables):
   """
   Decorate *bsp_leaf* with a Room object
   """
-  difficulty = _get_difficulty(bsp_leaf, difficulty_map)
-
   assert(bsp_leaf.rect)
 
-  room_type_options = [
-    rt for rt in room_types.items
-    if rt.difficulty is None or rt.difficulty == difficulty]
-
-  bsp_leaf.data['room'] = Room(
-    bsp_leaf.rect,
-    weighted_choice([(rt, rt.chance) for rt in room_type_options]))
-  return bsp_leaf.data['room']
-
-
-def get_room_nearest(leaves, target_point):
-  """
-  From the iterable of leaves, find the room closes to the given point.
-  This is used for placement of stairs and inter-quadrant special corridors.
-  """
-  leaves = list(leaves)
-  room = leaves[0].data['room']
-  distance = room.rect.center.manhattan_distance_to(target_point)
-  for leaf in leaves:
-    inner_room = leaf.data['room']
-    inner_distance = inner_room.rect.center.manhattan_distance_to(target_point)
-    if inner_distance < distance:
-      room = inner_room
-      distance = inner_distance
+  room = Room(room_id, bsp_leaf.rect, spawn_tables.room_types[difficulty].choose())
+  room.difficulty = difficulty
+  bsp_leaf.data['room'] = room
   return room
 
 
@@ -120,6 +343,12 @@ def engrave_rooms(tilemap, rooms):
   """
   for room in rooms:
     tilemap.rooms_by_id[room.room_id] = room
+    tilemap.room_graph.add_room(room)
+
+    if room.floor_mask is not None:
+      engrave_cave(tilemap, room)
+      continue
+
     for corner in room.rect.points_corners:
       tilemap.cell(corner).terrain = terrain_types.WALL
     tilemap.cell(room.rect.origin).annotations.add('corner_top_left')
@@ -143,65 +372,218 @@ def engrave_rooms(tilemap, rooms):
       tilemap.cell(point).terrain = terrain_types.FLOOR
 
     # tell cells what room they are in
-    for point in room.rect.points:
-      tilemap.assign_room(point, room.room_id)
+    tilemap.assign_room_rect(room.rect, room.room_id)
+
+
+# Which annotation a cave wall gets depending on which of its neighbors are
+# also walls. draw_game() checks corners last, so corners win.
+_CAVE_WALL_ANNOTATIONS = (
+  # (annotation, left, right, up, down): None means "don't care"
+  ('horz', True, None, None, None),
+  ('horz', None, True, None, None),
+  ('vert', None, None, True, None),
+  ('vert', None, None, None, True),
+  ('corner_top_left', False, True, False, True),
+  ('corner_top_right', True, False, False, True),
+  ('corner_bottom_left', False, True, True, False),
+  ('corner_bottom_right', True, False, True, False),
+)
+
 
+def engrave_cave(tilemap, room):
+  """
+  Like engrave_rooms(), but for a single CAVE room. Walls go on every non-
+  floor cell next to the floor (diagonals included), and the rest of the rect
+  is left as EMPTY rock.
 
-def generate_random_path(tilemap, rect1, rect2):
+  All the work of figuring out which cells are walls and how to draw them is
+  done on whole NumPy arrays. Only the final "put it in the cells" step looks
+  at cells one at a time.
+  """
+  floor = room.floor_mask
+  (width, height) = floor.shape
+  is_wall = (_count_neighborhood(floor, False) > 0) & ~floor
+
+  # Which neighbors of each cell are walls? Off the edge never is.
+  padded = np.pad(is_wall, 1, mode='constant', constant_values=False)
+  neighbors = (
+    padded[:-2, 1:-1],  # left
+    padded[2:, 1:-1],   # right
+    padded[1:-1, :-2],  # up
+    padded[1:-1, 2:],   # down
+  )
+  # Give each wall cell a bit for each annotation it gets
+  annotation_bits = np.zeros(floor.shape, dtype=np.uint8)
+  for (i, (_, *wanted)) in enumerate(_CAVE_WALL_ANNOTATIONS):
+    matches = is_wall.copy()
+    for (neighbor, want) in zip(neighbors, wanted):
+      if want is not None:
+        matches &= neighbor if want else ~neighbor
+    annotation_bits |= matches.astype(np.uint8) << i
+  # Walls with no wall neighbors at all still need to be drawn as something
+  annotation_bits[is_wall & (annotation_bits == 0)] = 1
+
+  # The DataStore lookups are surprisingly slow, so only do them once
+  wall = terrain_types.WALL
+  floor_terrain = terrain_types.FLOOR
+  origin = room.rect.origin
+  for point in room.floor_points:
+    tilemap.cell(point).terrain = floor_terrain
+  (xs, ys) = np.nonzero(is_wall)
+  for (x, y, bits) in zip(xs.tolist(), ys.tolist(), annotation_bits[xs, ys].tolist()):
+    cell = tilemap.cell(Point(origin.x + x, origin.y + y))
+    cell.terrain = wall
+    cell.annotations.update(
+      annotation for (i, (annotation, *_)) in enumerate(_CAVE_WALL_ANNOTATIONS)
+      if bits & (1 << i))
+
+  # tell cells what room they are in
+  tilemap.assign_room_rect(room.rect, room.room_id)
+
+
+class WallCounts:
   """
-  Returns two lists based on an L-shaped path between a random point in *rect1*
-  and a random point in *rect2*.
+  Answers "how many walls are on this line?" for any horizontal or vertical
+  line in the tilemap, in constant time, using prefix sums over the wall
+  cells. (A prefix sum is just a running total: if you know how many walls
+  there are in a row up to column 10 and up to column 3, you know how many
+  there are between 3 and 10 without looking at them.)
+
+  Call :py:meth:`update` after turning walls into something else, or the
+  counts for those rows and columns will be stale.
+  """
+  def __init__(self, tilemap):
+    self.tilemap = tilemap
+    self._wall_index = TERRAIN_INDEXES[terrain_types.WALL]
+    walls = tilemap.terrain_ids == self._wall_index
+    width, height = walls.shape
+    # _sums_x[x, y] is the number of walls in row y to the left of column x.
+    # _sums_y[x, y] is the number of walls in column x above row y.
+    self._sums_x = np.zeros((width + 1, height), dtype=np.int32)
+    np.cumsum(walls, axis=0, out=self._sums_x[1:, :])
+    self._sums_y = np.zeros((width, height + 1), dtype=np.int32)
+    np.cumsum(walls, axis=1, out=self._sums_y[:, 1:])
+
+  def update(self, points):
+    """Recompute the rows and columns containing *points*"""
+    terrain_ids = self.tilemap.terrain_ids
+    for y in set(p.y for p in points):
+      np.cumsum(
+        terrain_ids[:, y] == self._wall_index, out=self._sums_x[1:, y])
+    for x in set(p.x for p in points):
+      np.cumsum(
+        terrain_ids[x, :] == self._wall_index, out=self._sums_y[x, 1:])
+
+  def count_horz(self, y, x1, x2):
+    """Number of walls in row *y* between *x1* and *x2* inclusive"""
+    if x1 > x2:
+      x1, x2 = x2, x1
+    return int(self._sums_x[x2 + 1, y] - self._sums_x[x1, y])
+
+  def count_vert(self, x, y1, y2):
+    """Number of walls in column *x* between *y1* and *y2* inclusive"""
+    if y1 > y2:
+      y1, y2 = y2, y1
+    return int(self._sums_y[x, y2 + 1] - self._sums_y[x, y1])
+
+  def count_path_L(self, start, end):
+    """
+    Number of walls on ``start.path_L_to(end)``, which goes horizontally
+    first and then vertically
+    """
+    corner_is_wall = self.tilemap.terrain_ids[end.x, start.y] == self._wall_index
+    return (
+      self.count_horz(start.y, start.x, end.x) +
+      self.count_vert(end.x, start.y, end.y) -
+      int(corner_is_wall))
+
+
+# A corridor that goes through more walls than this starts to look silly.
+MAX_DOORS_PER_CORRIDOR = 4
+# How many pairs of endpoints plan_corridor() considers
+NUM_CORRIDOR_CANDIDATES = 8
+
+
+def plan_corridor(wall_counts, room1, room2):
+  """
+  Pick the endpoints of an L-shaped path between a random floor point in
+  *room1* and a random floor point in *room2*. Returns ``(start, end)``; the
+  path is ``start.path_L_to(end)``.
+
+  Several random pairs of endpoints are considered, with both elbow
+  orientations (horizontal-first from the *room1* end, or from the *room2*
+  end). Since *wall_counts* can count the walls on a path without walking it,
+  this costs the same every time. The first candidate that needs no more than
+  MAX_DOORS_PER_CORRIDOR doors wins. If none of them do, the one with the
+  fewest doors wins.
+  """
+  best = None
+  for _ in range(NUM_CORRIDOR_CANDIDATES):
+    a = room1.get_random_floor_point()
+    b = room2.get_random_floor_point()
+    for (start, end) in ((a, b), (b, a)):
+      num_doors = wall_counts.count_path_L(start, end)
+      if num_doors <= MAX_DOORS_PER_CORRIDOR:
+        return (start, end)
+      if best is None or num_doors < best[0]:
+        best = (num_doors, start, end)
+  return best[1:]
+
+
+def get_path_cells(tilemap, start, end):
+  """
+  Returns two lists of cells on ``start.path_L_to(end)``.
 
-  The first list contains all points in the path that have WALL terrain. These
+  The first list contains all cells in the path that have WALL terrain. These
   are for doors.
 
-  The second list contains all points in the path that have EMPTY terrain. These
-  are for corridor tiles.
+  The second list contains all cells in the path that have EMPTY terrain.
+  These are for corridor tiles.
   """
-  start = rect1.get_random_point()
-  end = rect2.get_random_point()
-  points_in_path = set()
-  doors = set()
-  corridors = set()
+  doors = []
+  corridors = []
   for point in start.path_L_to(end):
-    points_in_path.add(point)
     cell = tilemap.cell(point)
     if cell.terrain == terrain_types.WALL:
-      doors.add(cell)
+      doors.append(cell)
     elif (cell.terrain == terrain_types.EMPTY or not cell.terrain):
-      corridors.add(cell)
+      corridors.append(cell)
   return (doors, corridors)
 
 
-def engrave_corridor_between_rooms(tilemap, a, b, annotation=None):
+def engrave_corridor_between_rooms(tilemap, wall_counts, a, b, annotation=None):
   """
   Draw an L-shaped corridor between the two given rooms, making doors where it
-  intersects with a wall.
+  intersects with a wall. *wall_counts* is the :py:class:`WallCounts` for
+  *tilemap*; it's kept up to date as walls turn into doors.
 
   Optionally set an annotation on each cell. This is used to mark the
   transitions between difficulty quadrants, so that GameScene can transition
   the music and heal the player.
+
+  The corridor is also added to ``tilemap.room_graph``, connecting *a*, *b*,
+  and any room whose wall it cuts through.
   """
-  (doors, corridors) = generate_random_path(
-    tilemap,
-    a.rect.with_inset(1),
-    b.rect.with_inset(1))
-  iter_count = 0
-  # If path contains more than 4 doors, try again, but don't try more than
-  # 10 times.
-  while len(doors) > 4 and iter_count < 10:
-    iter_count += 1
-    (doors, corridors) = generate_random_path(
-      tilemap,
-      a.rect.with_inset(1),
-      b.rect.with_inset(1))
+  (start, end) = plan_corridor(wall_counts, a, b)
+  (doors, corridors) = get_path_cells(tilemap, start, end)
   for door in doors:
     door.terrain = terrain_types.DOOR_CLOSED
+  wall_counts.update([door.point for door in doors])
   for corridor in corridors:
     corridor.terrain = terrain_types.CORRIDOR
     if annotation:
       corridor.annotations.add(annotation)
 
+  room_ids = [a.room_id, b.room_id]
+  for door in doors:
+    if door.room_id not in room_ids:
+      room_ids.append(door.room_id)
+  return tilemap.room_graph.add_corridor(
+    room_ids,
+    [door.point for door in doors],
+    [corridor.point for corridor in corridors],
+    annotation)
+
 
 def generate_and_engrave_corridors(tilemap, root):
   """
@@ -214,39 +596,105 @@ def generate_and_engrave_corridors(tilemap, root):
     (remember the blog post!) does not have a corridor to its sibling. Instead,
     explicitly draw corridors between specific rooms in each quadrant.
   """
+  wall_counts = WallCounts(tilemap)
+
   # generate corridors between rooms WITHIN a quadrant
   sibling_pairs = [(a, b) for (a, b) in root.sibling_pairs if a.level > 2 and b.level > 2]
   for (a, b) in sibling_pairs:
     engrave_corridor_between_rooms(
-      tilemap, a.leftmost_leaf.data['room'], b.leftmost_leaf.data['room'])
+      tilemap, wall_counts,
+      a.leftmost_leaf.data['room'], b.leftmost_leaf.data['room'])
 
   # generate corridors between quadrants (the glowing ones)
-  room_aa_bottom = get_room_nearest(
-    root.get_node_at_path('aa').leaves,
-    Point(0, tilemap.size.height / 2))
-  room_ab_top = get_room_nearest(
-    root.get_node_at_path('ab').leaves,
-    room_aa_bottom.rect.center)
+  graph = tilemap.room_graph
+  room_aa_bottom = graph.get_room_nearest(
+    Point(0, tilemap.size.height / 2), difficulty=0)
+  room_ab_top = graph.get_room_nearest(
+    room_aa_bottom.rect.center, difficulty=1)
   engrave_corridor_between_rooms(
-    tilemap, room_aa_bottom, room_ab_top, 'transition-1-2')
-
-  room_ab_right = get_room_nearest(
-    root.get_node_at_path('ab').leaves,
-    Point(tilemap.size.width / 2, tilemap.size.height))
-  room_bb_left = get_room_nearest(
-    root.get_node_at_path('bb').leaves,
-    room_ab_right.rect.center)
+    tilemap, wall_counts, room_aa_bottom, room_ab_top, 'transition-1-2')
+
+  room_ab_right = graph.get_room_nearest(
+    Point(tilemap.size.width / 2, tilemap.size.height), difficulty=1)
+  room_bb_left = graph.get_room_nearest(
+    room_ab_right.rect.center, difficulty=2)
   engrave_corridor_between_rooms(
-    tilemap, room_ab_right, room_bb_left, 'transition-2-3')
-
-  room_bb_top = get_room_nearest(
-    root.get_node_at_path('bb').leaves,
-    Point(tilemap.size.width, tilemap.size.height / 2))
-  room_ba_bottom = get_room_nearest(
-    root.get_node_at_path('ba').leaves,
-    room_bb_top.rect.center)
+    tilemap, wall_counts, room_ab_right, room_bb_left, 'transition-2-3')
+
+  room_bb_top = graph.get_room_nearest(
+    Point(tilemap.size.width, tilemap.size.height / 2), difficulty=2)
+  room_ba_bottom = graph.get_room_nearest(
+    room_bb_top.rect.center, difficulty=3)
   engrave_corridor_between_rooms(
-    tilemap, room_bb_top, room_ba_bottom, 'transition-3-4')
+    tilemap, wall_counts, room_bb_top, room_ba_bottom, 'transition-3-4')
+
+
+def get_orphaned_rooms(tilemap, report):
+  """
+  Returns a dict mapping component number to the list of rooms in that
+  component, for every component in the given
+  :py:class:`~ld38.connectivity.ConnectivityReport` *except* the one
+  containing the stairs up. In other words, all the rooms the player can't
+  get to.
+  """
+  if report.num_components == 1:
+    return {}
+  labels = report.labels
+  stairs_up = tilemap.points_of_interest['stairs_up']
+  main_component = labels[stairs_up.x, stairs_up.y]
+  orphans = defaultdict(list)
+  for room in tilemap.room_graph.rooms_by_id.values():
+    floor_point = room.first_floor_point
+    component = labels[floor_point.x, floor_point.y]
+    if component != main_component:
+      orphans[component].append(room)
+  return orphans
+
+
+# How many extra corridors repair_connectivity() is willing to carve before
+# giving up on a map
+MAX_REPAIR_CORRIDORS = 8
+
+
+def repair_connectivity(tilemap):
+  """
+  Make sure every room (and therefore the stairs down) can be reached from the
+  stairs up. If some can't, carve a corridor from the orphaned room closest to
+  a reachable room, preferring rooms in the same quadrant, and check again.
+
+  Returns ``(report, is_connected)``, where *report* is the final
+  :py:class:`~ld38.connectivity.ConnectivityReport`.
+  """
+  wall_counts = None
+  for _ in range(MAX_REPAIR_CORRIDORS):
+    report = get_connectivity_report(tilemap)
+    orphans = get_orphaned_rooms(tilemap, report)
+    if not orphans:
+      return (report, True)
+
+    orphan_ids = set(
+      room.room_id for rooms in orphans.values() for room in rooms)
+    reachable_by_difficulty = defaultdict(RoomCenterIndex)
+    reachable = RoomCenterIndex()
+    for room in tilemap.room_graph.rooms_by_id.values():
+      if room.room_id not in orphan_ids:
+        reachable_by_difficulty[room.difficulty].add(room)
+        reachable.add(room)
+
+    best = None  # (distance, orphan room, reachable room)
+    for rooms in orphans.values():
+      for room in rooms:
+        index = reachable_by_difficulty.get(room.difficulty, reachable)
+        target = index.get_nearest(room.rect.center)
+        distance = target.rect.center.manhattan_distance_to(room.rect.center)
+        if best is None or distance < best[0]:
+          best = (distance, room, target)
+
+    wall_counts = wall_counts or WallCounts(tilemap)
+    engrave_corridor_between_rooms(tilemap, wall_counts, best[1], best[2])
+
+  report = get_connectivity_report(tilemap)
+  return (report, not get_orphaned_rooms(tilemap, report))
 
 
 def engrave_bsp_divisions(tilemap, node):
@@ -271,16 +719,6 @@ def engrave_bsp_divisions(tilemap, node):
     engrave_bsp_divisions(tilemap, node.child_b)
 
 
-def engrave_difficulty(root):
-  """
-  Tell all the cells what their difficulty is. This is mostly so GameScene
-  can fade up the appropriate music. :-)
-  """
-  for i, path in enumerate(['aa', 'ab', 'bb', 'ba']):
-    for leaf in root.get_node_at_path(path).leaves:
-      leaf.data['room'].difficulty = i
-
-
 def get_can_add_monster_at_point(tilemap, point):
   """Returns True iff you can add a monster at the given point"""
   if point in tilemap.occupied_cells:
@@ -295,7 +733,7 @@ get_can_add_item_at_point = get_can_add_monster_at_point
 
 
 MonsterData = namedtuple('MonsterData', ['monster_type', 'position', 'difficulty'])
-def place_monsters(tilemap):
+def place_monsters(tilemap, spawn_tables):
   """
   Tell the tilemap where the monsters go. This just populates the tilemap's
   ``points_of_interest`` property, which is how LevelState knows where to spawn
@@ -304,34 +742,23 @@ def place_monsters(tilemap):
   monster_datas = []
   # spawn monsters room by room
   for room in tilemap.rooms_by_id.values():
-    rt = room.room_type
-
-    # Filter monster types by what this room says it can have
-    # (might be None for wildcard)
-    possible_monsters = (
-      list(monster_types.items) if rt.monsters is None
-      else [monster_types[mt_k] for mt_k in room.room_type.monsters])
-    # Further filter monster types by whether the monster says it can be in
-    # a room of this difficulty (may be None for wildcard)
-    allowed_monster_types = [
-      mt for mt in possible_monsters
-      if mt.difficulty is None or mt.difficulty == room.difficulty]
-
-    # The room rect covers the walls, so inset by 1 before picking a point
-    # from it
-    inner_rect = room.rect.with_inset(1)
+    # SpawnTables has already worked out which monsters are allowed in this
+    # kind of room at this difficulty, and how likely each one is.
+    monster_table = spawn_tables.monster_types[
+      (room.room_type.id, room.difficulty)]
+
     # Compute how many monsters we can have (data file number is per 100 cells)
     num_monsters = max(
-      1, round(inner_rect.area * room.room_type.monster_density / 100.0))
+      1, round(room.floor_area * room.room_type.monster_density / 100.0))
 
     # The rest of this should be pretty self-explanatory
     for _ in range(num_monsters):
-      point = inner_rect.get_random_point()
-      mt = weighted_choice([(mt, mt.chance) for mt in allowed_monster_types])
+      point = room.get_random_floor_point()
+      mt = monster_table.choose()
 
       i = 0
       while not get_can_add_monster_at_point(tilemap, point) and i < 10:
-        point = inner_rect.get_random_point()
+        point = room.get_random_floor_point()
         i += 1
       if i >= 10:
         print("Unable to place monster; skipping")
@@ -344,7 +771,7 @@ def place_monsters(tilemap):
 
 
 ItemData = namedtuple('ItemData', ['item_type', 'position'])
-def place_items(tilemap):
+def place_items(tilemap, spawn_tables):
   """
   Tell the tilemap where the items go. This just populates the tilemap's
   ``points_of_interest`` property, which is how LevelState knows where to spawn
@@ -355,15 +782,13 @@ def place_items(tilemap):
   item_datas = []
   tilemap.points_of_interest['items'] = item_datas 
   for room in tilemap.rooms_by_id.values():
-    inner_rect = room.rect.with_inset(1)
-    num_items = max(1, round(inner_rect.area * room.room_type.item_density / 100.0))
+    item_table = spawn_tables.item_types[room.difficulty]
+    num_items = max(1, round(room.floor_area * room.room_type.item_density / 100.0))
 
     # +1 = gold
     for i in range(num_items + 1):
-      point = inner_rect.get_random_point()
-      it = weighted_choice([
-        (it, it.chance_by_difficulty[room.difficulty])
-        for it in item_types.items])
+      point = room.get_random_floor_point()
+      it = item_table.choose()
 
       # spawn one gold per room
       if i == 0:
@@ -371,7 +796,7 @@ def place_items(tilemap):
 
       i = 0
       while not get_can_add_item_at_point(tilemap, point) and i < 10:
-        point = inner_rect.get_random_point()
+        point = room.get_random_floor_point()
         i += 1
       if i >= 10:
         print("Unable to place item; skipping")
@@ -398,12 +823,50 @@ def _bsp_randrange(level, a, b):
     return randrange(a, b)
 
 
-def generate_dungeon(size):
+# How many times generate_dungeon() will throw away a map it couldn't repair
+# before giving up and using it anyway
+MAX_GENERATION_ATTEMPTS = 5
+
+
+def generate_dungeon(size, spawn_tables=None, check_connectivity=True):
   """
   Tie it all together. Returns a fully populated RogueBasementTilemap of the
   given size.
+
+  *spawn_tables* is a :py:class:`SpawnTables`. If you leave it out, the cached
+  one from :py:func:`get_spawn_tables` is used.
+
+  If *check_connectivity* is ``True`` (the default), make sure every room can
+  be reached from the stairs up, repairing or regenerating the map if not.
+  The final :py:class:`~ld38.connectivity.ConnectivityReport` is stored in
+  ``tilemap.points_of_interest['connectivity']``.
   """
+  spawn_tables = spawn_tables or get_spawn_tables()
+
+  for _ in range(MAX_GENERATION_ATTEMPTS):
+    tilemap = generate_layout(size, spawn_tables)
+    if not check_connectivity:
+      break
+    (report, is_connected) = repair_connectivity(tilemap)
+    tilemap.points_of_interest['connectivity'] = report
+    if is_connected:
+      break
+    print("Generated a map with unreachable rooms; trying again")
+  else:
+    print("Unable to generate a fully connected map; using it anyway")
 
+  # Figure out where the monsters and items go
+  place_monsters(tilemap, spawn_tables)
+  place_items(tilemap, spawn_tables)
+  tilemap.mark_base_terrain()
+  return tilemap
+
+
+def generate_layout(size, spawn_tables):
+  """
+  Returns a RogueBasementTilemap of the given size with rooms, corridors, and
+  stairs, but no monsters or items.
+  """
   # Make a blank tilemap
   tilemap = RogueBasementTileMap(size)
 
@@ -411,48 +874,34 @@ def generate_dungeon(size):
   # function is the helper defined just above this function
   generator = RandomBSPTree(tilemap.size, 4, randrange_func=_bsp_randrange)
 
-  # key is difficulty (int).
-  # values are the topmost ancestor for all nodes of that difficulty. A node
-  # knows what difficulty it is based on which ancestor it has.
-  difficulty_map = {
-    # This 'aa', 'ab' notation is just a quicker, less error-prone way of
-    # saying node.child_a.child_b and such.
-    0: generator.root.get_node_at_path('aa'),
-    1: generator.root.get_node_at_path('ab'),
-    2: generator.root.get_node_at_path('bb'),
-    3: generator.root.get_node_at_path('ba'),
-  }
-
-  # Create a room in each leaf
-  rooms = [generate_room(leaf, difficulty_map) for leaf in generator.root.leaves]
-  # Set the cell terrain values
+  # Create a room in each leaf. Each quadrant's subtree is walked exactly
+  # once, and every leaf in it gets that quadrant's difficulty. The leaves
+  # are visited in the same order as generator.root.leaves.
+  rooms = []
+  for path in sorted(QUADRANT_PATHS_BY_DIFFICULTY.values()):
+    difficulty = DIFFICULTIES_BY_QUADRANT_PATH[path]
+    for leaf in generator.root.get_node_at_path(path).leaves:
+      rooms.append(generate_room(len(rooms), leaf, difficulty, spawn_tables))
+  # Set the cell terrain values, and add the rooms to the room graph
   engrave_rooms(tilemap, rooms)  
   # Make corridors
   generate_and_engrave_corridors(tilemap, generator.root)
 
   # Place stairs up (no game value, just a marker)
-  stairs_up_room = get_room_nearest(
-    generator.root.get_node_at_path('aa').leaves,
-    Point(tilemap.size.width / 2, tilemap.size.height / 4))
-  stairs_up = stairs_up_room.rect.with_inset(1).get_random_point()
+  stairs_up_room = tilemap.room_graph.get_room_nearest(
+    Point(tilemap.size.width / 2, tilemap.size.height / 4), difficulty=0)
+  stairs_up = stairs_up_room.get_random_floor_point()
   tilemap.points_of_interest['stairs_up'] = stairs_up
   tilemap.occupied_cells.add(stairs_up)
   tilemap.cell(tilemap.points_of_interest['stairs_up']).feature = EnumFeature.STAIRS_UP
 
   # Place stairs down
-  stairs_down_room = get_room_nearest(
-    generator.root.get_node_at_path('ba').leaves, Point(tilemap.size.width / 2, tilemap.size.height / 2))
-  stairs_down = stairs_down_room.rect.with_inset(1).get_random_point()
+  stairs_down_room = tilemap.room_graph.get_room_nearest(
+    Point(tilemap.size.width / 2, tilemap.size.height / 2), difficulty=3)
+  stairs_down = stairs_down_room.get_random_floor_point()
   tilemap.points_of_interest['stairs_down'] = stairs_down
   tilemap.occupied_cells.add(stairs_down)
   tilemap.cell(tilemap.points_of_interest['stairs_down']).feature = EnumFeature.STAIRS_DOWN
 
-  # Tell all the cells how difficult they are (you know, for the music)
-  engrave_difficulty(generator.root)
-
-  # Figure out where the monsters and items go
-  place_monsters(tilemap)
-  place_items(tilemap)
-
   #engrave_bsp_divisions(tilemap, generator.root)
   return tilemap
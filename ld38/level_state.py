@@ -2,15 +2,17 @@
 # reference cycles! Weakref is used to hold a reference to the parent
 # GameState object.
 import weakref
+# consume_events() can be told how long it's allowed to take
+import time
 # Everything that happens is associated with an event. The event processing
 # system keeps events to be processed in a queue.
 from collections import deque
-# Levels assign their own arbitrary unique IDs.
-from uuid import uuid4
+
+import numpy as np
 
 # You should really go read the docs on this:
 # http://steveasleep.com/clubsandwich/api_event_dispatcher.html
-from clubsandwich.event_dispatcher import EventDispatcher
+from clubsandwich.event_dispatcher import Event, EventDispatcher
 # "Better to ask forgiveness than beg for permission" - LevelState's approach
 # to querying cell data
 from clubsandwich.tilemap import CellOutOfBoundsError
@@ -25,24 +27,59 @@ from .behavior import (
 )
 from .const import (
   EnumEventNames,
+  NOTHING_INDEX,
   monster_types,
   item_types,
 )
+from .actions import resolve_plans
+from .projectiles import Projectiles
+from .scheduler import Scheduler
+
+
+# If True, monsters whose turns come up together all decide what to do
+# before any of them does anything. See LevelState.take_turns().
+PLAN_TURNS_TOGETHER = False
+
+
+def _get_speed(entity):
+  return entity.speed
+
+
+def _read_only(array):
+  # A view shares the array's memory, so it's always up to date, but nobody
+  # can write to the array through it
+  view = array.view()
+  view.flags.writeable = False
+  return view
 
 
 # LevelState stores all information related to a single map and its
 # inhabitants. It also handles the event loop.
 class LevelState:
-  def __init__(self, tilemap, game_state):
+  def __init__(self, tilemap, game_state, populate=True):
     # Things that don't change
     self._game_state = weakref.ref(game_state)
     self.tilemap = tilemap
-    self.uuid = uuid4().hex
+    # GameState.add_level() numbers the levels from the top, starting at 0
+    self.level_id = None
 
     # Things that do change
     self.event_queue = deque()
+    # All entities on the map, in the order they were added. This is also the
+    # order their behaviors get events in.
+    self.entities = []
     self.entity_by_position = {}
     self.items_by_position = {}
+    # Thrown things that haven't landed yet. They aren't entities; see
+    # projectiles.py.
+    self.projectiles = Projectiles(self)
+    # Whose turn it is. See scheduler.py.
+    self.scheduler = Scheduler()
+    # While monsters are planning their turns, the actions they take go in
+    # here instead of happening. See take_turns().
+    self.plans = None
+    # What consume_events() is in the middle of, if it ran out of time
+    self._event_steps = None
     self._is_applying_events = False
 
     # This is the object that remembers who wants to know about what, and what
@@ -53,8 +90,37 @@ class LevelState:
     for name in EnumEventNames:
       self.dispatcher.register_event_type(name)
 
-    # Player is special, create them explicitly
     self.player = None
+    self.level_memory_cache = set()
+    self.los_cache = set()
+
+    # The same information as the sets and dicts above, as NumPy grids
+    # indexed [x, y] like tilemap.terrain_ids. They're updated a little at a
+    # time as things happen, by the methods below that change the level, so
+    # reading them is free. Bots, GameBatch and anything else that wants to
+    # look at the whole level at once should use the read-only views
+    # (terrain_ids, remembered_mask, visible_mask, entity_type_ids,
+    # entity_hp, item_type_ids) instead of walking the cells.
+    size = (tilemap.size.width, tilemap.size.height)
+    self._remembered_mask = np.zeros(size, dtype=np.bool_)
+    self._visible_mask = np.zeros(size, dtype=np.bool_)
+    self._entity_type_ids = np.full(size, NOTHING_INDEX, dtype=np.int16)
+    self._entity_hp = np.zeros(size, dtype=np.int32)
+    # The top (last dropped) item in each cell
+    self._item_type_ids = np.full(size, NOTHING_INDEX, dtype=np.int16)
+    self.terrain_ids = _read_only(tilemap.terrain_ids)
+    self.remembered_mask = _read_only(self._remembered_mask)
+    self.visible_mask = _read_only(self._visible_mask)
+    self.entity_type_ids = _read_only(self._entity_type_ids)
+    self.entity_hp = _read_only(self._entity_hp)
+    self.item_type_ids = _read_only(self._item_type_ids)
+
+    # serialization.py fills in the player, monsters and items itself when it
+    # loads a level that has already been played
+    if not populate:
+      return
+
+    # Player is special, create them explicitly
     self.player = self.create_entity(
       monster_types.PLAYER,
       self.tilemap.points_of_interest['stairs_up'])
@@ -71,7 +137,6 @@ class LevelState:
     # There are two sets of points: points the player can see right now
     # (self.los_cache), and points the player has seen in the past
     # (self.level_memory_cache). self.update_los_cache() keeps both up to date.
-    self.level_memory_cache = set()
     self.update_los_cache()
 
   # Expose the GameState weakref as a property for convenience
@@ -85,20 +150,41 @@ class LevelState:
   # seen from the given vantage point.
   def update_los_cache(self):
     self.los_cache = get_visible_points(self.player.position, self.get_can_see)
+    self._visible_mask[:] = False
+    if self.los_cache:
+      (xs, ys) = self._points_to_indexes(self.los_cache)
+      self._visible_mask[xs, ys] = True
+      self._remembered_mask[xs, ys] = True
     self.level_memory_cache.update(self.los_cache)
 
+  def remember(self, points):
+    """Add *points* to what the player remembers, like when loading a level"""
+    points = set(points)
+    if points:
+      self._remembered_mask[self._points_to_indexes(points)] = True
+    self.level_memory_cache.update(points)
+
+  def _points_to_indexes(self, points):
+    # The FoV includes cells past the edge of the map when the player is next
+    # to it. They don't fit in the grids (or worse, negative ones wrap around
+    # to the other side), so leave them out.
+    (width, height) = self._visible_mask.shape
+    points = [p for p in points if 0 <= p.x < width and 0 <= p.y < height]
+    xs = np.fromiter((p.x for p in points), dtype=np.intp, count=len(points))
+    ys = np.fromiter((p.y for p in points), dtype=np.intp, count=len(points))
+    return (xs, ys)
+
   # Create an entity, instantiate its behaviors, put it on the map
   def create_entity(self, monster_type, position, behavior_state=None):
     mt = monster_type
-    if mt.id == 'PLAYER':
-      # Only create one player at a time!
-      assert self.player is None
-
     # No overlapping entities, please
     assert position not in self.entity_by_position
 
     # Instantiate the entity
     entity = Entity(monster_type=mt)
+    if entity.is_player:
+      # Only create one player at a time!
+      assert self.player is None
     entity.position = position
     entity.behavior_state = behavior_state or {}
 
@@ -126,28 +212,70 @@ class LevelState:
     # know how to subscribe themselves to dispatchers.
     for behavior in entity.behaviors:
       behavior.add_to_event_dispatcher(self.dispatcher)
+    if any(behavior.takes_turns for behavior in entity.behaviors):
+      self.scheduler.add(entity, entity.speed)
+    self.entities.append(entity)
     # Remember this entity's position
     if entity.position:
       self.entity_by_position[entity.position] = entity
+      self._put_entity_in_grids(entity)
 
   def remove_entity(self, entity):
     # Unsubscribe behaviors from dispatcher
     for behavior in entity.behaviors:
       behavior.remove_from_event_dispatcher(self.dispatcher)
+    self.scheduler.remove(entity)
+    if entity in self.entities:
+      self.entities.remove(entity)
     # Remove from the position index
     if entity.position:
       del self.entity_by_position[entity.position]
+      self._take_entity_out_of_grids(entity)
       entity.position = None
 
+  def move_entity(self, entity, position):
+    """Move *entity* to *position*, which must be empty. Fires no events."""
+    del self.entity_by_position[entity.position]
+    self._take_entity_out_of_grids(entity)
+    entity.position = position
+    self.entity_by_position[position] = entity
+    self._put_entity_in_grids(entity)
+
+  def set_hp(self, entity, hp):
+    """Set ``entity.hp``, and keep the entity_hp grid up to date"""
+    entity.hp = hp
+    if entity.position:
+      self._entity_hp[entity.position.x, entity.position.y] = hp
+
+  def _put_entity_in_grids(self, entity):
+    (x, y) = (entity.position.x, entity.position.y)
+    self._entity_type_ids[x, y] = entity.type_index
+    self._entity_hp[x, y] = entity.hp
+
+  def _take_entity_out_of_grids(self, entity):
+    (x, y) = (entity.position.x, entity.position.y)
+    self._entity_type_ids[x, y] = NOTHING_INDEX
+    self._entity_hp[x, y] = 0
+
   # Item storage in the map is extremely simple. There's just a flat list of
   # items per cell.
   def drop_item(self, item, point, entity=None):
     self.items_by_position.setdefault(point, [])
     self.items_by_position[point].append(item)
+    self._item_type_ids[point.x, point.y] = item.type_index
     if entity is not None:
       self.fire(EnumEventNames.entity_dropped_item, data=item, entity=entity)
     return True
 
+  def set_items_at(self, point, items):
+    """Replace the items at *point* with the list *items*"""
+    if items:
+      self.items_by_position[point] = items
+      self._item_type_ids[point.x, point.y] = items[-1].type_index
+    else:
+      self.items_by_position.pop(point, None)
+      self._item_type_ids[point.x, point.y] = NOTHING_INDEX
+
   ### event stuff ###
 
   # "Firing" an event just means remembering it for later. We don't want to get
@@ -162,14 +290,58 @@ class LevelState:
 
   # GameScene calls this each frame. It iterates over all the events in the
   # queue and dispatches each one.
-  def consume_events(self):
+  #
+  # On a crowded level that can take a while, so GameScene can also give it a
+  # *budget*, in seconds. When the time is up it stops wherever it is, even in
+  # the middle of the monsters' turns, and returns False. The next call picks
+  # up where it left off. It returns True once everything has been handled.
+  # Until then has_unhandled_events is True, and the player shouldn't get to
+  # do anything.
+  def consume_events(self, budget=None):
     # This is an overly paranoid check to make sure this doesn't get called
     # inside itself.
     assert not self._is_applying_events
+    if self._event_steps is None:
+      if not self.event_queue:
+        return True
+      self._event_steps = self._apply_events()
+
     self._is_applying_events = True
+    try:
+      if budget is None:
+        for _ in self._event_steps:
+          pass
+      else:
+        deadline = time.perf_counter() + budget
+        for _ in self._event_steps:
+          if time.perf_counter() >= deadline:
+            return False
+    finally:
+      self._is_applying_events = False
+    self._event_steps = None
+
+    # See journal.py
+    if self.game_state.journal is not None:
+      self.game_state.journal.finish_turn()
+
+    # The turn is over, so this is a good time to save
+    if self.game_state.autosaver:
+      self.game_state.autosaver.snapshot()
+    return True
 
+  @property
+  def has_unhandled_events(self):
+    return bool(self.event_queue) or self._event_steps is not None
+
+  def _apply_events(self):
+    # A generator that handles the events in the queue, and yields whenever
+    # it's a good time for consume_events() to check the clock: after each
+    # event, and after each monster's turn
+    journal = self.game_state.journal
     while self.event_queue:
       (name, entity, data) = self.event_queue.popleft()
+      if journal is not None:
+        journal.record_event(name, entity, data)
       # Remember, the dispatcher is what actually remembers what objects want
       # to get called for what events. Some events are associated with an
       # entity. For those events, objects may subscribe only for that entity.
@@ -177,8 +349,69 @@ class LevelState:
       # If any of the handlers fire new events, they just get added to
       # self.event_queue.
       self.dispatcher.fire(name, entity, data)
+      # Monsters whose turn has come act, then everything in flight moves.
+      # Anything they do gets its events handled right here, since they go on
+      # the end of the queue.
+      if name == EnumEventNames.player_took_action:
+        yield from self.take_turns(Event(name.value, entity, data))
+        if self.player.position is not None:
+          self.projectiles.advance()
+      yield
+
+  def take_turns(self, event):
+    """
+    Call the player_took_action handlers of every entity whose turn has come,
+    in the scheduler's order. This is a generator that yields after each
+    entity's turn (see consume_events()).
+
+    Normally each monster acts as soon as it has decided what to do, so the
+    ones that go later see what the earlier ones did. With
+    :py:data:`PLAN_TURNS_TOGETHER`, it happens in two phases instead. First
+    every monster decides, while the level stays exactly as it was at the
+    start of the turn: the actions they take are only written down (see
+    actions.Plan). Then actions.resolve_plans() does them all in order and
+    sorts out who gets where first. Since nobody's decision depends on
+    anybody else's, they could be made in any order, or all at once. A
+    monster fast enough to go twice in one turn starts a new round of
+    planning, so it gets to see what happened in the first.
+    """
+    if not PLAN_TURNS_TOGETHER:
+      for entity in self.scheduler.take_turn(_get_speed):
+        self._take_turn(entity, event)
+        # Once the player is dead, nobody else needs to do anything. (Monster
+        # behaviors assume there's a player on the map.)
+        if self.player.position is None:
+          break
+        yield
+      return
 
-    self._is_applying_events = False
+    self.plans = []
+    planned = set()
+    try:
+      for entity in self.scheduler.take_turn(_get_speed):
+        if entity in planned:
+          self._resolve_plans()
+          if self.player.position is None:
+            break
+          planned.clear()
+        planned.add(entity)
+        self._take_turn(entity, event)
+        yield
+      self._resolve_plans()
+    finally:
+      self.plans = None
+
+  def _take_turn(self, entity, event):
+    for behavior in entity.behaviors:
+      if behavior.takes_turns:
+        behavior.on_player_took_action(event)
+
+  def _resolve_plans(self):
+    # Actions have to really happen now, so stop writing them down
+    plans = self.plans
+    self.plans = None
+    resolve_plans(self, plans)
+    self.plans = []
 
   ### action helper methods ###
 
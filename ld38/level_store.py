@@ -0,0 +1,125 @@
+"""
+Keeps memory use bounded no matter how many levels the player visits.
+
+A LevelState is a lot of objects: a cell per tile, every entity with its
+behaviors, the dispatcher, the memory caches. GameState used to keep all of
+them forever. Now it keeps them in a LevelStore, which only holds on to the
+few most recently used levels. The rest are written to disk in the compact
+format from serialization.py, and read back the next time somebody asks for
+them.
+"""
+import tempfile
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+
+from .serialization import (
+  dumps_level_snapshot,
+  dumps_level_state,
+  loads_level_state,
+  snapshot_level_state,
+)
+
+
+# How many levels to keep in memory, including the current one
+MAX_LIVE_LEVELS = 2
+
+
+class LevelStore:
+  """
+  Dict-like container of LevelState objects by ID. Looking up a level makes
+  it the most recently used one. When there are more than *max_live_levels*
+  in memory, the least recently used ones are written to a temporary
+  directory and dropped.
+
+  .. py:attribute:: max_live_levels
+
+    Number of LevelStates to keep in memory; at least 1
+  """
+  def __init__(self, game_state, max_live_levels=MAX_LIVE_LEVELS):
+    assert max_live_levels >= 1
+    self.max_live_levels = max_live_levels
+    # Levels are recreated attached to this GameState. Keep it the same way
+    # LevelState does, so there's no reference cycle.
+    self._game_state = weakref.ref(game_state)
+    self._live = OrderedDict()
+    self._paths_by_id = {}
+    # Deleted along with everything in it when the store goes away
+    self._temp_dir = None
+
+  def __len__(self):
+    return len(self._live) + len(self._paths_by_id)
+
+  def __contains__(self, level_id):
+    return level_id in self._live or level_id in self._paths_by_id
+
+  def __iter__(self):
+    yield from self._live
+    yield from self._paths_by_id
+
+  @property
+  def live_ids(self):
+    """IDs of levels currently in memory, least recently used first"""
+    return list(self._live)
+
+  def __getitem__(self, level_id):
+    if level_id in self._live:
+      self._live.move_to_end(level_id)
+      return self._live[level_id]
+    path = self._paths_by_id.pop(level_id)
+    level_state = loads_level_state(path.read_bytes(), self._game_state())
+    path.unlink()
+    self._add_live(level_id, level_state)
+    return level_state
+
+  def __setitem__(self, level_id, level_state):
+    self._paths_by_id.pop(level_id, None)
+    self._add_live(level_id, level_state)
+
+  def _add_live(self, level_id, level_state):
+    self._live[level_id] = level_state
+    self._live.move_to_end(level_id)
+    while len(self._live) > self.max_live_levels:
+      self.evict(next(iter(self._live)))
+
+  def get_serialized(self, level_id):
+    """
+    Returns the level in the form written to disk (see
+    serialization.dumps_level_state()), without loading it if it isn't
+    already loaded.
+    """
+    data = self.get_snapshot(level_id)
+    if isinstance(data, bytes):
+      return data
+    return dumps_level_snapshot(data)
+
+  def get_snapshot(self, level_id):
+    """
+    Returns something that won't change even if the level does: a
+    serialization.LevelSnapshot if the level is in memory, or the bytes from
+    disk if it isn't. Either way, it's quick.
+    """
+    if level_id in self._live:
+      return snapshot_level_state(self._live[level_id])
+    return self._paths_by_id[level_id].read_bytes()
+
+  def add_serialized(self, level_id, data):
+    """
+    Add a level in the form returned by :py:meth:`get_serialized`. It isn't
+    loaded until somebody asks for it.
+    """
+    self._live.pop(level_id, None)
+    self._paths_by_id[level_id] = self._write(level_id, data)
+
+  def _write(self, level_id, data):
+    if self._temp_dir is None:
+      self._temp_dir = tempfile.TemporaryDirectory(prefix='rogue_basement_')
+    path = Path(self._temp_dir.name) / '{}.level'.format(level_id)
+    path.write_bytes(data)
+    return path
+
+  def evict(self, level_id):
+    """Write a level to disk and forget the LevelState object"""
+    level_state = self._live.pop(level_id)
+    self._paths_by_id[level_id] = self._write(
+      level_id, dumps_level_state(level_state))
@@ -5,6 +5,15 @@ from clubsandwich.ui import (
   UIScene,
 )
 from .game_scene import GameMainScene
+from .game_state import finish_creating_game_state, start_creating_game_state
+from .save_game import SaveFileError, get_has_save, load_game
+
+class _HideableButtonView(ButtonView):
+  """A ButtonView that can't be selected while it's hidden"""
+  @property
+  def can_become_first_responder(self):
+    return not self.is_hidden
+
 
 TITLE = """
 .-,--.                  ,-,---.                           .  
@@ -42,6 +51,15 @@ Use <tab> and <return> to navigate menus.
 
 class MainMenuScene(UIScene):
   def __init__(self, *args, **kwargs):
+    # Only shown if there's a saved game. See become_active().
+    self.continue_button = _HideableButtonView(
+      text="Continue", callback=self.continue_game,
+      layout_options=LayoutOptions.row_bottom(10).with_updates(
+        left=0.4, width=0.2, right=None))
+    # For when something goes wrong
+    self.message_view = LabelView(
+      '', color_fg='#ff0000',
+      layout_options=LayoutOptions.row_bottom(1).with_updates(bottom=2))
     views = [
       LabelView(
         TITLE[1:].rstrip(),
@@ -53,13 +71,49 @@ class MainMenuScene(UIScene):
       ButtonView(
         text="Descend the stairs", callback=self.play,
         layout_options=LayoutOptions.row_bottom(10).with_updates(
-          left=0.2, width=0.2, right=None)),
+          left=0.1, width=0.2, right=None)),
+      self.continue_button,
       ButtonView(
         text="Quit", callback=lambda: self.director.pop_scene(),
         layout_options=LayoutOptions.row_bottom(10).with_updates(
-          left=0.6, width=0.2, right=None)),
+          left=0.7, width=0.2, right=None)),
+      self.message_view,
     ]
     super().__init__(views, *args, **kwargs)
+    # Creating a GameState means generating a level, which takes long enough
+    # to notice. Do it in the background while the player reads the title
+    # screen.
+    self.game_state_future = None
+
+  def become_active(self):
+    super().become_active()
+    # Also called when a game ends and we come back to the title screen
+    if self.game_state_future is None:
+      self.game_state_future = start_creating_game_state()
+    # The save may have come or gone since last time
+    self.continue_button.is_hidden = not get_has_save()
+    if self.view.first_responder is self.continue_button and self.continue_button.is_hidden:
+      self.view.find_next_responder()
+    self.message_view.text = ''
 
   def play(self):
-    self.director.push_scene(GameMainScene())
+    game_state = finish_creating_game_state(self.game_state_future)
+    self.game_state_future = None
+    self.director.push_scene(GameMainScene(game_state))
+
+  def continue_game(self):
+    if not get_has_save():
+      return
+    # The new game being made in the background uses the random module, and
+    # loading a saved game sets the random module's state. If they overlap,
+    # the saved game doesn't come back the way it was. So make sure the new
+    # game is done (or never starts) first. It isn't needed anymore.
+    if self.game_state_future is not None and not self.game_state_future.cancel():
+      self.game_state_future.result()
+    self.game_state_future = None
+    try:
+      game_state = load_game()
+    except SaveFileError as e:
+      self.message_view.text = "Unable to load saved game: {}".format(e)
+      return
+    self.director.push_scene(GameMainScene(game_state))
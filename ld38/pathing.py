@@ -0,0 +1,117 @@
+"""
+Finding the way around a level, for anything that plays the game by itself
+(see bot.py) and for commands that take many turns (see running.py).
+
+Everything works on LevelState's NumPy grids, indexed ``[x, y]``. The main
+tool is a "Dijkstra map": the number of moves from every cell to the nearest
+goal. To get to a goal, keep stepping to the neighbor with a smaller number.
+Every move costs the same, diagonals included, so the map is really a
+breadth-first search. It's computed a whole wavefront at a time with array
+operations instead of one cell at a time in Python, which is what makes it
+fast enough to do every turn.
+"""
+import numpy as np
+
+from .connectivity import PASSABLE_BY_TERRAIN_INDEX
+from .const import KEYS_TO_DIRECTIONS, PLAYER_TYPE_INDEX
+
+
+UNREACHABLE = -1
+
+# Entities that aren't worth fighting or running away from
+_HARMLESS_TYPE_INDEXES = [PLAYER_TYPE_INDEX]
+
+
+def get_passable_mask(level_state, known_only=True):
+  """
+  Cells the player could walk through, ignoring monsters. With
+  *known_only*, only cells the player remembers count, so the player isn't
+  led anywhere they couldn't know about.
+  """
+  passable = PASSABLE_BY_TERRAIN_INDEX[level_state.terrain_ids]
+  if known_only:
+    passable &= level_state.remembered_mask
+  return passable
+
+
+def get_monster_mask(level_state):
+  """Cells with a monster the player can see in them"""
+  entity_type_ids = level_state.entity_type_ids
+  return (
+    level_state.visible_mask &
+    (entity_type_ids >= 0) &
+    ~np.isin(entity_type_ids, _HARMLESS_TYPE_INDEXES))
+
+
+def _grow(mask):
+  """Returns *mask* plus all 8 neighbors of every cell in it"""
+  grown = mask.copy()
+  grown[1:, :] |= mask[:-1, :]
+  grown[:-1, :] |= mask[1:, :]
+  grown[:, 1:] |= mask[:, :-1]
+  grown[:, :-1] |= mask[:, 1:]
+  grown[1:, 1:] |= mask[:-1, :-1]
+  grown[:-1, :-1] |= mask[1:, 1:]
+  grown[1:, :-1] |= mask[:-1, 1:]
+  grown[:-1, 1:] |= mask[1:, :-1]
+  return grown
+
+
+def get_distance_map(goals, passable, stop_at=None):
+  """
+  Returns an int32 array of how many moves it is from each cell to the
+  nearest cell in the *goals* mask, moving only through the *passable* mask,
+  or :py:data:`UNREACHABLE`. Goals don't have to be passable themselves.
+
+  If *stop_at* is an ``(x, y)``, stop as soon as that cell has a distance;
+  cells further away are left :py:data:`UNREACHABLE`.
+  """
+  distances = np.full(goals.shape, UNREACHABLE, dtype=np.int32)
+  distances[goals] = 0
+  seen = goals.copy()
+  frontier = goals
+  distance = 0
+  while frontier.any():
+    if stop_at is not None and seen[stop_at]:
+      break
+    distance += 1
+    frontier = _grow(frontier) & passable & ~seen
+    distances[frontier] = distance
+    seen |= frontier
+  return distances
+
+
+def get_step_toward(distances, position):
+  """
+  The direction (a key of ``KEYS_TO_DIRECTIONS``) that gets closer to a goal
+  from *position* according to *distances*, or ``None`` if there's no way to
+  get closer.
+  """
+  (width, height) = distances.shape
+  here = distances[position.x, position.y]
+  if here == UNREACHABLE:
+    here = np.iinfo(np.int32).max
+  best = None
+  best_distance = here
+  for (direction, delta) in KEYS_TO_DIRECTIONS.items():
+    (x, y) = (position.x + delta.x, position.y + delta.y)
+    if not (0 <= x < width and 0 <= y < height):
+      continue
+    distance = distances[x, y]
+    if distance != UNREACHABLE and distance < best_distance:
+      (best, best_distance) = (direction, distance)
+  return best
+
+
+def get_direction_to_nearest(level_state, goals, known_only=True, avoid=None):
+  """
+  The first step of a shortest path from the player to any cell in the
+  *goals* mask, or ``None`` if none of them can be reached. Paths don't go
+  through cells in the *avoid* mask, if there is one.
+  """
+  position = level_state.player.position
+  passable = get_passable_mask(level_state, known_only)
+  if avoid is not None:
+    passable &= ~avoid
+  distances = get_distance_map(goals, passable, stop_at=(position.x, position.y))
+  return get_step_toward(distances, position)
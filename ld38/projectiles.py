@@ -0,0 +1,224 @@
+"""
+Things that have been thrown and haven't landed yet.
+
+Thrown rocks used to be entities, with a ROCK_IN_FLIGHT monster type and a
+behavior that moved them, which is a lot of machinery for something that
+lives for a few turns. Now each level has a :py:class:`Projectiles` that
+keeps everything in flight in a few parallel lists, and moves all of it in
+one go after every turn. They aren't entities: they don't block anybody,
+and you can't hit them. The monster type is still used for their name,
+color and character.
+
+A thrown rock flies along a line from the thrower toward its target, one
+cell at a time. The player always aims way past the edge of the map (see
+commands.THROW_DISTANCE), so making a list of every cell on that line up
+front would mostly be a waste. Instead a :py:class:`ThrowPath` remembers how
+far along the line the rock is, and :py:func:`advance_throw_path` works out
+the next cell only when the rock gets there. That makes throwing cost the
+same no matter how far away the target is.
+
+The path ends at the target, at the edge of the map, or just before the
+first cell that isn't walkable, whichever comes first. Whoever is standing
+in the way gets hit.
+"""
+import weakref
+from collections import namedtuple
+
+from clubsandwich.geom import Point
+
+from .actions import action_attack
+from .const import IN_FLIGHT_MONSTER_TYPES
+
+
+# The same line as clubsandwich's Point.points_bresenham_to(), worked out one
+# step at a time. The line is drawn as if it were in the first octant, with
+# (xx, xy, yx, yy) turning it the right way around.
+#
+# * (x0, y0): where the line starts
+# * (dx, dy): length of the line along its long and short axis
+# * i, j: how far along each of those the last point handed out is
+# * d: Bresenham's error term
+ThrowPath = namedtuple('ThrowPath', [
+  'x0', 'y0', 'xx', 'xy', 'yx', 'yy', 'dx', 'dy', 'i', 'j', 'd'])
+
+
+def get_throw_path(start, target):
+  """
+  Returns a :py:class:`ThrowPath` from *start* toward *target*. The first
+  point it gives is the one after *start*.
+  """
+  (dx, dy) = (target.x - start.x, target.y - start.y)
+  xsign = 1 if dx > 0 else -1
+  ysign = 1 if dy > 0 else -1
+  (dx, dy) = (abs(dx), abs(dy))
+  if dx > dy:
+    (xx, xy, yx, yy) = (xsign, 0, 0, ysign)
+  else:
+    (dx, dy) = (dy, dx)
+    (xx, xy, yx, yy) = (0, ysign, xsign, 0)
+  return ThrowPath(
+    x0=start.x, y0=start.y, xx=xx, xy=xy, yx=yx, yy=yy, dx=dx, dy=dy,
+    i=0, j=0, d=2 * dy - dx)
+
+
+def advance_throw_path(level_state, path):
+  """
+  Returns ``(point, path)``: the next point on *path*, and the path to use
+  after that. *point* is ``None`` if the path has ended.
+  """
+  if path.i >= path.dx:
+    return (None, path)
+  (j, d) = (path.j, path.d)
+  if d > 0:
+    j += 1
+    d -= path.dx
+  d += path.dy
+  i = path.i + 1
+  point = Point(path.x0 + i * path.xx + j * path.yx, path.y0 + i * path.xy + j * path.yy)
+  # Off the map counts as not walkable
+  if not level_state.get_is_terrain_passable(point):
+    return (None, path)
+  return (point, path._replace(i=i, j=j, d=d))
+
+
+class Projectile:
+  """
+  What a projectile looks like to action_attack() and to event handlers when
+  it hits something or lands: enough like an Entity for them to say "the
+  rock hits you", and nothing more. Only made when it's needed.
+  """
+  __slots__ = ('monster_type', 'position', 'strength', 'item')
+  is_player = False
+
+  def __init__(self, monster_type, position, strength, item):
+    self.monster_type = monster_type
+    self.position = position
+    self.strength = strength
+    self.item = item
+
+  def __repr__(self):
+    return "{}(monster_type={})".format(self.__class__.__name__, self.monster_type.id)
+
+
+class Projectiles:
+  """
+  Everything in flight on one level, as parallel lists: the Nth projectile
+  is at ``positions[N]``, on ``paths[N]``, and so on.
+
+  * positions: Points
+  * paths: :py:class:`ThrowPath` objects
+  * speeds: cells per turn
+  * strengths: damage done to whatever it hits, taken from the thrower
+  * thrower_types: the thrower's monster type, which gets the blame for the
+    damage
+  * items: the Item that was thrown, which is dropped where it lands
+  * is_waiting: True until it has sat out its first move, since it starts
+    out one cell away from the thrower
+  """
+  def __init__(self, level_state):
+    self._level_state = weakref.ref(level_state)
+    self.positions = []
+    self.paths = []
+    self.speeds = []
+    self.strengths = []
+    self.thrower_types = []
+    self.items = []
+    self.is_waiting = []
+    # For drawing: the monster type of the last projectile in each cell
+    self.monster_type_by_position = {}
+
+  def __len__(self):
+    return len(self.positions)
+
+  def add(self, item, position, path, speed, strength, thrower_type,
+          is_waiting=True):
+    self.positions.append(position)
+    self.paths.append(path)
+    self.speeds.append(speed)
+    self.strengths.append(strength)
+    self.thrower_types.append(thrower_type)
+    self.items.append(item)
+    self.is_waiting.append(is_waiting)
+    self.monster_type_by_position[position] = get_in_flight_type(item)
+
+  def throw(self, thrower, item, target_position, speed):
+    """
+    Have *thrower* throw *item* from their inventory toward
+    *target_position*. Returns ``False`` if there's no room to throw it that
+    way.
+    """
+    level_state = self._level_state()
+    (first_point, path) = advance_throw_path(
+      level_state, get_throw_path(thrower.position, target_position))
+    if first_point is None:
+      return False
+    if not level_state.get_can_move(thrower, first_point):
+      return False
+    if level_state.get_entity_at(first_point):
+      return False
+
+    thrower.inventory.remove(item)
+    ### Thrown object takes strength from thrower ###
+    self.add(
+      item, first_point, path, speed, thrower.strength, thrower.monster_type)
+    return True
+
+  def advance(self):
+    """
+    Move everything in flight. Things that hit someone or reach the end of
+    their path land, and are forgotten.
+    """
+    if not self.positions:
+      return
+    level_state = self._level_state()
+    in_flight = []
+    for projectile in zip(
+        self.positions, self.paths, self.speeds, self.strengths,
+        self.thrower_types, self.items, self.is_waiting):
+      (position, path, speed, strength, thrower_type, item, is_waiting) = projectile
+      has_landed = False
+      for _ in range(speed):
+        if is_waiting:
+          is_waiting = False
+          continue
+        (next_point, path) = advance_throw_path(level_state, path)
+        if next_point is None:
+          # End of the line, or a wall
+          self._land(item, position, strength)
+          has_landed = True
+          break
+        entity_to_hit = level_state.get_entity_at(next_point)
+        if entity_to_hit:
+          action_attack(
+            level_state,
+            Projectile(get_in_flight_type(item), next_point, strength, item),
+            entity_to_hit, thrower_type)
+          self._land(item, next_point, strength)
+          has_landed = True
+          break
+        position = next_point
+      if not has_landed:
+        in_flight.append(
+          (position, path, speed, strength, thrower_type, item, is_waiting))
+
+    self.positions = [projectile[0] for projectile in in_flight]
+    self.paths = [projectile[1] for projectile in in_flight]
+    self.speeds = [projectile[2] for projectile in in_flight]
+    self.strengths = [projectile[3] for projectile in in_flight]
+    self.thrower_types = [projectile[4] for projectile in in_flight]
+    self.items = [projectile[5] for projectile in in_flight]
+    self.is_waiting = [projectile[6] for projectile in in_flight]
+    self.monster_type_by_position = {
+      position: get_in_flight_type(item)
+      for (position, item) in zip(self.positions, self.items)}
+
+  def _land(self, item, position, strength):
+    level_state = self._level_state()
+    level_state.drop_item(
+      item, position,
+      entity=Projectile(get_in_flight_type(item), position, strength, item))
+
+
+def get_in_flight_type(item):
+  """The monster type of *item* while it's in the air, like ROCK_IN_FLIGHT"""
+  return IN_FLIGHT_MONSTER_TYPES[item.type_index]
@@ -0,0 +1,150 @@
+"""
+Recording games and playing them back without a window.
+
+A game only depends on its seed (see GameState) and the commands the player
+gives it (see commands.py), so that's all a replay needs. Replay files are
+plain text, one command per line, so you can read and edit them::
+
+  Rogue Basement replay 1
+  seed 1234567
+  R
+  R
+  THROW UL
+  GET
+
+:py:func:`play_replay` runs a replay through headless.HeadlessGame, which
+does exactly what the game does minus the drawing, as fast as it can,
+and reports how fast that was. That makes replays handy as repeatable
+benchmarks. ``python replay.py FILE`` does it from the command line.
+"""
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from appdirs import user_data_dir
+
+from .headless import HeadlessGame
+
+
+HEADER = 'Rogue Basement replay'
+# Bump this if the format changes in a way that old replays can't be read
+REPLAY_VERSION = 1
+
+
+class ReplayFileError(Exception):
+  """The replay file is missing, damaged, or from an incompatible version"""
+  pass
+
+
+# *commands* is a list of ``(command, direction)`` pairs, the arguments to
+# perform_command(). *direction* is None for commands that don't need one.
+Replay = namedtuple('Replay', ['seed', 'commands'])
+
+
+# What play_replay() found out
+ReplayResult = namedtuple('ReplayResult', [
+  'turns', 'seconds', 'turns_per_second', 'score', 'depth', 'is_dead', 'has_won'])
+
+
+def get_default_replay_path():
+  """Where GameMainScene writes the last game's replay"""
+  return Path(user_data_dir('Rogue Basement', 'steveasleep')) / 'last.rbreplay'
+
+
+def dumps_replay(replay):
+  """Returns *replay* as text. Undo with :py:func:`loads_replay`."""
+  lines = ['{} {}'.format(HEADER, REPLAY_VERSION), 'seed {}'.format(replay.seed)]
+  for (command, direction) in replay.commands:
+    lines.append(command if direction is None else '{} {}'.format(command, direction))
+  return '\n'.join(lines) + '\n'
+
+
+def loads_replay(text):
+  """Returns a :py:class:`Replay` from the output of :py:func:`dumps_replay`"""
+  lines = text.splitlines()
+  if len(lines) < 2 or not lines[0].startswith(HEADER + ' '):
+    raise ReplayFileError("Not a Rogue Basement replay")
+  if lines[0] != '{} {}'.format(HEADER, REPLAY_VERSION):
+    raise ReplayFileError("Unknown replay version: {!r}".format(lines[0]))
+  try:
+    (label, seed) = lines[1].split()
+    if label != 'seed':
+      raise ValueError(label)
+    seed = int(seed)
+  except ValueError as e:
+    raise ReplayFileError("Replay has no seed") from e
+
+  commands = []
+  for line in lines[2:]:
+    parts = line.split()
+    if not parts:
+      continue
+    if len(parts) > 2:
+      raise ReplayFileError("Not a command: {!r}".format(line))
+    commands.append((parts[0], parts[1] if len(parts) == 2 else None))
+  return Replay(seed, commands)
+
+
+def save_replay(replay, path=None):
+  path = path or get_default_replay_path()
+  path.parent.mkdir(parents=True, exist_ok=True)
+  path.write_text(dumps_replay(replay))
+
+
+def load_replay(path=None):
+  path = path or get_default_replay_path()
+  try:
+    text = path.read_text()
+  except (OSError, UnicodeDecodeError) as e:
+    raise ReplayFileError("Unable to read replay file") from e
+  return loads_replay(text)
+
+
+class InputRecorder:
+  """
+  Set ``game_state.recorder`` to one of these, right after the GameState is
+  created, to record every command. The result is in ``self.replay``.
+  """
+  def __init__(self, seed):
+    self.replay = Replay(seed, [])
+
+  def record(self, command, direction):
+    self.replay.commands.append((command, direction))
+
+  def forget(self, n):
+    """Forget the last *n* commands, because they were undone"""
+    if n > 0:
+      del self.replay.commands[-n:]
+
+
+def play_replay(replay, game_state=None):
+  """
+  Play *replay* from the beginning, as fast as possible, and return a
+  :py:class:`ReplayResult`. Stops early if the player dies or wins.
+
+  Pass *game_state* if you want to look at it afterward; it must be a new
+  GameState created with ``replay.seed``.
+  """
+  game = HeadlessGame(
+    seed=replay.seed, game_state=game_state, collect_events=False)
+  game_state = game.game_state
+  assert game_state.seed == replay.seed
+
+  start = time.perf_counter()
+  for (command, direction) in replay.commands:
+    if game.is_over:
+      break
+    game.submit(command, direction)
+    game.consume_events()
+  seconds = time.perf_counter() - start
+  turns = game.turn
+
+  return ReplayResult(
+    turns=turns,
+    seconds=seconds,
+    turns_per_second=turns / seconds if seconds else float('inf'),
+    score=game_state.score,
+    depth=game_state.depth,
+    is_dead=game_state.level.player.position is None,
+    has_won=game_state.has_won,
+  )
@@ -0,0 +1,157 @@
+"""
+The level generator knows a lot about the shape of the dungeon while it's
+building it: which rooms are in which quadrant, which corridor connects which
+rooms, and so on. Instead of throwing all that away, it writes it down in a
+RoomGraph, which lives on the tilemap as ``tilemap.room_graph``.
+
+Rooms are the nodes. Corridors are the edges, and they remember which doors
+and corridor cells they are made of. Every room also knows its quadrant
+(difficulty), and room centers are kept in a coarse spatial index so "which
+room is closest to this point?" doesn't have to look at every room.
+"""
+from collections import defaultdict, namedtuple
+from math import floor
+
+
+# One corridor carved by the level generator. *room_ids* is every room the
+# corridor touches: the two rooms it was drawn between, plus any rooms whose
+# walls it cut a door into along the way.
+Corridor = namedtuple(
+  'Corridor', ['corridor_id', 'room_ids', 'doors', 'cells', 'annotation'])
+
+
+class RoomCenterIndex:
+  """
+  Buckets room centers into a grid of *bucket_size* x *bucket_size* squares.
+  To find the room nearest a point, look in the point's own bucket, then the
+  ring of buckets around it, then the next ring, and so on. As soon as the
+  best room found so far is closer than anything in the next ring could
+  possibly be, stop.
+
+  Ties are broken by insertion order, so the answer is exactly the same as a
+  linear scan over the rooms in the order they were added.
+  """
+  def __init__(self, bucket_size=8):
+    self.bucket_size = bucket_size
+    self._buckets = defaultdict(list)
+    self._count = 0
+    self._min_key = None
+    self._max_key = None
+
+  def __len__(self):
+    return self._count
+
+  def _get_key(self, point):
+    return (floor(point.x / self.bucket_size), floor(point.y / self.bucket_size))
+
+  def add(self, room):
+    center = room.rect.center
+    key = self._get_key(center)
+    self._buckets[key].append((self._count, center, room))
+    self._count += 1
+    if self._min_key is None:
+      self._min_key = key
+      self._max_key = key
+    else:
+      self._min_key = (min(self._min_key[0], key[0]), min(self._min_key[1], key[1]))
+      self._max_key = (max(self._max_key[0], key[0]), max(self._max_key[1], key[1]))
+
+  def _get_ring(self, bx, by, r):
+    if r == 0:
+      yield (bx, by)
+      return
+    for x in range(bx - r, bx + r + 1):
+      yield (x, by - r)
+      yield (x, by + r)
+    for y in range(by - r + 1, by + r):
+      yield (bx - r, y)
+      yield (bx + r, y)
+
+  def get_nearest(self, target_point):
+    """
+    Returns the room whose center is closest (manhattan distance) to
+    *target_point*, or ``None`` if the index is empty.
+    """
+    if not self._count:
+      return None
+    bx, by = self._get_key(target_point)
+    max_r = max(
+      bx - self._min_key[0], self._max_key[0] - bx,
+      by - self._min_key[1], self._max_key[1] - by)
+
+    best = None  # (distance, insertion order, room)
+    for r in range(max_r + 1):
+      for key in self._get_ring(bx, by, r):
+        for (order, center, room) in self._buckets.get(key, ()):
+          candidate = (center.manhattan_distance_to(target_point), order, room)
+          if best is None or candidate[:2] < best[:2]:
+            best = candidate
+      # Everything in ring r+1 and beyond is more than r buckets away on at
+      # least one axis.
+      if best is not None and best[0] <= r * self.bucket_size:
+        break
+    return best[2]
+
+
+class RoomGraph:
+  """
+  Rooms (by room_id) connected by corridors. See the module docs.
+
+  .. py:attribute:: rooms_by_id
+
+    Same as ``tilemap.rooms_by_id``; rooms in the order they were added
+
+  .. py:attribute:: room_ids_by_difficulty
+
+    Dict mapping difficulty (quadrant, 0-3) to a list of room IDs
+
+  .. py:attribute:: corridors
+
+    List of :py:class:`Corridor`, in the order they were carved
+  """
+  def __init__(self):
+    self.rooms_by_id = {}
+    self.room_ids_by_difficulty = defaultdict(list)
+    self.corridors = []
+    self._neighbor_ids_by_room_id = defaultdict(set)
+    self._corridors_by_room_id = defaultdict(list)
+    self._index = RoomCenterIndex()
+    self._indexes_by_difficulty = defaultdict(RoomCenterIndex)
+
+  def add_room(self, room):
+    self.rooms_by_id[room.room_id] = room
+    self.room_ids_by_difficulty[room.difficulty].append(room.room_id)
+    self._index.add(room)
+    self._indexes_by_difficulty[room.difficulty].add(room)
+
+  def add_corridor(self, room_ids, doors, cells, annotation=None):
+    """
+    Remember a corridor, and connect every room it touches to every other
+    room it touches. Returns the new :py:class:`Corridor`.
+    """
+    room_ids = tuple(room_ids)
+    corridor = Corridor(len(self.corridors), room_ids, doors, cells, annotation)
+    self.corridors.append(corridor)
+    for room_id in room_ids:
+      self._corridors_by_room_id[room_id].append(corridor)
+      self._neighbor_ids_by_room_id[room_id].update(
+        other_id for other_id in room_ids if other_id != room_id)
+    return corridor
+
+  def get_neighbor_ids(self, room_id):
+    """Set of IDs of rooms that share a corridor with *room_id*"""
+    return self._neighbor_ids_by_room_id[room_id]
+
+  def get_corridors(self, room_id):
+    """List of corridors touching *room_id*"""
+    return self._corridors_by_room_id[room_id]
+
+  def get_room_nearest(self, target_point, difficulty=None):
+    """
+    Returns the room closest to *target_point*, optionally only considering
+    rooms in the given quadrant. This is used for placement of stairs and
+    inter-quadrant special corridors.
+    """
+    if difficulty is None:
+      return self._index.get_nearest(target_point)
+    return self._indexes_by_difficulty[difficulty].get_nearest(target_point)
@@ -0,0 +1,157 @@
+"""
+Commands that take many turns with one keystroke: running in a straight line
+(shift + a direction) and exploring (x).
+
+A run doesn't do anything itself. Whoever is running the game asks it for
+the next command, performs it with commands.perform_command() like any
+other, handles the turn's events, and asks again, until the run says to
+stop. So runs show up in replays and turn journals as the single steps they
+really are.
+
+GameMainScene does all the turns of a run in one frame and only draws the
+screen at the end, which is what makes a long walk instant. It also stops
+the run when anything is logged, which covers getting hit, picking things
+up, opening doors (unless the run :py:attr:`Run.stops_at_doors` is False)
+and so on. The run itself stops when a monster comes into view, when
+there's something to pick up, and when it runs out of places to go.
+"""
+import numpy as np
+
+from clubsandwich.geom import Point
+
+from .const import KEYS_TO_DIRECTIONS, EnumFeature, terrain_types, verbs
+from .pathing import (
+  get_distance_map,
+  get_monster_mask,
+  get_passable_mask,
+  get_step_toward,
+)
+from .sentences import simple_declarative_sentence
+
+
+# No run takes longer than this, just in case
+MAX_RUN_TURNS = 1000
+
+# Stepping on stairs takes them, so runs stay off them
+_STAIRS = {EnumFeature.STAIRS_UP, EnumFeature.STAIRS_DOWN}
+_STAIRS_POINTS_OF_INTEREST = ('stairs_up', 'stairs_down')
+
+
+def get_visible_monsters(level_state):
+  """The set of monsters the player can see right now"""
+  return {
+    level_state.entity_by_position[Point(int(x), int(y))]
+    for (x, y) in np.argwhere(get_monster_mask(level_state))}
+
+
+class Run:
+  """
+  Base class for commands that take many turns. Subclasses implement
+  :py:meth:`get_direction`.
+
+  Call :py:meth:`get_next_command` before every turn. When it returns
+  ``None`` the run is over, and :py:attr:`message` may say why.
+  """
+  # Whether opening a door is news, or just part of the plan
+  stops_at_doors = True
+
+  def __init__(self, level_state):
+    self.level_state = level_state
+    self.turns = 0
+    self.message = None
+    # Monsters that were already around don't stop the run; the player knows
+    # about them
+    self.monsters_seen = get_visible_monsters(level_state)
+
+  def get_next_command(self):
+    level_state = self.level_state
+    player = level_state.player
+    if player.position is None or self.turns >= MAX_RUN_TURNS:
+      return None
+
+    new_monsters = get_visible_monsters(level_state) - self.monsters_seen
+    if new_monsters:
+      monster = next(iter(new_monsters))
+      self.message = simple_declarative_sentence(
+        'PLAYER', verbs.SEE, monster.monster_type.id, 'a')
+      return None
+    if self.turns and level_state.get_items_at(player.position):
+      return None
+
+    direction = self.get_direction()
+    if direction is not None:
+      self.turns += 1
+    return direction
+
+  def get_direction(self):
+    """The next step, a key of ``KEYS_TO_DIRECTIONS``, or ``None`` to stop"""
+    raise NotImplementedError()
+
+
+class RunInDirection(Run):
+  """
+  Keep walking in one direction until something is in the way, or the
+  player steps into a doorway
+  """
+  def __init__(self, level_state, direction):
+    super().__init__(level_state)
+    self.direction = direction
+
+  def get_direction(self):
+    level_state = self.level_state
+    position = level_state.player.position
+    if self.turns and level_state.tilemap.cell(position).terrain == terrain_types.DOOR_OPEN:
+      return None
+    next_position = position + KEYS_TO_DIRECTIONS[self.direction]
+    if level_state.get_entity_at(next_position) is not None:
+      return None
+    if not level_state.get_is_terrain_passable(next_position):
+      return None
+    if level_state.tilemap.cell(next_position).feature in _STAIRS:
+      return None
+    return self.direction
+
+
+class Explore(Run):
+  """
+  Walk to the nearest place the player hasn't seen yet, over and over,
+  opening doors on the way. Doesn't step on stairs or into monsters.
+  """
+  stops_at_doors = False
+
+  def __init__(self, level_state):
+    super().__init__(level_state)
+    # The last distance map and what it was made from. Walking through places
+    # the player has already seen doesn't change anything, so a long walk
+    # only needs one.
+    self._goals = None
+    self._passable = None
+    self._distances = None
+
+  def get_direction(self):
+    level_state = self.level_state
+    position = level_state.player.position
+    stairs = np.zeros_like(level_state.remembered_mask)
+    for name in _STAIRS_POINTS_OF_INTEREST:
+      point = level_state.tilemap.points_of_interest[name]
+      stairs[point.x, point.y] = True
+    goals = ~level_state.remembered_mask
+    passable = get_passable_mask(level_state) & ~stairs
+    passable_without_monsters = passable & ~get_monster_mask(level_state)
+
+    if not (self._distances is not None and
+            np.array_equal(goals, self._goals) and
+            np.array_equal(passable_without_monsters, self._passable)):
+      self._goals = goals
+      self._passable = passable_without_monsters
+      self._distances = get_distance_map(
+        goals, passable_without_monsters, stop_at=(position.x, position.y))
+    direction = get_step_toward(self._distances, position)
+
+    if direction is None:
+      distances = get_distance_map(goals, passable, stop_at=(position.x, position.y))
+      if get_step_toward(distances, position) is None:
+        self.message = "There is nothing left to explore."
+      else:
+        self.message = "There is a monster in the way."
+    return direction
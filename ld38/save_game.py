@@ -0,0 +1,238 @@
+"""
+Saving and loading a whole game.
+
+A save file is a short header followed by a compressed pickle of plain
+values (see serialization.py for why it's plain values and not the objects
+themselves). Each level is stored the same way LevelStore writes levels to
+disk, so levels that aren't loaded don't need to be loaded to save the game,
+and loading a game only loads the current level. The rest are read the first
+time the player goes back to them.
+"""
+import os
+import pickle
+import random
+import threading
+import weakref
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+from appdirs import user_data_dir
+
+from .game_state import GameState
+from .serialization import dumps_level_snapshot
+
+
+MAGIC = b'RBSAVE'
+# Bump this if the format changes in a way that old saves can't be read
+SAVE_VERSION = 8
+
+
+class SaveFileError(Exception):
+  """The save file is missing, damaged, or from an incompatible version"""
+  pass
+
+
+def get_default_save_path():
+  """Where the game is saved unless you say otherwise"""
+  return Path(user_data_dir('Rogue Basement', 'steveasleep')) / 'save.rbsave'
+
+
+def get_has_save(path=None):
+  return (path or get_default_save_path()).exists()
+
+
+def delete_save(path=None):
+  path = path or get_default_save_path()
+  if path.exists():
+    path.unlink()
+
+
+def dumps_game(game_state):
+  """Serialize *game_state* to bytes. Undo with :py:func:`loads_game`."""
+  return _dumps_game_data(
+    game_state.score, game_state.level_ids, game_state.active_id,
+    {level_id: game_state.level_states_by_id.get_serialized(level_id)
+     for level_id in game_state.level_ids},
+    game_state.next_level_seed, random.getstate())
+
+
+def _dumps_game_data(score, level_ids, active_id, levels, next_level_seed,
+                     random_state):
+  data = {
+    'score': score,
+    'level_ids': list(level_ids),
+    'active_id': active_id,
+    # level ID -> bytes from serialization.dumps_level_state()
+    'levels': levels,
+    # The seed of the level being generated, or None
+    'next_level_seed': next_level_seed,
+    'random_state': random_state,
+  }
+  return MAGIC + bytes([SAVE_VERSION]) + zlib.compress(
+    pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def loads_game(data):
+  """Returns a new GameState from the output of :py:func:`dumps_game`"""
+  if not data.startswith(MAGIC) or len(data) <= len(MAGIC):
+    raise SaveFileError("Not a Rogue Basement save file")
+  version = data[len(MAGIC)]
+  if version != SAVE_VERSION:
+    raise SaveFileError("Unknown save file version: {!r}".format(version))
+  try:
+    data = pickle.loads(zlib.decompress(data[len(MAGIC) + 1:]))
+  except (zlib.error, pickle.UnpicklingError, EOFError) as e:
+    raise SaveFileError("Save file is damaged") from e
+
+  game_state = GameState(populate=False)
+  game_state.score = data['score']
+  for level_id in data['level_ids']:
+    game_state.level_states_by_id.add_serialized(level_id, data['levels'][level_id])
+    game_state.level_ids.append(level_id)
+  game_state.active_id = data['active_id']
+
+  # Load the current level now, so it's not a surprise later, and get the
+  # next level going again, with the seed it had. Picking a new seed would
+  # use up a random number the saved game never did, and everything after
+  # that would come out different.
+  game_state.level
+  if data['next_level_seed'] is not None:
+    game_state.start_next_level(data['next_level_seed'])
+  # Last, so nothing above can change it
+  random.setstate(data['random_state'])
+  return game_state
+
+
+def save_game(game_state, path=None):
+  """
+  Write *game_state* to *path*. The old save is only replaced once the new
+  one is completely written, so a crash can't leave you with half a save.
+  """
+  _write_save(dumps_game(game_state), path)
+
+
+def _write_save(data, path=None):
+  path = path or get_default_save_path()
+  path.parent.mkdir(parents=True, exist_ok=True)
+  temp_path = path.with_suffix('.tmp')
+  with temp_path.open('wb') as f:
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(str(temp_path), str(path))
+
+
+def load_game(path=None):
+  """Returns a GameState read from *path*"""
+  path = path or get_default_save_path()
+  try:
+    data = path.read_bytes()
+  except OSError as e:
+    raise SaveFileError("Unable to read save file") from e
+  return loads_game(data)
+
+
+class Autosaver:
+  """
+  Saves the game after every turn without making the player wait for it.
+
+  At the end of each turn, LevelState.consume_events() calls
+  :py:meth:`snapshot`. That only copies the parts of the game that can
+  change (see serialization.snapshot_level_state()), and only for the
+  current level. Levels the player isn't on can't change, so each one is
+  copied once when the player leaves it and reused after that.
+
+  A background thread turns the newest snapshot into a save file and fsyncs
+  it. If the player takes several turns while it's busy, the ones in between
+  are skipped; only the latest one matters.
+  """
+  def __init__(self, game_state, path=None):
+    self._game_state = weakref.ref(game_state)
+    self.path = path or get_default_save_path()
+    # level ID -> LevelSnapshot or bytes, for levels other than the current
+    # one. Only touched on the main thread, except that the background thread
+    # swaps snapshots for bytes while holding the lock.
+    self._inactive_levels = {}
+    self._lock = threading.Condition()
+    self._pending = None
+    self._is_stopped = False
+    self._is_paused = False
+    self._thread = threading.Thread(
+      target=self._run, name='Autosaver', daemon=True)
+    self._thread.start()
+
+  def snapshot(self):
+    """Remember the game as it is right now, and save it soon"""
+    game_state = self._game_state()
+    if self._is_stopped or self._is_paused or game_state is None:
+      return
+    store = game_state.level_states_by_id
+    active_id = game_state.active_id
+    with self._lock:
+      self._inactive_levels.pop(active_id, None)
+      for level_id in game_state.level_ids:
+        if level_id != active_id and level_id not in self._inactive_levels:
+          self._inactive_levels[level_id] = store.get_snapshot(level_id)
+      levels = dict(self._inactive_levels)
+      levels[active_id] = store.get_snapshot(active_id)
+      self._pending = (
+        game_state.score, list(game_state.level_ids), active_id, levels,
+        game_state.next_level_seed, random.getstate())
+      self._lock.notify()
+
+  @contextmanager
+  def paused(self):
+    """
+    Don't save the turns taken inside the ``with`` block, just the game as it
+    is at the end of it. For commands that take many turns at once (see
+    running.py).
+    """
+    self._is_paused = True
+    try:
+      yield
+    finally:
+      self._is_paused = False
+    self.snapshot()
+
+  def stop(self, discard=False):
+    """
+    Stop saving. Unless *discard* is ``True``, wait for the last snapshot to
+    be written first. Call this before doing anything else to the save
+    file.
+    """
+    with self._lock:
+      self._is_stopped = True
+      if discard:
+        self._pending = None
+      self._lock.notify()
+    self._thread.join()
+
+  def _run(self):
+    while True:
+      with self._lock:
+        while self._pending is None and not self._is_stopped:
+          self._lock.wait()
+        if self._pending is None:
+          return
+        (score, level_ids, active_id, levels, next_level_seed,
+         random_state) = self._pending
+        self._pending = None
+
+      serialized = {}
+      for (level_id, data) in levels.items():
+        if not isinstance(data, bytes):
+          data = dumps_level_snapshot(data)
+          with self._lock:
+            # Don't serialize inactive levels again next time
+            if self._inactive_levels.get(level_id) is levels[level_id]:
+              self._inactive_levels[level_id] = data
+        serialized[level_id] = data
+      try:
+        _write_save(
+          _dumps_game_data(
+            score, level_ids, active_id, serialized, next_level_seed,
+            random_state),
+          self.path)
+      except OSError as e:
+        print("Unable to autosave:", e)
@@ -6,6 +6,8 @@ from clubsandwich.ui import (
   WindowView,
 )
 
+from .save_game import Autosaver, save_game
+
 TITLE = """
 .-,--.                  ,-,---.                           .  
  `|__/ ,-. ,-. . . ,-.   '|___/ ,-. ,-. ,-. ,-,-. ,-. ,-. |- 
@@ -69,17 +71,26 @@ _\\       /_
 
 
 class PauseScene(UIScene):
-  def __init__(self, *args, **kwargs):
+  def __init__(self, game_state, *args, **kwargs):
+    self.game_state = game_state
+    # For when saving doesn't work
+    self.message_view = LabelView(
+      '', color_fg='#ff0000',
+      layout_options=LayoutOptions.row_top(2).with_updates(top=7))
     view = WindowView(
       'Pause',
-      layout_options=LayoutOptions.centered(40, 10),
+      layout_options=LayoutOptions.centered(40, 15),
       subviews=[
           ButtonView(
               text='Resume', callback=self.resume,
-              layout_options=LayoutOptions.row_top(5)),
+              layout_options=LayoutOptions.row_top(4)),
+          ButtonView(
+              text='Save and quit', callback=self.save_and_quit,
+              layout_options=LayoutOptions.row_top(3).with_updates(top=4)),
+          self.message_view,
           ButtonView(
               text='Quit', callback=self.quit,
-              layout_options=LayoutOptions.row_bottom(5)),
+              layout_options=LayoutOptions.row_bottom(4)),
       ])
     super().__init__(view, *args, **kwargs)
     self.covers_screen = False
@@ -87,6 +98,24 @@ class PauseScene(UIScene):
   def resume(self):
     self.director.pop_scene()
 
+  def save_and_quit(self):
+    # The autosaver writes the same file, so it has to stop first
+    autosaver = self.game_state.autosaver
+    if autosaver:
+      autosaver.stop()
+      self.game_state.autosaver = None
+    try:
+      save_game(self.game_state)
+    except OSError as e:
+      # Stay here, so the player can try again or keep playing. Either way
+      # the game isn't lost.
+      if autosaver:
+        self.game_state.autosaver = Autosaver(self.game_state, autosaver.path)
+      self.message_view.text = "Unable to save the game:\n{}".format(
+        e.strerror or e)
+      return
+    self.director.pop_to_first_scene()
+
   def quit(self):
     self.director.pop_to_first_scene()
 
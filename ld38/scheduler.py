@@ -0,0 +1,100 @@
+"""
+Who gets to act when.
+
+Monsters act when the player does: every time the player takes an action,
+LevelState asks its :py:class:`Scheduler` who's due and calls their
+``on_player_took_action()`` handlers. (That event used to go out to every
+monster through the EventDispatcher, whether it was their turn or not.)
+
+Time is counted in ticks, :py:data:`TICKS_PER_TURN` of them per player turn.
+Every actor has a speed: how many times it acts per turn. A speed 1 monster
+acts every turn, a speed 2 monster acts twice, and a speed 0.5 monster acts
+every other turn. After an actor acts, its next turn is
+``TICKS_PER_TURN / speed`` ticks later.
+
+The actors are kept in a heap by the tick of their next turn, so working
+out who's due only looks at the ones who are. Actors due at the same tick
+act in the order they were added, which for monsters is the order they were
+created in, so the game stays deterministic.
+"""
+import heapq
+
+
+# Lots of small numbers divide this evenly, so speeds like 0.5, 1.5, 2 and 3
+# come out exact
+TICKS_PER_TURN = 60
+
+
+def get_ticks_per_action(speed):
+  """How long an actor with *speed* waits between turns"""
+  return max(1, round(TICKS_PER_TURN / speed))
+
+
+class Scheduler:
+  """
+  A heap of ``(tick, order, actor)`` entries. Actors can be any hashable
+  object.
+
+  Removing or rescheduling an actor doesn't dig its old entry out of the
+  heap. The old entry just stops being the one in ``_entry_by_actor``, and
+  is skipped when it comes up.
+  """
+  def __init__(self):
+    self.now = 0
+    self._heap = []
+    self._entry_by_actor = {}
+    self._next_order = 0
+
+  def __len__(self):
+    return len(self._entry_by_actor)
+
+  def __contains__(self, actor):
+    return actor in self._entry_by_actor
+
+  def add(self, actor, speed):
+    """Add *actor*, which first acts one action from now"""
+    order = self._next_order
+    self._next_order += 1
+    self._push(actor, self.now + get_ticks_per_action(speed), order)
+
+  def remove(self, actor):
+    self._entry_by_actor.pop(actor, None)
+
+  def get_ticks_until_due(self, actor):
+    return self._entry_by_actor[actor][0] - self.now
+
+  def set_ticks_until_due(self, actor, ticks):
+    """Change when *actor* acts next. Used when loading a saved level."""
+    (tick, order, _) = self._entry_by_actor[actor]
+    # Two entries with the same tick and order would compare actors
+    if self.now + ticks != tick:
+      self._push(actor, self.now + ticks, order)
+
+  def take_turn(self, get_speed):
+    """
+    Move time forward one player turn, and yield each actor whose turn has
+    come, in order. Each one is scheduled for its next turn, according to
+    ``get_speed(actor)``, before it's yielded, so fast actors can come up
+    more than once. If the caller stops early, whoever else was due goes
+    first next turn.
+    """
+    self.now += TICKS_PER_TURN
+    heap = self._heap
+    entry_by_actor = self._entry_by_actor
+    while heap and heap[0][0] <= self.now:
+      entry = heap[0]
+      (tick, order, actor) = entry
+      if entry_by_actor.get(actor) is not entry:
+        heapq.heappop(heap)
+        continue
+      # Swapping the old entry for the new one is one trip through the heap
+      # instead of two
+      next_entry = (tick + get_ticks_per_action(get_speed(actor)), order, actor)
+      entry_by_actor[actor] = next_entry
+      heapq.heapreplace(heap, next_entry)
+      yield actor
+
+  def _push(self, actor, tick, order):
+    entry = (tick, order, actor)
+    self._entry_by_actor[actor] = entry
+    heapq.heappush(self._heap, entry)
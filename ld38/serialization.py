@@ -0,0 +1,377 @@
+"""
+Converts generated levels to and from a compact form made only of plain
+Python values and NumPy arrays.
+
+Why not just pickle the tilemap? Two reasons:
+
+* The rows in our DataStores (``monster_types.VERP_1`` and friends) are
+  namedtuple classes created at runtime, so pickle can't find them again.
+  Here they're referred to by ID and looked up on the way back in.
+* A tilemap is thousands of Cell and Point objects. Most of what they store
+  is already in ``tilemap.terrain_ids``, and the rest is sparse, so this form
+  is a lot smaller and faster to move between processes.
+
+The level generator runs in a worker process (see game_state.py), and this is
+what it sends back. Levels the player isn't on are also written to disk in
+this form (see level_store.py).
+"""
+import pickle
+import threading
+import weakref
+import zlib
+from collections import namedtuple
+
+import numpy as np
+from clubsandwich.geom import Point, Rect, Size
+
+from .connectivity import get_connectivity_report
+from .const import (
+  EnumFeature,
+  EnumMonsterMode,
+  item_types,
+  monster_types,
+  room_types,
+)
+from .entity import Item
+from .level_generator import ItemData, MonsterData, Room
+from .level_state import LevelState
+from .projectiles import ThrowPath
+from .tilemap import RogueBasementTileMap
+
+
+# Bump this if the format changes in a way that old data can't be read
+FORMAT_VERSION = 7
+
+
+def _point_to_tuple(point):
+  return (point.x, point.y)
+
+
+def _tuple_to_point(xy):
+  return Point(int(xy[0]), int(xy[1]))
+
+
+def tilemap_to_dict(tilemap, include_spawns=True, terrain_ids=None):
+  """
+  Returns a dict of plain values describing *tilemap*: terrain, features,
+  annotations, rooms, corridors, and points of interest. Undo with
+  :py:func:`tilemap_from_dict`.
+
+  If *include_spawns* is ``False``, leave out where the level generator
+  wanted monsters and items to go. Levels that have already been played
+  don't need it.
+
+  ``tilemap.occupied_cells`` is never saved. It's only for the level
+  generator's own use.
+
+  Pass *terrain_ids* to save that instead of the tilemap's current terrain.
+  Everything else about a tilemap stays the same once it's generated, so
+  that's all you need to save a snapshot of it.
+  """
+  (width, height) = (tilemap.size.width, tilemap.size.height)
+
+  # Lots of cells have the same feature and annotations (every horizontal
+  # wall is just 'horz'), so store each combination once, and an array
+  # pointing at them
+  details = []
+  detail_index_by_value = {}
+  detail_indexes = np.full((width, height), -1, dtype=np.int16)
+  # (Sorted so the same tilemap always comes out the same)
+  for (x, y, feature, annotations) in sorted(
+      tilemap.get_cell_details(), key=lambda details: details[:2]):
+    value = (feature.value if feature else None, tuple(sorted(annotations)))
+    if value not in detail_index_by_value:
+      detail_index_by_value[value] = len(details)
+      details.append(value)
+    detail_indexes[x, y] = detail_index_by_value[value]
+
+  poi = tilemap.points_of_interest
+  return {
+    'version': FORMAT_VERSION,
+    'size': (width, height),
+    'terrain_ids': tilemap.terrain_ids.copy() if terrain_ids is None else terrain_ids,
+    'room_ids': list(tilemap.room_ids),
+    'room_indexes': tilemap.room_indexes.copy(),
+    'details': details,
+    'detail_indexes': detail_indexes,
+    'rooms': [
+      (room.room_id, room.room_type.id, room.difficulty,
+       (room.rect.x, room.rect.y, room.rect.width, room.rect.height),
+       room.floor_mask)
+      for room in tilemap.rooms_by_id.values()],
+    'corridors': [
+      (list(corridor.room_ids),
+       [_point_to_tuple(p) for p in corridor.doors],
+       [_point_to_tuple(p) for p in corridor.cells],
+       corridor.annotation)
+      for corridor in tilemap.room_graph.corridors],
+    'stairs_up': _point_to_tuple(poi['stairs_up']),
+    'stairs_down': _point_to_tuple(poi['stairs_down']),
+    'monsters': [
+      (m.monster_type.id, m.position.x, m.position.y, m.difficulty)
+      for m in poi['monsters']] if include_spawns else None,
+    'items': [
+      (i.item_type.id, i.position.x, i.position.y)
+      for i in poi['items']] if include_spawns else None,
+    'has_connectivity': 'connectivity' in poi,
+  }
+
+
+def tilemap_from_dict(data):
+  """
+  Returns a new RogueBasementTileMap from the output of
+  :py:func:`tilemap_to_dict`.
+  """
+  if data['version'] != FORMAT_VERSION:
+    raise ValueError("Unknown level format version: {!r}".format(data['version']))
+
+  (width, height) = data['size']
+  tilemap = RogueBasementTileMap(Size(width, height))
+  tilemap.set_terrain_ids(data['terrain_ids'])
+  tilemap.mark_base_terrain()
+
+  for (room_id, room_type_id, difficulty, rect, floor_mask) in data['rooms']:
+    room = Room.restore(
+      room_id, room_types[room_type_id], difficulty,
+      Rect(Point(*rect[:2]), Size(*rect[2:])), floor_mask)
+    tilemap.rooms_by_id[room_id] = room
+    tilemap.room_graph.add_room(room)
+  tilemap.set_room_indexes(data['room_ids'], data['room_indexes'])
+
+  for (room_ids, doors, cells, annotation) in data['corridors']:
+    tilemap.room_graph.add_corridor(
+      room_ids,
+      [_tuple_to_point(p) for p in doors],
+      [_tuple_to_point(p) for p in cells],
+      annotation)
+
+  tilemap.set_cell_details(
+    [(None if feature is None else EnumFeature(feature), frozenset(annotations))
+     for (feature, annotations) in data['details']],
+    data['detail_indexes'])
+
+  poi = tilemap.points_of_interest
+  poi['stairs_up'] = _tuple_to_point(data['stairs_up'])
+  poi['stairs_down'] = _tuple_to_point(data['stairs_down'])
+  if data['monsters'] is not None:
+    poi['monsters'] = [
+      MonsterData(monster_types[mt_id], Point(x, y), difficulty)
+      for (mt_id, x, y, difficulty) in data['monsters']]
+  if data['items'] is not None:
+    poi['items'] = [
+      ItemData(item_types[it_id], Point(x, y))
+      for (it_id, x, y) in data['items']]
+  if data['has_connectivity']:
+    poi['connectivity'] = get_connectivity_report(tilemap)
+  return tilemap
+
+
+def dumps_tilemap(tilemap):
+  """Serialize *tilemap* to bytes"""
+  return pickle.dumps(tilemap_to_dict(tilemap), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def loads_tilemap(data):
+  """Inverse of :py:func:`dumps_tilemap`"""
+  return tilemap_from_dict(pickle.loads(data))
+
+
+# Everything about a LevelState that can change during play, copied just
+# enough that changes to the LevelState won't affect it. See
+# snapshot_level_state().
+LevelSnapshot = namedtuple('LevelSnapshot', [
+  'level_id', 'tilemap', 'terrain_changes', 'entities', 'items', 'projectiles',
+  'level_memory'])
+
+
+def _copy_behavior_state(behavior_state):
+  # Behaviors keep ints and lists (of Points, which never change) in here.
+  # Only the lists get modified in place, so copying them is deep enough.
+  return {
+    k: list(v) if isinstance(v, list) else v
+    for (k, v) in behavior_state.items()}
+
+
+def snapshot_level_state(level_state):
+  """
+  Returns a :py:class:`LevelSnapshot` of *level_state*, which can be turned
+  into a dict by :py:func:`level_snapshot_to_dict` later, on any thread, no
+  matter what happens to the level in the meantime.
+
+  This is meant to be cheap enough to do every turn. The expensive parts of a
+  level are the tilemap and its cells, and the only thing about them that
+  changes after generation is terrain (doors open and close). So the
+  snapshot keeps a reference to the tilemap, and only copies the cells whose
+  terrain is different from ``tilemap.base_terrain_ids``.
+  """
+  assert not level_state.event_queue
+
+  tilemap = level_state.tilemap
+  (xs, ys) = np.nonzero(tilemap.terrain_ids != tilemap.base_terrain_ids)
+  terrain_changes = (xs, ys, tilemap.terrain_ids[xs, ys])
+
+  # The player always comes first, even if they're dead and off the map
+  entities = [level_state.player] + [
+    e for e in level_state.entities if e is not level_state.player]
+  projectiles = level_state.projectiles
+  scheduler = level_state.scheduler
+  return LevelSnapshot(
+    level_id=level_state.level_id,
+    tilemap=tilemap,
+    terrain_changes=terrain_changes,
+    entities=[
+      (entity.monster_type.id,
+       _point_to_tuple(entity.position) if entity.position else None,
+       {'hp_max': entity.hp_max, 'strength': entity.strength,
+        'speed': entity.speed},
+       {'hp': entity.hp},
+       entity.mode.value,
+       _copy_behavior_state(entity.behavior_state),
+       [item.item_type.id for item in entity.inventory],
+       # None for entities that don't take turns (or are dead)
+       scheduler.get_ticks_until_due(entity) if entity in scheduler else None)
+      for entity in entities],
+    items=[
+      (point.x, point.y, [item.item_type.id for item in items])
+      for (point, items) in level_state.items_by_position.items() if items],
+    # Everything in Projectiles is a list that gets replaced rather than
+    # changed, so zip() copies plenty
+    projectiles=[
+      (item.item_type.id, _point_to_tuple(position), tuple(path), speed,
+       strength, thrower_type.id, is_waiting)
+      for (position, path, speed, strength, thrower_type, item, is_waiting) in zip(
+        projectiles.positions, projectiles.paths, projectiles.speeds,
+        projectiles.strengths, projectiles.thrower_types, projectiles.items,
+        projectiles.is_waiting)],
+    level_memory=frozenset(level_state.level_memory_cache),
+  )
+
+
+# Tilemap -> output of tilemap_to_dict() minus the terrain, for tilemaps that
+# have been snapshotted. It doesn't change, and the autosaver would otherwise
+# recompute it every turn.
+_static_tilemap_dicts = weakref.WeakKeyDictionary()
+_static_tilemap_dicts_lock = threading.Lock()
+
+
+def _get_static_tilemap_dict(tilemap):
+  with _static_tilemap_dicts_lock:
+    try:
+      return _static_tilemap_dicts[tilemap]
+    except KeyError:
+      data = tilemap_to_dict(tilemap, include_spawns=False, terrain_ids=False)
+      del data['terrain_ids']
+      _static_tilemap_dicts[tilemap] = data
+      return data
+
+
+def level_snapshot_to_dict(snapshot):
+  """
+  Returns a dict of plain values from a :py:class:`LevelSnapshot`, the same
+  as :py:func:`level_state_to_dict`.
+  """
+  tilemap = snapshot.tilemap
+  memory = np.zeros((tilemap.size.width, tilemap.size.height), dtype=bool)
+  if snapshot.level_memory:
+    (xs, ys) = zip(*((p.x, p.y) for p in snapshot.level_memory))
+    memory[list(xs), list(ys)] = True
+
+  terrain_ids = tilemap.base_terrain_ids.copy()
+  (xs, ys, values) = snapshot.terrain_changes
+  terrain_ids[xs, ys] = values
+
+  return {
+    'version': FORMAT_VERSION,
+    'level_id': snapshot.level_id,
+    'tilemap': dict(_get_static_tilemap_dict(tilemap), terrain_ids=terrain_ids),
+    'entities': snapshot.entities,
+    'items': snapshot.items,
+    'projectiles': snapshot.projectiles,
+    'level_memory': memory,
+  }
+
+
+def level_state_to_dict(level_state):
+  """
+  Returns a dict of plain values describing *level_state*: its tilemap, every
+  entity and item as they are right now, and what the player remembers.
+  Undo with :py:func:`level_state_from_dict`.
+
+  Behaviors aren't saved. They're recreated from each entity's monster type,
+  and anything they need to remember is in ``entity.behavior_state``.
+  """
+  return level_snapshot_to_dict(snapshot_level_state(level_state))
+
+
+def level_state_from_dict(data, game_state):
+  """
+  Returns a new LevelState attached to *game_state* from the output of
+  :py:func:`level_state_to_dict`.
+  """
+  if data['version'] != FORMAT_VERSION:
+    raise ValueError("Unknown level format version: {!r}".format(data['version']))
+
+  level_state = LevelState(
+    tilemap_from_dict(data['tilemap']), game_state, populate=False)
+  level_state.level_id = data['level_id']
+
+  for (i, entity_data) in enumerate(data['entities']):
+    (mt_id, position, stats, state, mode, behavior_state, inventory,
+     ticks_until_due) = entity_data
+    position = _tuple_to_point(position) if position else None
+    # *data* may be straight from a LevelSnapshot, which has to stay the way
+    # it is, so the entity gets its own copies of everything
+    entity = level_state.create_entity(
+      monster_types[mt_id], position, _copy_behavior_state(behavior_state))
+    if i == 0:
+      level_state.player = entity
+    # Usually the same as the monster type's
+    entity.hp_max = stats['hp_max']
+    entity.strength = stats['strength']
+    entity.speed = stats['speed']
+    level_state.set_hp(entity, state['hp'])
+    entity.mode = EnumMonsterMode(mode)
+    entity.inventory = [Item(item_types[it_id]) for it_id in inventory]
+    if ticks_until_due is not None:
+      level_state.scheduler.set_ticks_until_due(entity, ticks_until_due)
+    if position is None:
+      # Dead, but still needs to exist. See action_attack().
+      level_state.remove_entity(entity)
+
+  for (x, y, item_type_ids) in data['items']:
+    for it_id in item_type_ids:
+      level_state.drop_item(Item(item_types[it_id]), Point(x, y))
+
+  for projectile_data in data['projectiles']:
+    (it_id, position, path, speed, strength, thrower_type_id,
+     is_waiting) = projectile_data
+    level_state.projectiles.add(
+      Item(item_types[it_id]), _tuple_to_point(position), ThrowPath(*path),
+      speed, strength, monster_types[thrower_type_id], is_waiting)
+
+  level_state.remember(
+    Point(int(x), int(y)) for (x, y) in zip(*np.nonzero(data['level_memory'])))
+  if level_state.player.position:
+    level_state.update_los_cache()
+  else:
+    level_state.los_cache = set()
+  return level_state
+
+
+def dumps_level_state(level_state):
+  """Serialize *level_state* to compressed bytes"""
+  return dumps_level_snapshot(snapshot_level_state(level_state))
+
+
+def dumps_level_snapshot(snapshot):
+  """
+  Serialize a :py:class:`LevelSnapshot` to the same bytes
+  :py:func:`dumps_level_state` would have returned when it was taken
+  """
+  return zlib.compress(pickle.dumps(
+    level_snapshot_to_dict(snapshot), protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def loads_level_state(data, game_state):
+  """Inverse of :py:func:`dumps_level_state`"""
+  return level_state_from_dict(pickle.loads(zlib.decompress(data)), game_state)
@@ -5,13 +5,22 @@ The docs for the superclasses are important:
 
 http://steveasleep.com/clubsandwich/api_tilemap.html
 """
-from collections import defaultdict
-
-from clubsandwich.tilemap import TileMap, Cell
+import numpy as np
+from clubsandwich.tilemap import CellOutOfBoundsError, TileMap, Cell
 
 from .const import (
   terrain_types,
 )
+from .room_graph import RoomGraph
+
+
+# Every terrain type gets a small integer, in the order they appear in
+# terrain.csv, so the whole map's terrain can be stored in one NumPy array.
+TERRAIN_INDEXES = {t: i for i, t in enumerate(terrain_types.items)}
+TERRAINS_BY_INDEX = list(terrain_types.items)
+# Every cell starts out EMPTY. Looking this up in the DataStore for each of
+# thousands of cells is slow, so do it once.
+EMPTY_TERRAIN_INDEX = TERRAIN_INDEXES[terrain_types.EMPTY]
 
 
 class RogueBasementCell(Cell):
@@ -19,34 +28,168 @@ class RogueBasementCell(Cell):
   One cell in the RogueBasementTilemap. It changes the default terrain to
   terrain_types.EMPTY instead of the int ``0``, and adds a *room_id* property
   to tie it to the Room object created by the level generator.
+
+  Terrain and room are really stored in the tilemap's NumPy arrays.
+  Setting ``cell.terrain`` writes the terrain's index into *terrain_ids*, so
+  the array is always up to date without anyone having to remember to update
+  it.
   """
-  def __init__(self, *args, **kwargs):
-    super().__init__(*args, **kwargs)
-    self.room_id = None
-    self.terrain = terrain_types.EMPTY
+  def __init__(self, point, tilemap):
+    # Cell.__init__() sets terrain to 0, which isn't a real terrain, so keep
+    # the array out of it until we've set a real one.
+    self._terrain_ids = None
+    super().__init__(point)
+    self._room_indexes = tilemap.room_indexes
+    self._room_ids = tilemap.room_ids
+    self._terrain = TERRAINS_BY_INDEX[tilemap.terrain_ids[point.x, point.y]]
+    self._terrain_ids = tilemap.terrain_ids
+
+  @property
+  def terrain(self):
+    return self._terrain
+
+  @terrain.setter
+  def terrain(self, value):
+    self._terrain = value
+    if self._terrain_ids is not None:
+      self._terrain_ids[self.point.x, self.point.y] = TERRAIN_INDEXES[value]
+
+  @property
+  def room_id(self):
+    i = self._room_indexes[self.point.x, self.point.y]
+    return None if i < 0 else self._room_ids[i]
 
 
 class RogueBasementTileMap(TileMap):
   """
   Extensions to the base TileMap class:
 
-  * Stores dicts mapping room_id -> Room, and room_id -> [RogueBasementCell].
+  * Stores a dict mapping room_id -> Room
   * Stores a set of cells that have been "used" by the level generator
+  * Stores the RoomGraph the level generator built (see room_graph.py)
+  * Keeps every cell's terrain index (see TERRAIN_INDEXES) in a NumPy array,
+    ``terrain_ids``, indexed ``[x, y]`` just like the cells are. This is how
+    the level generator answers questions about lots of cells at once.
+  * Keeps every cell's room in another array, ``room_indexes``, which holds
+    indexes into the ``room_ids`` list, or -1 for no room.
+
+  Cell objects are only created the first time somebody asks for them. Most
+  of a cell's data lives in the arrays anyway, and a big part of a level is
+  solid rock that nobody ever looks at, so this makes new and loaded levels
+  much cheaper. Don't use ``_cells`` directly; it has ``None`` holes in it.
   """
-  def __init__(self, *args, **kwargs):
-    super().__init__(*args, cell_class=RogueBasementCell, **kwargs)
+  def __init__(self, size):
+    # TileMap.__init__() would create every cell up front, so do its job here
+    # instead.
+    self.size = size
+    self.points_of_interest = {}
+    self._cells = [[None] * size.height for _ in range(size.width)]
+
+    self.terrain_ids = np.full(
+      (size.width, size.height),
+      EMPTY_TERRAIN_INDEX,
+      dtype=np.uint8)
+    # The terrain as it was when the level was finished being generated (or
+    # loaded). Saving only has to look at cells that are different from this.
+    self.base_terrain_ids = self.terrain_ids.copy()
+    self.room_indexes = np.full((size.width, size.height), -1, dtype=np.int16)
+    self.room_ids = []
+    self._room_indexes_by_id = {}
+    # Features and annotations for cells that haven't been created yet; see
+    # set_cell_details()
+    self._details = []
+    self._detail_indexes = None
+
     self.rooms_by_id = {}
-    self.cells_by_room_id = defaultdict(list)
     self.occupied_cells = set()
+    self.room_graph = RoomGraph()
+
+  def cell(self, point):
+    if not self.contains_point(point):
+      raise CellOutOfBoundsError("Cell index out of range: {!r}".format(point))
+    column = self._cells[point.x]
+    cell = column[point.y]
+    if cell is None:
+      cell = column[point.y] = RogueBasementCell(point, self)
+      if self._detail_indexes is not None:
+        i = self._detail_indexes[point.x, point.y]
+        if i >= 0:
+          (feature, annotations) = self._details[i]
+          cell.feature = feature
+          cell.annotations = set(annotations)
+    return cell
+
+  def set_terrain_ids(self, terrain_ids):
+    """
+    Set the terrain of every cell at once from an array shaped like
+    *terrain_ids*. Much faster than setting ``cell.terrain`` one at a time.
+    """
+    self.terrain_ids[:, :] = terrain_ids
+    for column in self._cells:
+      for cell in column:
+        if cell is not None:
+          cell._terrain = TERRAINS_BY_INDEX[self.terrain_ids[cell.point.x, cell.point.y]]
+
+  def mark_base_terrain(self):
+    """Remember the current terrain as ``base_terrain_ids``"""
+    self.base_terrain_ids = self.terrain_ids.copy()
+
+  def set_cell_details(self, details, detail_indexes):
+    """
+    Set the feature and annotations of every cell at once, without creating
+    any cells. *details* is a list of ``(feature, annotations)`` pairs, and
+    *detail_indexes* is an array like ``self.terrain_ids`` with an index into
+    *details* for each cell, or -1 to leave the cell alone. Cells that have
+    already been created are left alone too.
+    """
+    self._details = details
+    self._detail_indexes = detail_indexes
+
+  def get_cell_details(self):
+    """
+    Yields ``(x, y, feature, annotations)`` for every cell that has a feature
+    or any annotations, whether or not the cell has been created.
+    """
+    if self._detail_indexes is not None:
+      (xs, ys) = np.nonzero(self._detail_indexes >= 0)
+      for (x, y) in zip(xs.tolist(), ys.tolist()):
+        if self._cells[x][y] is None:
+          yield (x, y) + tuple(self._details[self._detail_indexes[x, y]])
+    for column in self._cells:
+      for cell in column:
+        if cell is not None and (cell.feature is not None or cell.annotations):
+          yield (cell.point.x, cell.point.y, cell.feature, cell.annotations)
+
+  def _get_room_index(self, room_id):
+    try:
+      return self._room_indexes_by_id[room_id]
+    except KeyError:
+      i = self._room_indexes_by_id[room_id] = len(self.room_ids)
+      self.room_ids.append(room_id)
+      return i
+
+  def set_room_indexes(self, room_ids, room_indexes):
+    """
+    Assign rooms to every cell at once. *room_indexes* is an array like
+    ``self.room_indexes``, but indexing into *room_ids*.
+    """
+    assert not self.room_ids
+    for room_id in room_ids:
+      self._get_room_index(room_id)
+    self.room_indexes[:, :] = room_indexes
 
   def assign_room(self, point, room_id):
-    cell = self.cell(point)
-    assert not cell.room_id
-    cell.room_id = room_id
-    self.cells_by_room_id[room_id].append(cell)
+    assert self.room_indexes[point.x, point.y] < 0
+    self.room_indexes[point.x, point.y] = self._get_room_index(room_id)
+
+  def assign_room_rect(self, rect, room_id):
+    """Same as calling assign_room() for every point in *rect*"""
+    area = self.room_indexes[rect.x:rect.x + rect.width, rect.y:rect.y + rect.height]
+    assert (area < 0).all()
+    area[:, :] = self._get_room_index(room_id)
 
   def get_room(self, point):
-    room_id = self.cell(point).room_id
-    if room_id is None:
+    i = self.room_indexes[point.x, point.y]
+    if i < 0:
       return None
-    return self.rooms_by_id[room_id]
\ No newline at end of file
+    return self.rooms_by_id[self.room_ids[i]]
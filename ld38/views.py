@@ -88,14 +88,14 @@ class StatsView(View):
 
   def update(self):
     self.progress_bar.fraction = (
-      self.game_state.level.player.state['hp'] /
-      self.game_state.level.player.stats['hp_max'])
+      self.game_state.level.player.hp /
+      self.game_state.level.player.hp_max)
     self.inventory_count.text = "  Rocks: {}  ".format(
       len(self.game_state.level.player.inventory))
     # HACK: extra padding so the label clears its background properly when it
     # shrinks
     self.health_label.text = "  Health: {}  ".format(
-      self.game_state.level.player.state['hp'])
+      self.game_state.level.player.hp)
     self.score_label.text = "Score: {}".format(
       self.game_state.score)
 
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+# Plays back a game recorded with RECORD_REPLAY = True (see
+# ld38/game_scene.py), without opening a window, as fast as possible, and says
+# how fast that was. Useful for checking whether a change made the game
+# faster or slower: same replay, same turns, same work.
+#
+#   python replay.py                      # the last recorded game
+#   python replay.py some.rbreplay -n 5   # best of 5 runs
+import argparse
+import multiprocessing
+import sys
+from pathlib import Path
+
+from ld38.replay import (
+  ReplayFileError,
+  get_default_replay_path,
+  load_replay,
+  play_replay,
+)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Play back a Rogue Basement replay")
+  parser.add_argument(
+    'path', nargs='?', type=Path, default=None,
+    help="replay file (default: {})".format(get_default_replay_path()))
+  parser.add_argument(
+    '-n', '--repeat', type=int, default=1,
+    help="play it this many times and report the fastest")
+  args = parser.parse_args()
+
+  try:
+    replay = load_replay(args.path)
+  except ReplayFileError as e:
+    print(e, file=sys.stderr)
+    return 1
+
+  results = [play_replay(replay) for _ in range(args.repeat)]
+  best = max(results, key=lambda result: result.turns_per_second)
+  if best.has_won:
+    outcome = "won"
+  elif best.is_dead:
+    outcome = "died"
+  else:
+    outcome = "still playing"
+  print("{} turns in {:.3f}s: {:.0f} turns/s".format(
+    best.turns, best.seconds, best.turns_per_second))
+  print("Score {}, depth {}, {}".format(best.score, best.depth, outcome))
+  return 0
+
+
+if __name__ == '__main__':
+  multiprocessing.freeze_support()
+  sys.exit(main())
@@ -4,6 +4,11 @@
 # give you a general idea of how things work. You should steal these ideas,
 # or learn from my mistakes, as the case may be. :-)
 
+# Levels are generated in a worker process (see ld38/game_state.py). When the
+# game is bundled with PyInstaller, multiprocessing needs a little help
+# starting that process.
+import multiprocessing
+
 # clubsandwich is my roguelike library that wraps bearlibterminal. We need it
 # for some basics which I'll get to in a moment.
 from clubsandwich.blt.nice_terminal import terminal
@@ -48,6 +53,7 @@ class GameLoop(DirectorLoop):
 
 
 if __name__ == '__main__':
+  multiprocessing.freeze_support()
   # Every frame (as fast as possible up to 80fps), check for input, handle it
   # if it exists, and then draw the screen. Quit if the active scene says so.
   GameLoop().run()